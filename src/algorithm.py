@@ -1,49 +1,126 @@
+import os
+import time
+import zlib
+import threading
+import heapq
 import numpy as np
 from dataset import DataSource
 from math_util import *
 from workers import Worker
-import matplotlib.pyplot as plt
-import copy
+from engine import OptKGEngine, IncrementalOptKGEngine
+from sharded import ShardedOptKGEngine
+from evaluation import Evaluator
+
+
+# the array-backed engines that can replace the reference loop of run_Opt_KG
+_ENGINES = {'vectorized': OptKGEngine, 'incremental': IncrementalOptKGEngine, 'sharded': ShardedOptKGEngine}
+# the engines working on self._instances_ramain
+_LOOP_ENGINES = ('loop', 'pruned')
+# added to the perfect worker bound of the 'pruned' engine to cover the rounding errors
+_BOUND_SLACK = 1e-12
+# version of the checkpoint format written by Algorithm.save_checkpoint
+_CHECKPOINT_VERSION = 1
+
+
 class Algorithm:
     """
     The algorithms presented in the paper 'Statistical Decision Making for Optimal Budget Allocation in Crowd Labeling'
     The class is named as Algorithm since I at first want to code all possible algorithms in the paper so that comparison
     experiments can be done
-    Currently this class only contains one algorithm:Opt-KG
+    Currently this class only contains one algorithm:Opt-KG, the other allocation policies are in policies.py
     """
 
-    def __init__(self, instances, workers, budget):
+    def __init__(self, instances, workers, budget, engine='loop', batch_size=1, profile=None):
         """
         Initialize the experiment for the given instances, the workers and the buduget T
         :param instances: the given dataset (of type DataSource)
         :param workers: the workers (of type Worker)
         :param budget: the given experiment budget T
+        :param engine: 'loop' for the reference Python loop, 'pruned' for the loop skipping the instances whose reward
+                       bound cannot beat the best pair, 'vectorized' for the array-backed OptKGEngine,
+                       'incremental' for the IncrementalOptKGEngine, 'sharded' for the ShardedOptKGEngine selecting
+                       in up to sharded.NUM_SHARDS processes. All of them return the same H_T
+        :param batch_size: number k of pairs selected per round, the k best pairs under the parameters at the start
+                           of the round with at most one pair per instance, then the k labels are acquired and the
+                           parameters updated one after another. k > 1 needs an array-backed engine
+        :param profile: a profiling.RunProfile recording the time of each phase of the steps, None to not profile
         """
+        if engine not in _LOOP_ENGINES and engine not in _ENGINES:
+            raise ValueError('unknown engine: ' + str(engine))
+        if batch_size < 1 or (batch_size > 1 and engine in _LOOP_ENGINES):
+            raise ValueError('batch_size > 1 needs an array-backed engine')
         self._instances = instances
         self._workers = workers
         self._param_of_all_insts = self._instances.get_all_inst_prior_distribution()
         self._param_of_all_wrks = self._workers.get_all_worker_prior()
         self._T = budget
-        # traversing available instances
+        # traversing available instances, {orig_id: {label position: worker id}} in the order of the dataset
         self._instances_ramain = {}
+        # the response read for each label position
+        self._pair_response = []
         # The list containing all the indexes of the instances whose a > b
         self._positive_set = []
         # instances that have been chosen
         self._chosen_inst = []
+        # bitmap of the chosen instances, in the order of the rows of the instances' PosteriorStore
+        self._inst_store = self._instances.get_posterior_store()
+        self._chosen_mask = np.zeros(len(self._inst_store), dtype=bool)
+        # the Evaluator of the run, built at the first evaluation
+        self._evaluator = None
+        # which implementation of the selection step is used
+        self._engine = engine
+        # number of pairs selected per round
+        self._batch_size = batch_size
+        # number of pairs left in self._instances_ramain
+        self._pairs_remain = 0
+        # the heap of the 'pruned' engine, entries (-key, position in the dataset, version, orig_id, inst_wrk) where
+        # key is the exact max reward of the instance with its best pair inst_wrk, or an upper bound of it and None
+        self._bound_heap = []
+        # the version of the live entry of each remaining instance, the other entries are stale
+        self._bound_version = {}
+        # the position of each instance in the dataset and the instances of each worker
+        self._inst_pos = {}
+        self._wrk_insts = {}
+        # number of pairs whose reward was computed by the last _select_inst_wrk_pruned
+        self._pairs_scanned = 0
+        self._profile = profile
+        # the engine object of a started run with an array-backed engine
+        self._engine_obj = None
+        # whether the steps have started
+        self._started = False
+        # the pairs of the current batch that are not acquired yet
+        self._pending_pairs = []
+        # the remaining label positions read from a checkpoint, used when the steps start
+        self._resume_remain = None
+        # the thread writing the last checkpoint
+        self._checkpoint_writer = None
 
 
     def _initialize_instances_remain(self):
         """
-        Initialize the self._instances_remain dictionary
+        Initialize the self._instances_remain dictionary from the CrowdData of the instances.
+        Each remaining (instance, worker) pair is an entry {label position: worker id} of the instance's dict, python
+        dicts keep their order when entries are popped, so removing a pair is O(1) and the traversing order stays
+        the order of the dataset
         :return: None
         """
-        self._instances_ramain = copy.deepcopy(self._instances.get_dataset())
-
-        # b = self._instances.get_dataset()
-        #
-        # assert id(self._instances_ramain) != id(b)
-        #
-        # exit(1)
+        data = self._instances.get_crowd_data()
+        wrk_ids = data.get_worker_id_list()
+        inst_ptr = data.get_inst_ptr().tolist()
+        wrk_idx = data.get_worker_index().tolist()
+        response = data.get_response().tolist()
+        self._instances_ramain = {}
+        self._pair_response = response
+        for i, key_ in enumerate(data.get_inst_id_list()):
+            remain = {}
+            first_response = {}
+            for pos in range(inst_ptr[i], inst_ptr[i + 1]):
+                wrk = wrk_ids[wrk_idx[pos]]
+                remain[pos] = wrk
+                # a worker labeling the instance twice is always read at his first label
+                response[pos] = first_response.setdefault(wrk, response[pos])
+            self._instances_ramain[key_] = remain
+        self._pairs_remain = len(response)
 
 
     def _select_inst_wrk(self):
@@ -51,8 +128,10 @@ class Algorithm:
         Select the next instance to label and the corresponding next worker
         :return: the selected instance and the worker
         """
-        prior_params_ab = self._param_of_all_insts
-        prior_params_cd = self._param_of_all_wrks
+        # the parameters as lists of floats indexed by the rows of the posterior stores, cheaper to read per pair
+        # than the {ID: [p, q]} views
+        prior_params_ab, inst_index = self._store_rows(self._inst_store)
+        prior_params_cd, wrk_index = self._store_rows(self._workers.get_posterior_store())
         # initialize the R_max and the dic whose form is {R_max:[instance id, worker id]}
         R_max = None
         inst_wrk = []
@@ -60,11 +139,11 @@ class Algorithm:
 
         assert len(self._instances_ramain) > 0
         for key_ in self._instances_ramain.keys():
-            wrks_list = self._instances_ramain[key_]['workers']
+            wrks_list = self._instances_ramain[key_]
             assert len(wrks_list) > 0
-            for wrk_pos, wrk in enumerate(wrks_list):
-                [c, d] = prior_params_cd[wrk]
-                [a, b] = prior_params_ab[key_]
+            [a, b] = prior_params_ab[inst_index[key_]]
+            for wrk_pos, wrk in wrks_list.items():
+                [c, d] = prior_params_cd[wrk_index[wrk]]
                 # calculate a_tilde and b_tilde
                 new_a, new_b = new_a_b(a, b, c, d, 1)
                 # calculate I(a,b) and I(a_tilde, b_tilde)
@@ -95,6 +174,135 @@ class Algorithm:
         return R_max, inst_wrk
 
 
+    @staticmethod
+    def _store_rows(store):
+        """
+        :return: the parameters of a PosteriorStore as a list of [p, q] lists, and its {ID: index} dict
+        """
+        return store.params().tolist(), store.index_map()
+
+
+    def _reward(self, a, b, c, d):
+        """
+        The reward of asking worker (c, d) to label instance (a, b), computed as in _select_inst_wrk
+        :return: R
+        """
+        new_a, new_b = new_a_b(a, b, c, d, 1)
+        I_ab = Beta_ab_cdf(a, b)
+        R1 = h_function(Beta_ab_cdf(new_a, new_b)) - h_function(I_ab)
+        new_a, new_b = new_a_b(a, b, c, d, 0)
+        R2 = h_function(Beta_ab_cdf(new_a, new_b)) - h_function(I_ab)
+        if R1 >= R2:
+            return R1
+        return R2
+
+
+    def _reward_bound(self, task_id):
+        """
+        Upper bound of the reward of any pair of the instance, for any worker.
+        A reward is h(I_new) - h(I(a, b)) with h(I_new) <= 1, so it is at most 1 - h(I(a, b)). A perfect worker
+        (c / (c + d) going to 1 or 0) moves the instance to (a + 1, b) or (a, b + 1), and no worker moves I further
+        away from 0.5 than that, which was checked over a wide range of a, b, c, d up to rounding errors of order
+        1e-16, covered by the slack. The bound does not depend on the worker, so it only changes when the instance
+        is labeled. The bound holds for I(a, b) computed by the kernel, a quantized beta cache loses it
+        :return: the bound
+        """
+        [a, b] = self._param_of_all_insts[task_id]
+        h_ab = h_function(Beta_ab_cdf(a, b))
+        h_perfect = max(h_function(Beta_ab_cdf(a + 1, b)), h_function(Beta_ab_cdf(a, b + 1)))
+
+        return min(1 - h_ab, h_perfect - h_ab + _BOUND_SLACK)
+
+
+    def _push_bound(self, task_id):
+        """
+        Give the instance a new live entry keyed by its reward bound, the former entry becomes stale
+        :return: None
+        """
+        version = self._bound_version.get(task_id, 0) + 1
+        self._bound_version[task_id] = version
+        heapq.heappush(self._bound_heap, (-self._reward_bound(task_id), self._inst_pos[task_id], version, task_id, None))
+
+
+    def _initialize_bound_index(self):
+        """
+        Build the heap of the 'pruned' engine from self._instances_ramain, every instance starts with its bound
+        :return: None
+        """
+        self._bound_heap = []
+        self._bound_version = {}
+        self._inst_pos = {}
+        self._wrk_insts = {}
+        for pos, (key_, wrks_list) in enumerate(self._instances_ramain.items()):
+            self._inst_pos[key_] = pos
+            self._bound_version[key_] = 0
+            self._bound_heap.append((-self._reward_bound(key_), pos, 0, key_, None))
+            for wrk in wrks_list.values():
+                self._wrk_insts.setdefault(wrk, {})[key_] = None
+        heapq.heapify(self._bound_heap)
+
+
+    def _update_bound_index(self, inst_wrk):
+        """
+        After a label, the chosen instance and all the instances of the chosen worker fall back to their bound,
+        an instance without pair left is dropped
+        :param inst_wrk: the chosen instance and worker
+        :return: None
+        """
+        [task_id, wrk_id, wrk_pos] = inst_wrk
+        touched = {task_id: None}
+        touched.update(self._wrk_insts[wrk_id])
+        for key_ in touched:
+            if key_ in self._instances_ramain:
+                self._push_bound(key_)
+            else:
+                self._bound_version.pop(key_, None)
+        # drop the stale entries once they outnumber the live ones
+        if len(self._bound_heap) > 4 * len(self._bound_version) + 64:
+            self._bound_heap = [entry for entry in self._bound_heap if self._bound_version.get(entry[3]) == entry[2]]
+            heapq.heapify(self._bound_heap)
+
+
+    def _select_inst_wrk_pruned(self):
+        """
+        Same choice as _select_inst_wrk, ties included, scanning only the instances whose bound can beat the best
+        pair. The heap is ordered by decreasing key, then position in the dataset. While the top entry is a bound,
+        the pairs of its instance are scored and the entry is replaced by the exact max reward of the instance.
+        Once the top entry is exact, every other instance has a max reward below it, or equal to it at a later
+        position, so its pair is the first max of the traversing order. The instances whose bound stays under the
+        max reward are never scored
+        :return: the selected instance and the worker
+        """
+        prior_params_ab = self._param_of_all_insts
+        prior_params_cd, wrk_index = self._store_rows(self._workers.get_posterior_store())
+        heap = self._bound_heap
+        scanned = 0
+
+        assert len(self._bound_version) > 0
+        while True:
+            neg_key, pos, version, key_, inst_wrk = heap[0]
+            if self._bound_version.get(key_) != version:
+                heapq.heappop(heap)
+                continue
+            if inst_wrk is not None:
+                break
+            # the max reward of the instance, the first max in the order of its pairs
+            R_max = None
+            [a, b] = prior_params_ab[key_]
+            for wrk_pos, wrk in self._instances_ramain[key_].items():
+                [c, d] = prior_params_cd[wrk_index[wrk]]
+                R = self._reward(a, b, c, d)
+                if R_max is None or R > R_max:
+                    R_max = R
+                    inst_wrk = [key_, wrk, wrk_pos]
+            scanned = scanned + len(self._instances_ramain[key_])
+            self._bound_version[key_] = version + 1
+            heapq.heapreplace(heap, (-R_max, pos, version + 1, key_, inst_wrk))
+        self._pairs_scanned = scanned
+
+        return -neg_key, inst_wrk
+
+
     def _acquire_label_Update_posterior(self, R_max, inst_wrk):
         """
         After we decide the next instance and the worker, we aquire the label z of the i-th instance from the j-th worker
@@ -106,8 +314,7 @@ class Algorithm:
             [task_id, wrk_id, wrk_pos] = inst_wrk
         except:
             print()
-        response_idx = self._instances.get_dataset()[task_id]['workers'].index(wrk_id)
-        z_real = self._instances.get_dataset()[task_id]['response'][response_idx]
+        z_real = self._pair_response[wrk_pos]
         [a, b] = self._param_of_all_insts[task_id]
         [c, d] = self._param_of_all_wrks[wrk_id]
         self._instances.update_parameter_a_b(task_id, a, b, c, d, z_real)
@@ -119,57 +326,313 @@ class Algorithm:
     def _pop_out_chosen_wrk_response(self,task_id, idx):
         """
         :parameter: task_id, the selected instance at stage T
-                    idx: the worker's index in the list
-        Pop the chosen worker and his response from the instances_remain dictionary
+                    idx: the label position of the chosen worker
+        Pop the chosen worker from the instances_remain dictionary
         :return: None
         """
-        # delete the chosen worker and his response from the instance_remain set
-        self._instances_ramain[task_id]['workers'].pop(idx)
-        self._instances_ramain[task_id]['response'].pop(idx)
+        # delete the chosen worker from the instance_remain set
+        self._instances_ramain[task_id].pop(idx)
+        self._pairs_remain = self._pairs_remain - 1
         # add the task_id to self._chosen_inst
-        self._chosen_inst.append(task_id)
+        self._mark_chosen(task_id)
         # judge whether all the workers of instance task_id have been chosen
         # if yes, pop out the instance from the instances_remain dataset
-        if len(self._instances_ramain[task_id]['workers']) == 0:
+        if len(self._instances_ramain[task_id]) == 0:
             self._instances_ramain.pop(task_id)
 
 
+    def _mark_chosen(self, task_id):
+        """
+        Record that the instance was chosen at this step
+        :return: None
+        """
+        self._chosen_inst.append(task_id)
+        self._chosen_mask[self._inst_store.index(task_id)] = True
+
+
     def _output_set_Ht(self):
         """
         The Budget T has run out and we output the positive set H_T,the content of
-        the Ht is the orig_id of the instances whose a > b
+        the Ht is the orig_id of the instances whose a > b. Both sets are in the order of the dataset
         :return: Ht, Ht_complement
         """
-        all_prior_params_ab = self._param_of_all_insts
-        chosen_inst_unique = list(set(self._chosen_inst))
-        Ht = []
-        Ht_complement = []
-        for key_ in chosen_inst_unique:
-            [a, b] = all_prior_params_ab[key_]
-            if a >= b:
-                Ht.append(key_)
-            else:
-                Ht_complement.append(key_)
+        inst_ids = self._inst_store.ids()
+        chosen = np.flatnonzero(self._chosen_mask)
+        params = self._inst_store.params()[chosen]
+        positive = params[:, 0] >= params[:, 1]
+        Ht = [inst_ids[i] for i in chosen[positive].tolist()]
+        Ht_complement = [inst_ids[i] for i in chosen[~positive].tolist()]
 
         return Ht, Ht_complement
 
 
-    def run_Opt_KG(self):
+    def evaluate(self):
+        """
+        Score the current positive set against the gold answers, at any step of the run, see Evaluator.evaluate
+        :return: dict with accuracy, precision, recall and the confusion counts
+        """
+        if self._evaluator is None:
+            self._evaluator = Evaluator(self._instances)
+
+        return self._evaluator.evaluate(self._chosen_mask, self._inst_store.params())
+
+
+    def _remove_pairs(self, positions):
+        """
+        Remove label positions from self._instances_ramain without acquiring their labels, used to resume a run
+        :param positions: the label positions
+        :return: None
+        """
+        data = self._instances.get_crowd_data()
+        inst_ids = data.get_inst_id_list()
+        inst_of_pos = np.searchsorted(data.get_inst_ptr(), positions, side='right') - 1
+        for pos, i in zip(positions.tolist(), inst_of_pos.tolist()):
+            key_ = inst_ids[i]
+            self._instances_ramain[key_].pop(pos)
+            self._pairs_remain = self._pairs_remain - 1
+            if len(self._instances_ramain[key_]) == 0:
+                self._instances_ramain.pop(key_)
+
+
+    def _remaining_mask(self):
+        """
+        :return: bool array with one entry per label position, True for the pairs not chosen yet
+        """
+        if self._resume_remain is not None:
+            return self._resume_remain.copy()
+        num_labels = len(self._instances.get_crowd_data().get_response())
+        if not self._started:
+            return np.ones(num_labels, dtype=bool)
+        if self._engine_obj is not None:
+            return self._engine_obj.remaining_mask()
+        mask = np.zeros(num_labels, dtype=bool)
+        for wrks_list in self._instances_ramain.values():
+            mask[list(wrks_list.keys())] = True
+
+        return mask
+
+
+    def _checkpoint_state(self):
+        """
+        Copy the state of the run. The posteriors, the remaining pairs, the chosen instances and the pending pairs of
+        the batch are all the state there is, the engines rebuild the rest from them
+        :return: dict of arrays
+        """
+        inst_store = self._instances.get_posterior_store()
+        return {'version': np.array(_CHECKPOINT_VERSION),
+                'fingerprint': np.array(_data_fingerprint(self._instances.get_crowd_data()), dtype=np.uint32),
+                'batch_size': np.array(self._batch_size),
+                'inst_params': inst_store.params().copy(),
+                'wrk_params': self._workers.get_posterior_store().params().copy(),
+                'chosen': np.array([inst_store.index(key_) for key_ in self._chosen_inst], dtype=np.int64),
+                'pending': np.array(self._pending_pairs, dtype=np.int64),
+                'remain': np.packbits(self._remaining_mask()),
+                'num_labels': np.array(len(self._instances.get_crowd_data().get_response()))}
+
+
+    def save_checkpoint(self, path, background=False):
+        """
+        Write the state of the run to a binary file, resume it with load_checkpoint. The state is copied first and
+        the file is replaced only once it is complete, so a process dying while writing leaves the former checkpoint
+        :param path: the checkpoint file
+        :param background: True to write the file in a thread and go on with the run meanwhile
+        :return: None
+        """
+        state = self._checkpoint_state()
+        self.wait_checkpoint()
+        if background:
+            self._checkpoint_writer = threading.Thread(target=_write_checkpoint, args=(path, state))
+            self._checkpoint_writer.start()
+        else:
+            _write_checkpoint(path, state)
+
+
+    def wait_checkpoint(self):
+        """
+        Wait for the checkpoint written in the background, if any
+        :return: None
+        """
+        if self._checkpoint_writer is not None:
+            self._checkpoint_writer.join()
+            self._checkpoint_writer = None
+
+
+    def load_checkpoint(self, path):
+        """
+        Resume the run saved by save_checkpoint, before any step is taken. The instances and the workers must be built
+        from the same data, the run then goes on exactly as the saved one would have, with any engine
+        :param path: the checkpoint file
+        :return: the number of steps already taken
+        """
+        if self._started:
+            raise ValueError('a checkpoint is loaded before the run starts')
+        with np.load(path) as f:
+            state = {key_: f[key_] for key_ in f.files}
+        if int(state['version']) != _CHECKPOINT_VERSION:
+            raise ValueError('unknown checkpoint version: ' + str(int(state['version'])))
+        if int(state['fingerprint']) != _data_fingerprint(self._instances.get_crowd_data()):
+            raise ValueError('the checkpoint was written for another dataset')
+        if int(state['batch_size']) != self._batch_size:
+            raise ValueError('the checkpoint was written with batch_size ' + str(int(state['batch_size'])))
+        inst_store = self._instances.get_posterior_store()
+        inst_store.restore((len(state['inst_params']), state['inst_params']))
+        self._workers.get_posterior_store().restore((len(state['wrk_params']), state['wrk_params']))
+        inst_ids = inst_store.ids()
+        self._chosen_inst = [inst_ids[i] for i in state['chosen'].tolist()]
+        self._chosen_mask[:] = False
+        self._chosen_mask[state['chosen']] = True
+        self._pending_pairs = state['pending'].tolist()
+        self._resume_remain = np.unpackbits(state['remain'], count=int(state['num_labels'])).astype(bool)
+
+        return len(self._chosen_inst)
+
+
+    def _phase(self, name, fn, *args):
+        """
+        Call fn(*args), timed as the given phase when the run is profiled
+        :return: what fn returns
+        """
+        if self._profile is None:
+            return fn(*args)
+        start = time.perf_counter()
+        result = fn(*args)
+        self._profile.add_phase(name, time.perf_counter() - start)
+
+        return result
+
+
+    def _Opt_KG_steps(self):
+        """
+        Generator running Opt-KG one step at a time, it yields after every acquired label and never stops by itself,
+        the caller decides how many steps are taken. Closing the generator closes the engine of an array-backed run
+        :return: None
+        """
+        profile = self._profile
+        if profile is not None:
+            profile.start()
+        remain = self._resume_remain
+        self._started = True
+        if self._engine in _ENGINES:
+            engine = _ENGINES[self._engine](self._instances, self._workers)
+            if remain is not None:
+                engine.deactivate(np.flatnonzero(~remain))
+            self._engine_obj = engine
+            self._resume_remain = None
+            try:
+                while True:
+                    if len(self._pending_pairs) == 0:
+                        if self._batch_size == 1:
+                            R_max, pair = self._phase('select', engine.select)
+                            self._pending_pairs = [pair]
+                        else:
+                            R_max, pairs = self._phase('select', engine.select_batch, self._batch_size)
+                            self._pending_pairs = pairs.tolist()
+                    pair = self._pending_pairs.pop(0)
+                    task_id = self._phase('update', engine.acquire_label_update_posterior, pair)
+                    self._phase('bookkeeping', self._mark_chosen, task_id)
+                    if profile is not None:
+                        profile.end_step(engine.pop_pairs_scanned())
+                    yield
+            finally:
+                engine.close()
+        self._initialize_instances_remain()
+        if remain is not None:
+            self._remove_pairs(np.flatnonzero(~remain))
+        self._resume_remain = None
+        if self._engine == 'pruned':
+            self._initialize_bound_index()
+            while True:
+                R_max, inst_wrk = self._phase('select', self._select_inst_wrk_pruned)
+                task_id, idx = self._phase('update', self._acquire_label_Update_posterior, R_max, inst_wrk)
+                self._phase('bookkeeping', self._pop_out_chosen_wrk_response, task_id, idx)
+                self._phase('index', self._update_bound_index, inst_wrk)
+                if profile is not None:
+                    profile.end_step(self._pairs_scanned)
+                yield
+        while True:
+            pairs_scanned = self._pairs_remain
+            R_max, inst_wrk = self._phase('select', self._select_inst_wrk)
+            task_id, idx = self._phase('update', self._acquire_label_Update_posterior, R_max, inst_wrk)
+            self._phase('bookkeeping', self._pop_out_chosen_wrk_response, task_id, idx)
+            if profile is not None:
+                profile.end_step(pairs_scanned)
+            yield
+
+
+    def run_Opt_KG(self, checkpoint=None, checkpoint_every=1000):
         """
         Whole algorithm Opt-KG
+        :param checkpoint: file to checkpoint the run to, None for no checkpoint. If the file exists the run resumes
+                           from it, the checkpoints are written in the background every checkpoint_every steps and
+                           once more when the budget is spent
+        :param checkpoint_every: number of steps between two checkpoints
         :return: Positive set H_T
         """
         Budget_T = self._T
-        self._initialize_instances_remain()
-        for t in range(0, Budget_T):
-            R_max, inst_wrk = self._select_inst_wrk()
-            task_id, idx = self._acquire_label_Update_posterior(R_max, inst_wrk)
-            self._pop_out_chosen_wrk_response(task_id, idx)
+        if checkpoint is not None and os.path.exists(checkpoint):
+            self.load_checkpoint(checkpoint)
+        steps = self._Opt_KG_steps()
+        try:
+            for t in range(len(self._chosen_inst), Budget_T):
+                next(steps)
+                if checkpoint is not None and (t + 1) % checkpoint_every == 0:
+                    self.save_checkpoint(checkpoint, background=True)
+        finally:
+            steps.close()
+        if checkpoint is not None:
+            self.save_checkpoint(checkpoint)
 
         H_T = self._output_set_Ht()
 
         return H_T
 
+
+    def sweep_Opt_KG(self, budgets=None):
+        """
+        Run Opt-KG once up to the largest budget and snapshot the result at every budget on the way.
+        Opt-KG is deterministic, so the run with budget T is a prefix of the run with any larger budget and the
+        snapshots are the same as separate runs of run_Opt_KG with each budget. The engine is closed after the last
+        budget, or when the generator is closed
+        :param budgets: the budgets to snapshot at, default is [T] given to the constructor
+        :return: generator of (budget, H_T, H_T_complement, accuracy), in increasing order of budget
+        """
+        if budgets is None:
+            budgets = [self._T]
+        steps = self._Opt_KG_steps()
+        t = len(self._chosen_inst)
+        try:
+            for T_ in sorted(set(budgets)):
+                while t < T_:
+                    next(steps)
+                    t = t + 1
+                H_T, H_complement = self._output_set_Ht()
+                yield T_, H_T, H_complement, self.evaluate()['accuracy']
+        finally:
+            steps.close()
+
+
+def _data_fingerprint(crowd_data):
+    """
+    :return: CRC32 of the labels of a CrowdData, to check that a checkpoint belongs to the data
+    """
+    crc = 0
+    for array in (crowd_data.get_inst_ptr(), crowd_data.get_worker_index(), crowd_data.get_response()):
+        crc = zlib.crc32(np.ascontiguousarray(array, dtype=np.int64).tobytes(), crc)
+
+    return crc
+
+
+def _write_checkpoint(path, state):
+    """
+    Write the arrays of a checkpoint to a temporary file and move it to path
+    :return: None
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **state)
+    os.replace(tmp_path, path)
+
+
 # test the Algorithm.py
 def _test_algorithm():
     filename = 'rte.standardized.tsv'
@@ -183,5 +646,24 @@ def _test_algorithm():
     print(H_T)
 
 
+# stop a run half way with a checkpoint and resume it, the result must be the one of the uninterrupted run
+def _test_checkpoint():
+    import tempfile
+    filename = 'rte.standardized.tsv'
+    Budget = 301
+    for engine, batch_size in (('loop', 1), ('pruned', 1), ('incremental', 1), ('vectorized', 4)):
+        H_T = Algorithm(DataSource(filename, 1, 1), Worker(filename, 4, 1), Budget, engine=engine,
+                        batch_size=batch_size).run_Opt_KG()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'checkpoint.npz')
+            Algorithm(DataSource(filename, 1, 1), Worker(filename, 4, 1), Budget // 2, engine=engine,
+                      batch_size=batch_size).run_Opt_KG(checkpoint=path)
+            resumed = Algorithm(DataSource(filename, 1, 1), Worker(filename, 4, 1), Budget, engine=engine,
+                                batch_size=batch_size)
+            assert resumed.run_Opt_KG(checkpoint=path) == H_T
+        print(engine, batch_size, len(H_T[0]), len(H_T[1]))
+
+
 if __name__ == "__main__":
-    _test_algorithm()
\ No newline at end of file
+    _test_algorithm()
+    _test_checkpoint()
\ No newline at end of file
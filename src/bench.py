@@ -0,0 +1,159 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import numpy as np
+import math_util
+from dataset import DataSource
+from workers import Worker
+from algorithm import Algorithm, _ENGINES
+from loader import load_crowd_data
+from simulator import write_crowd_file
+from kernels import Beta_ab_cdf_batch, kg_reward, apply_labels, kernel_backend, warm_up
+
+
+def generate_dataset(path, num_inst, num_workers, labels_per_inst, seed=0):
+    """
+    Write a synthetic crowd labeling file in the RTE schema (orig_id, !amt_worker_ids, response, gold) with
+    simulator.write_crowd_file. Every instance gets labels_per_inst distinct workers drawn at random, each worker
+    answers the gold label with his own accuracy drawn from Beta(4, 1)
+    :param path: the file to write
+    :return: None
+    """
+    write_crowd_file(path, num_inst, num_workers, min(labels_per_inst, num_workers), seed=seed)
+
+
+def _time(fn, repeat):
+    """
+    Call fn repeat times
+    :return: the best and the mean time of one call in seconds
+    """
+    times = []
+    for r in range(0, repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times), sum(times) / len(times)
+
+
+def _new_algorithm(crowd_data, budget, engine):
+    return Algorithm(DataSource(crowd_data, 1, 1), Worker(crowd_data, 4, 1), budget, engine=engine)
+
+
+def bench_size(crowd_data, size, budgets, engines, repeat):
+    """
+    Run all the benchmarks on one dataset
+    :return: list of result dicts
+    """
+    results = []
+
+    def record(name, fn, calls=1, engine=None, budget=None):
+        best, mean = _time(fn, repeat)
+        results.append({'name': name, 'engine': engine, 'size': size, 'budget': budget, 'calls': calls,
+                        'best': best, 'mean': mean, 'best_per_call': best / calls})
+        print(results[-1])
+
+    rng = np.random.RandomState(1)
+    n = 10000
+    a, b, c, d = rng.uniform(0.5, 30, (4, n))
+    # I(a,b): scalar with a cold and a warm cache, and batched
+    def beta_cold():
+        math_util.configure_beta_cache()
+        for k in range(0, n):
+            math_util.Beta_ab_cdf(a[k], b[k])
+    def beta_warm():
+        for k in range(0, n):
+            math_util.Beta_ab_cdf(a[k], b[k])
+    record('Beta_ab_cdf_cold', beta_cold, n)
+    record('Beta_ab_cdf_warm', beta_warm, n)
+    record('Beta_ab_cdf_batch', lambda: Beta_ab_cdf_batch(a, b), n)
+    record('kg_reward', lambda: kg_reward(a, b, c, d), n)
+    # posterior updates: the scalar DataSource / Worker path and the in place array kernel
+    sourcedata = DataSource(crowd_data, 1, 1)
+    workers = Worker(crowd_data, 4, 1)
+    inst_ids = sourcedata.get_inst_id_list()
+    wrk_ids = workers.get_worker_id_list()
+    m = min(1000, len(inst_ids))
+    def update_scalar():
+        for k in range(0, m):
+            task_id = inst_ids[k]
+            wrk_id = wrk_ids[k % len(wrk_ids)]
+            [ak, bk] = sourcedata.get_all_inst_prior_distribution()[task_id]
+            [ck, dk] = workers.get_all_worker_prior()[wrk_id]
+            sourcedata.update_parameter_a_b(task_id, ak, bk, ck, dk, k % 2)
+            workers.update_parameter_c_d(wrk_id, ak, bk, ck, dk, k % 2)
+    record('update_scalar', update_scalar, m)
+    pa, pb = np.ones(m), np.ones(m)
+    pc, pd = np.full(m, 4.0), np.ones(m)
+    idx = np.arange(m)
+    record('update_array', lambda: apply_labels(pa, pb, pc, pd, idx, idx, idx % 2), m)
+    # one selection step on the initial state
+    Opt_KG = _new_algorithm(crowd_data, 0, 'loop')
+    Opt_KG._initialize_instances_remain()
+    record('select', Opt_KG._select_inst_wrk, engine='loop')
+    if 'pruned' in engines:
+        Opt_KG._initialize_bound_index()
+        record('select', Opt_KG._select_inst_wrk_pruned, engine='pruned')
+    for engine in engines:
+        if engine not in _ENGINES:
+            continue
+        engine_ = _ENGINES[engine](DataSource(crowd_data, 1, 1), Worker(crowd_data, 4, 1))
+        record('select', engine_.select, engine=engine)
+    # whole runs
+    for engine in engines:
+        for budget in budgets:
+            record('run_Opt_KG', lambda: _new_algorithm(crowd_data, budget, engine).run_Opt_KG(),
+                   engine=engine, budget=budget)
+
+    return results
+
+
+def run_benchmarks(sizes, budgets, engines, repeat=3, labels_per_inst=10, output=None):
+    """
+    Benchmark the kernels and the engines on synthetic datasets
+    :param sizes: list of numbers of instances, the number of workers is a fifth of it
+    :param budgets: budgets of the whole runs, the ones larger than the number of labels are skipped
+    :param engines: engines of Algorithm to benchmark, 'loop', 'pruned' and/or the array-backed ones
+    :param repeat: number of repetitions of each measure
+    :param output: JSON file to write the report to
+    :return: the report dict
+    """
+    # compile the kernels first, the timings do not count the compilation
+    warm_up()
+    report = {'meta': {'python': platform.python_version(), 'numpy': np.__version__,
+                       'kernel_backend': kernel_backend(), 'platform': platform.platform(),
+                       'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'repeat': repeat,
+                       'labels_per_inst': labels_per_inst},
+              'results': []}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in sizes:
+            path = os.path.join(tmp_dir, 'synthetic_' + str(size) + '.tsv')
+            generate_dataset(path, size, max(size // 5, labels_per_inst), labels_per_inst)
+            crowd_data = load_crowd_data(path)
+            size_budgets = [T_ for T_ in budgets if T_ <= size * labels_per_inst]
+            report['results'].extend(bench_size(crowd_data, size, size_budgets, engines, repeat))
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=1)
+
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark Opt-KG selection, updates and whole runs')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[200, 800, 3200])
+    parser.add_argument('--budgets', type=int, nargs='+', default=[100, 1000])
+    # the reference loop is slow, add it with --engines loop pruned vectorized incremental
+    parser.add_argument('--engines', nargs='+', default=['vectorized', 'incremental'])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--labels-per-inst', type=int, default=10)
+    parser.add_argument('--output', default='bench_results.json')
+    args = parser.parse_args(argv)
+    run_benchmarks(args.sizes, args.budgets, args.engines, args.repeat, args.labels_per_inst, args.output)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,193 @@
+import os
+from collections import OrderedDict
+import numpy as np
+from kernels import BACKEND, Beta_ab_cdf_scalar
+
+
+# header of the on-disk store: magic, format version, the quantum the keys were made with and the kernel backend
+# the values were computed with
+_MAGIC = b'IABC'
+_VERSION = 2
+_HEADER = np.dtype([('magic', 'S4'), ('version', '<u4'), ('quantum', '<f8'), ('backend', 'S8')])
+# one record per cached value: the key (a, b) and I(a, b)
+_RECORD = np.dtype([('a', '<f8'), ('b', '<f8'), ('I', '<f8')])
+
+
+class BetaCache:
+    """
+    A cache of I(a,b) = Pr( theta > 0.5 | theta ~ Beta(a, b) ).
+
+    The cache is an LRU dictionary bounded to `capacity` entries. The keys can optionally be quantized: a and b are
+    rounded to a grid of step `quantum` and the value is computed at the grid point, so nearby (a, b) share one
+    entry. For a, b >= 1 the gradient of I has L1 norm below 0.7 (measured on a log grid up to 5000), so the
+    quantization error is at most 0.35 * quantum there.
+    The cache can be backed by a binary file that is only read at the first lookup and to which new entries are
+    appended by flush(), instead of rewriting the whole file. A file written with another format version, another
+    quantum or another kernel backend is ignored and replaced.
+    """
+
+    def __init__(self, capacity=None, quantum=None, path=None):
+        """
+        :param capacity: max number of entries kept in memory, None for no bound
+        :param quantum: grid step of the quantized keys, None for exact keys
+        :param path: file of the on-disk store, None for a memory only cache
+        """
+        if capacity is not None and capacity <= 0:
+            raise ValueError('capacity must be positive')
+        if quantum is not None and quantum <= 0:
+            raise ValueError('quantum must be positive')
+        self._capacity = capacity
+        self._quantum = quantum
+        self._path = path
+        self._entries = OrderedDict()
+        # entries computed since the last flush, waiting to be appended to the file
+        self._pending = []
+        self._loaded = path is None
+        # whether the file has to be created (or replaced) with a new header at the next flush
+        self._rewrite = False
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def _key(self, a, b):
+        """
+        :return: the key of (a, b), the grid indexes when quantizing
+        """
+        if self._quantum is None:
+            return float(a), float(b)
+        return float(round(a / self._quantum)), float(round(b / self._quantum))
+
+
+    def _compute(self, key):
+        """
+        :return: I(a, b) at the point represented by the key
+        """
+        a, b = key
+        if self._quantum is not None:
+            a = a * self._quantum
+            b = b * self._quantum
+        return Beta_ab_cdf_scalar(a, b)
+
+
+    def _insert(self, key, value):
+        """
+        Insert an entry as the most recently used one and evict the least recently used entries over capacity
+        :return: None
+        """
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if self._capacity is not None:
+            while len(self._entries) > self._capacity:
+                self._entries.popitem(last=False)
+                self.evictions = self.evictions + 1
+
+
+    def get(self, a, b):
+        """
+        :param a: beta distribution parameter a
+        :param b: beta distribution parameter b
+        :return: Pr( theta > 0.5 | theta ~ Beta(a, b) )
+        """
+        if not self._loaded:
+            self.load()
+        key = self._key(a, b)
+        value = self._entries.get(key)
+        if value is not None:
+            self.hits = self.hits + 1
+            self._entries.move_to_end(key)
+            return value
+        self.misses = self.misses + 1
+        value = self._compute(key)
+        self._insert(key, value)
+        if self._path is not None:
+            self._pending.append((key[0], key[1], value))
+        return value
+
+
+    def load(self):
+        """
+        Read the on-disk store into memory, keeping the most recent entries when there are more than the capacity
+        :return: None
+        """
+        self._loaded = True
+        if self._path is None:
+            return
+        if not os.path.exists(self._path) or os.path.getsize(self._path) < _HEADER.itemsize:
+            self._rewrite = True
+            return
+        header = np.fromfile(self._path, dtype=_HEADER, count=1)[0]
+        quantum = 0.0 if self._quantum is None else self._quantum
+        if header['magic'] != _MAGIC or header['version'] != _VERSION or header['quantum'] != quantum \
+                or header['backend'] != BACKEND.encode():
+            self._rewrite = True
+            return
+        records = np.fromfile(self._path, dtype=_RECORD, offset=_HEADER.itemsize)
+        if self._capacity is not None:
+            records = records[-self._capacity:]
+        for a, b, value in records.tolist():
+            self._insert((a, b), value)
+
+
+    def flush(self):
+        """
+        Append the entries computed since the last flush to the on-disk store
+        :return: None
+        """
+        if self._path is None:
+            return
+        if not self._loaded:
+            self.load()
+        if self._rewrite:
+            header = np.zeros(1, dtype=_HEADER)
+            header['magic'] = _MAGIC
+            header['version'] = _VERSION
+            header['quantum'] = 0.0 if self._quantum is None else self._quantum
+            header['backend'] = BACKEND.encode()
+            with open(self._path, 'wb') as f:
+                header.tofile(f)
+            self._rewrite = False
+        if len(self._pending) > 0:
+            with open(self._path, 'ab') as f:
+                np.array(self._pending, dtype=_RECORD).tofile(f)
+            self._pending = []
+
+
+    def compact(self):
+        """
+        Rewrite the on-disk store with only the entries currently in memory, dropping evicted and repeated entries
+        :return: None
+        """
+        if self._path is None:
+            return
+        if not self._loaded:
+            self.load()
+        self._rewrite = True
+        self._pending = [(key[0], key[1], value) for key, value in self._entries.items()]
+        self.flush()
+
+
+    def stats(self):
+        """
+        :return: a dict with the hit and miss counters, the number of evictions and the current size
+        """
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups > 0 else 0.0,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'capacity': self._capacity}
+
+
+def _test_beta_cache():
+    cache = BetaCache(capacity=2)
+    I_ab = cache.get(1, 1)
+    assert cache.get(1.0, 1.0) == I_ab == 0.5
+    cache.get(2, 3)
+    cache.get(3, 2)
+    print(cache.stats())
+
+
+if __name__ == '__main__':
+    _test_beta_cache()
@@ -1,7 +1,8 @@
 import numpy as np
-import pandas as pd
-import matplotlib as plt
 from random import choice
+from loader import CrowdData, load_crowd_data
+from kernels import posterior_ab
+from posterior_store import PosteriorStore
 
 
 
@@ -12,18 +13,31 @@ class DataSource:
     Each instance in the data set is uniquely distinguished by the "orig_id", and has a prior distribution
     at any stage t ( 0<= t <= T-1)
     """
-    def __init__(self, filename, a0, b0):
-        self._path = "D:\\task allocation\\noisy-oracle-master\\noisy-oracle-master\\data\\all_collected_data\\"
-        self._filepath = self._path + filename
-        self._dataset = {}
+    def __init__(self, filename, a0, b0, data_path=None):
+        """
+
+        :param filename: dataset filename(format ending should not be forgotten), or a CrowdData already loaded by
+                         load_crowd_data so that the file is only read once for DataSource and Worker
+        :param a0: the initial a0 parameter for all the instances
+        :param b0: the initial b0 parameter for all the instances
+        :param data_path: the directory of the file, default is loader.DATA_PATH
+        """
+        if isinstance(filename, CrowdData):
+            self._data = filename
+        else:
+            self._data = load_crowd_data(filename, data_path)
+        # the dict form of the data set, only built by get_dataset for the code reading it
+        self._dataset = None
+        # the list of the instance ids, the IDs of the PosteriorStore
         self._inst_id = []
-        # read the data from the given file
-        self._read_data_from_file()
+        # the gold answers of the instances added by add_instance
+        self._added_gold = {}
         # parameters of prior distributions for instances and for workers
         self._a0 = a0
         self._b0 = b0
-        # parameters of prior distributions for instances
-        self._inst_prior = {}
+        # parameters of prior distributions for instances, a PosteriorStore and the {orig_id: [a, b]} view over it
+        self._inst_store = None
+        self._inst_prior = None
         # initialize each instance's prior distribution
         self._initialize_prior_distribution()
 
@@ -31,22 +45,27 @@ class DataSource:
 
     def _read_data_from_file(self):
         """
-        Create the data set from the given file so that self._dataset is a dict of instances, where each item
-        in the dict is of the form {"orig_id":content}
+        Create the data set from the loaded CrowdData so that self._dataset is a dict of instances, where each item
+        in the dict is of the form {"orig_id":content}. It holds every label as Python objects, so it is only built
+        by get_dataset, the engines read the arrays of the CrowdData
         :return: None
         """
-        df = pd.read_csv(self._filepath, sep='	')
-        task_worker = df.groupby('orig_id')['!amt_worker_ids'].apply(lambda x: x.tolist()).to_dict()
-        task_response = df.groupby('orig_id')['response'].apply(lambda x: x.tolist()).to_dict()
-        task_gold = df.groupby('orig_id')['gold'].apply(lambda x: x.unique()).to_dict()
-
-        for key_, value_ in task_worker.items():
+        self._dataset = {}
+        wrk_ids = self._data.get_worker_id_list()
+        inst_ptr = self._data.get_inst_ptr().tolist()
+        wrk_idx = self._data.get_worker_index().tolist()
+        response = self._data.get_response().tolist()
+        gold = self._data.get_gold().tolist()
+
+        for i, key_ in enumerate(self._data.get_inst_id_list()):
+            lo, hi = inst_ptr[i], inst_ptr[i + 1]
             content = {}
-            content['workers'] = value_
-            content['response'] = task_response[key_]
-            content['gold'] = task_gold[key_]
+            content['workers'] = [wrk_ids[j] for j in wrk_idx[lo:hi]]
+            content['response'] = response[lo:hi]
+            content['gold'] = gold[i]
             self._dataset[key_] = content
-            self._inst_id.append(key_)
+        for key_ in self._inst_id[len(self._dataset):]:
+            self._dataset[key_] = {'workers': [], 'response': [], 'gold': self._added_gold[key_]}
 
 
     def _initialize_prior_distribution(self):
@@ -56,9 +75,9 @@ class DataSource:
         and b-i is 1.
         :return:
         """
-        for task_idx in self._dataset.keys():
-            inst_prior_ = [self._a0, self._b0]
-            self._inst_prior[task_idx] = inst_prior_
+        self._inst_store = PosteriorStore(self._data.get_inst_id_list(), self._a0, self._b0)
+        self._inst_id = self._inst_store.ids()
+        self._inst_prior = self._inst_store.view()
 
 
 
@@ -76,23 +95,29 @@ class DataSource:
         # for key_, value_ in worker.items():
         #     c = value_[0]
         #     d = value_[1]
-        if z == 1:
-            exp_theta = a *((a + 1) * c + b * d) / ((a + b + 1) * (a * c + b * d))
-            exp_theta_square = a *(a + 1) * ((a + 2) * c + b * d) / ((a + b + 1) * (a + b + 2) * (a * c + b * d))
-        elif z == 0:         # the RTE dataset have two label results : 0 and 1, different from the paper
-            exp_theta = a * (b * c + (a + 1) * d) / ((a + b + 1) * (b * c + a * d))
-            exp_theta_square = a * (a + 1) * (b * c + (a + 2) * d) / ((a + b + 1) * (a + b + 2) * (b * c + a * d))
-        else:
-            raise ValueError
-
-        new_a = exp_theta * (exp_theta - exp_theta_square) / (exp_theta_square - np.square(exp_theta))
-        new_b = (1 - exp_theta) * (exp_theta - exp_theta_square)/(exp_theta_square - np.square(exp_theta))
+        new_a, new_b = posterior_ab(a, b, c, d, z)
 
         # for key_ in inst.keys():
-        self._inst_prior[task_id] = [new_a, new_b]
+        self._inst_store.set(task_id, new_a, new_b)
             # return self._inst_prior[key_]
 
 
+    def add_instance(self, inst_id, gold=None):
+        """
+        Add an instance that is not in the data file, with the initial prior Beta(a0, b0). The instance has no
+        labels in the dataset and is not part of the CrowdData
+        :param inst_id: "orig_id" of the new instance
+        :param gold: the gold answer if known
+        :return: None
+        """
+        if inst_id in self._inst_prior:
+            return
+        self._added_gold[inst_id] = gold
+        self._inst_store.add(inst_id)
+        if self._dataset is not None:
+            self._dataset[inst_id] = {'workers': [], 'response': [], 'gold': gold}
+
+
     def get_inst_prior_parameter(self, inst_id):
         """
         Get the parameters of the instance prior distribution
@@ -108,12 +133,34 @@ class DataSource:
 
     def get_dataset(self):
         """
-        Return the dataset of the dict form
+        Return the dataset of the dict form, built at the first call
         :return: self._dataset
         """
+        if self._dataset is None:
+            self._read_data_from_file()
         return self._dataset
 
 
+    def get_gold(self):
+        """
+        Return the gold answers of the instances in the order of get_inst_id_list, -1 for the instances added
+        without one
+        :return: int array
+        """
+        added = [self._added_gold[key_] for key_ in self._inst_id[len(self._data.get_gold()):]]
+        added = np.array([-1 if g is None else g for g in added], dtype=np.int64)
+
+        return np.concatenate((np.asarray(self._data.get_gold(), dtype=np.int64), added))
+
+
+    def get_crowd_data(self):
+        """
+        Return the columnar CrowdData the dataset was built from
+        :return: self._data
+        """
+        return self._data
+
+
     def get_inst_id_list(self):
         """
         Get a list that contains all the ids of the instances
@@ -124,24 +171,29 @@ class DataSource:
 
     def get_all_inst_prior_distribution(self):
         """
-        Return the current dict of the parameters of instances prior distribution
+        Return the current parameters of instances prior distribution, as a read-only {orig_id: [a, b]} mapping
+        that follows the updates
         :return: self._inst_prior
         """
         return self._inst_prior
 
 
+    def get_posterior_store(self):
+        """
+        Return the PosteriorStore of the parameters of the instances, for snapshots and array access
+        :return: self._inst_store
+        """
+        return self._inst_store
+
+
     def get_H_star(self):
         """
         Return the set H* and H*c i.e. the set containing the instances whose gold answer are 1
         :return:H_star, H_star_c
         """
-        H_star = []
-        H_star_c = []
-        for key_, value_ in self._dataset.items():
-            if value_['gold'] == 1:
-                H_star.append(key_)
-            if value_['gold'] == 0:
-                H_star_c.append(key_)
+        gold = self.get_gold()
+        H_star = [self._inst_id[i] for i in np.flatnonzero(gold == 1).tolist()]
+        H_star_c = [self._inst_id[i] for i in np.flatnonzero(gold == 0).tolist()]
 
         return H_star, H_star_c
 
@@ -0,0 +1,709 @@
+import numpy as np
+from kernels import kg_reward, apply_labels
+
+
+def _pair_table(instances, workers):
+    """
+    Gather the current parameters and the flat pair table of the engines. The instances and the workers get dense
+    integer ids, the rows of their posterior stores, and every (instance, worker, response) triple of the dataset is
+    a row of the pair table, in the order Algorithm._select_inst_wrk traverses them, so the pairs of an instance are
+    contiguous. The table is built from the arrays of the CrowdData, without the dict form of the dataset
+    :param instances: the given dataset (of type DataSource)
+    :param workers: the workers (of type Worker)
+    :return: list of the instance ids, list of the worker ids, (N, 2) array of a, b, (W, 2) array of c, d and the
+             arrays of the instance index, the worker index and the response of each pair
+    """
+    data = instances.get_crowd_data()
+    inst_store = instances.get_posterior_store()
+    wrk_store = workers.get_posterior_store()
+    inst_ids = list(inst_store.ids())
+    wrk_ids = list(wrk_store.ids())
+    # current parameters of the prior distributions
+    ab = inst_store.params().copy()
+    cd = wrk_store.params().copy()
+    inst_ptr = np.asarray(data.get_inst_ptr(), dtype=np.int64)
+    pair_inst = np.repeat(np.arange(inst_ptr.size - 1), np.diff(inst_ptr))
+    pair_wrk = np.asarray(data.get_worker_index(), dtype=np.int64)
+    pair_resp = np.array(data.get_response(), dtype=np.int64)
+    crowd_wrk_ids = data.get_worker_id_list()
+    if wrk_ids[:len(crowd_wrk_ids)] != list(crowd_wrk_ids):
+        # the workers were not built from this CrowdData, map the worker codes to their rows
+        pair_wrk = np.array([wrk_store.index(wrk_id) for wrk_id in crowd_wrk_ids], dtype=np.int64)[pair_wrk]
+    # the reference loop reads the label of the first occurrence of the worker, keep it that way
+    key = pair_inst * len(wrk_ids) + pair_wrk
+    order = np.argsort(key, kind='stable')
+    repeated = key[order][1:] == key[order][:-1]
+    if repeated.any():
+        first = np.maximum.accumulate(np.where(np.concatenate(([False], repeated)), 0, np.arange(key.size)))
+        pair_resp[order] = pair_resp[order[first]]
+
+    return inst_ids, wrk_ids, ab, cd, pair_inst, pair_wrk, pair_resp
+
+
+def _adjacency(pair_inst, pair_wrk, num_inst, num_wrk):
+    """
+    The pairs touching each instance and each worker
+    :return: the pairs of instance i are [inst_ptr[i], inst_ptr[i + 1]) as they are contiguous in the pair table,
+             the pairs of worker j are wrk_pairs[wrk_ptr[j]:wrk_ptr[j + 1]]
+    """
+    inst_ptr = np.searchsorted(pair_inst, np.arange(num_inst + 1))
+    wrk_pairs = np.argsort(pair_wrk, kind='stable')
+    wrk_ptr = np.searchsorted(pair_wrk[wrk_pairs], np.arange(num_wrk + 1))
+
+    return inst_ptr, wrk_pairs, wrk_ptr
+
+
+def _touched_pairs(inst_ptr, wrk_pairs, wrk_ptr, active, i, j):
+    """
+    The remaining pairs of instance i and of worker j, the pairs whose reward changes when a label of i by j is
+    acquired
+    :param inst_ptr, wrk_pairs, wrk_ptr: the adjacency of the pair table, as returned by _adjacency
+    :param active: bool array, True for the remaining pairs
+    :return: array of indexes in the pair table
+    """
+    touched = np.concatenate((np.arange(inst_ptr[i], inst_ptr[i + 1]), wrk_pairs[wrk_ptr[j]:wrk_ptr[j + 1]]))
+
+    return touched[active[touched]]
+
+
+class OptKGEngine:
+    """
+    An array-backed version of the Opt-KG selection step.
+
+    The parameters a, b of the instances and c, d of the workers are kept in flat float arrays indexed by dense
+    integers, and every (instance, worker, response) triple of the dataset is a row of a flat pair table.
+    The pairs are stored in the same order as Algorithm._select_inst_wrk traverses them and removed pairs are only
+    masked out, so np.argmax picks exactly the pair the reference loop would pick.
+    """
+
+    def __init__(self, instances, workers):
+        """
+        Build the arrays from the given instances and workers
+        :param instances: the given dataset (of type DataSource)
+        :param workers: the workers (of type Worker)
+        """
+        self._instances = instances
+        self._workers = workers
+        (self._inst_ids, self._wrk_ids, ab, cd, self._pair_inst, self._pair_wrk,
+         self._pair_resp) = _pair_table(instances, workers)
+        self._wrk_index = {wrk_id: j for j, wrk_id in enumerate(self._wrk_ids)}
+        self._a = ab[:, 0].copy()
+        self._b = ab[:, 1].copy()
+        self._c = cd[:, 0].copy()
+        self._d = cd[:, 1].copy()
+        # the pairs that have not been chosen yet
+        self._active = np.ones(self._pair_inst.size, dtype=bool)
+        # number of pair rewards computed since the last call of pop_pairs_scanned
+        self._scanned = 0
+
+
+    def _remaining_rewards(self):
+        """
+        :return: the indexes of the remaining pairs in the pair table and their rewards
+        """
+        remain = np.flatnonzero(self._active)
+
+        return remain, self.rewards(remain)
+
+
+    def rewards(self, pairs):
+        """
+        The Opt-KG rewards of the given pairs under the current parameters, counted as scanned
+        :param pairs: array of indexes in the pair table
+        :return: array of rewards
+        """
+        i = self._pair_inst[pairs]
+        j = self._pair_wrk[pairs]
+        self._scanned = self._scanned + len(pairs)
+
+        return kg_reward(self._a[i], self._b[i], self._c[j], self._d[j])
+
+
+    def select(self):
+        """
+        Select the next pair to label, ties are broken in favor of the first pair in traversing order
+        :return: the max reward and the index of the selected pair in the pair table
+        """
+        remain, R = self._remaining_rewards()
+        assert remain.size > 0
+        best = int(np.argmax(R))
+
+        return R[best], int(remain[best])
+
+
+    def select_batch(self, k):
+        """
+        Select the k pairs with the largest rewards under the current parameters, at most one pair per instance.
+        The pairs are ranked by decreasing reward, ties in traversing order, so the first pair is the one select()
+        returns and the first m pairs of a batch of k are the batch of m
+        :param k: the number of pairs to select
+        :return: array of the rewards and array of the indexes of the selected pairs, fewer than k when less than k
+                 instances have remaining pairs
+        """
+        remain, R = self._remaining_rewards()
+        assert remain.size > 0
+        order = np.lexsort((remain, -R))
+        # the first pair of every instance in the ranking is its best pair
+        _, first = np.unique(self._pair_inst[remain[order]], return_index=True)
+        best = order[np.sort(first)[:k]]
+
+        return R[best], remain[best]
+
+
+    def acquire_label_update_posterior(self, pair):
+        """
+        Acquire the label of the chosen pair, update a, b, c, d through DataSource and Worker and mirror the new
+        values into the arrays. The pair is then removed from the remaining pairs.
+        :param pair: the index of the chosen pair in the pair table
+        :return: the orig_id of the chosen instance
+        """
+        i = self._pair_inst[pair]
+        j = self._pair_wrk[pair]
+        task_id = self._inst_ids[i]
+        wrk_id = self._wrk_ids[j]
+        z_real = self._pair_resp[pair]
+        a, b = self._a[i], self._b[i]
+        c, d = self._c[j], self._d[j]
+        self._instances.update_parameter_a_b(task_id, a, b, c, d, z_real)
+        self._workers.update_parameter_c_d(wrk_id, a, b, c, d, z_real)
+        [self._a[i], self._b[i]] = self._instances.get_all_inst_prior_distribution()[task_id]
+        [self._c[j], self._d[j]] = self._workers.get_all_worker_prior()[wrk_id]
+        self._active[pair] = False
+
+        return task_id
+
+
+    def remaining_mask(self):
+        """
+        :return: bool array with one entry per pair of the pair table, True for the pairs not chosen yet
+        """
+        return self._active.copy()
+
+
+    def deactivate(self, pairs):
+        """
+        Remove pairs from the remaining pairs without acquiring their labels, used to resume a run
+        :param pairs: array of indexes in the pair table
+        :return: None
+        """
+        self._active[pairs] = False
+
+
+    def pop_pairs_scanned(self):
+        """
+        :return: the number of pair rewards computed since the last call
+        """
+        scanned = self._scanned
+        self._scanned = 0
+
+        return scanned
+
+
+    def close(self):
+        """
+        Release what the engine holds outside of this process, nothing for this engine, see ShardedOptKGEngine
+        :return: None
+        """
+        pass
+
+
+class TournamentTree:
+    """
+    An indexed max structure over a number of slots.
+
+    Every internal node keeps the winner of its two children, the left child wins ties, so the root is always the
+    first slot holding the max value, which is the same tie-breaking as np.argmax and the reference loop.
+    Changing k slots replays only the matches on their paths to the root, O(k log n). The slots beyond the given
+    values hold -inf, and resize() makes room for more slots
+    """
+
+    def __init__(self, values, capacity=0):
+        """
+        Build the tree over the given values
+        :param values: initial value of each slot
+        :param capacity: minimum number of slots
+        """
+        n = len(values)
+        self._size = 1 << max(0, (max(n, capacity) - 1).bit_length())
+        # value and winning slot of each node, the leaves are stored at [size, 2 * size)
+        self._val = np.full(2 * self._size, -np.inf)
+        self._val[self._size:self._size + n] = values
+        self._win = np.zeros(2 * self._size, dtype=np.int64)
+        self._win[self._size:] = np.arange(self._size)
+        lo = self._size // 2
+        while lo >= 1:
+            self._play(np.arange(lo, 2 * lo))
+            lo = lo // 2
+
+
+    def _play(self, nodes):
+        """
+        Replay the matches of the given internal nodes from their children
+        :param nodes: array of internal node indexes, all on the same level
+        :return: None
+        """
+        left = 2 * nodes
+        right = left + 1
+        take_left = self._val[left] >= self._val[right]
+        self._val[nodes] = np.where(take_left, self._val[left], self._val[right])
+        self._win[nodes] = np.where(take_left, self._win[left], self._win[right])
+
+
+    def update(self, slots, values):
+        """
+        Set new values for the given slots and fix their paths to the root
+        :param slots: array of slot indexes
+        :param values: array of new values
+        :return: None
+        """
+        nodes = np.asarray(slots, dtype=np.int64) + self._size
+        if nodes.size == 0:
+            return
+        self._val[nodes] = values
+        nodes = np.unique(nodes // 2)
+        while nodes[0] >= 1:
+            self._play(nodes)
+            nodes = np.unique(nodes // 2)
+
+
+    def top(self):
+        """
+        :return: the first slot holding the max value and the value
+        """
+        return int(self._win[1]), self._val[1]
+
+
+    def values(self):
+        """
+        :return: view of the values of all the slots
+        """
+        return self._val[self._size:]
+
+
+    def resize(self, capacity):
+        """
+        Make room for at least capacity slots, the size is doubled so that growing one slot at a time costs O(1)
+        amortized matches per slot
+        :param capacity: minimum number of slots
+        :return: None
+        """
+        if capacity <= self._size:
+            return
+        self.__init__(self.values().copy(), max(capacity, 2 * self._size))
+
+
+class AdjacencyOptKGEngine(OptKGEngine):
+    """
+    OptKGEngine that also knows the pairs of every instance and every worker.
+
+    A label only changes the parameters of one instance and one worker, so only the rewards of the pairs touching
+    them change. The engine finds those pairs and rescores them in a TournamentTree kept by its user, which is how
+    IncrementalOptKGEngine and the Opt-KG policy of policies.py keep their rewards
+    """
+
+    def __init__(self, instances, workers):
+        """
+        Build the arrays and the adjacency of the pair table
+        :param instances: the given dataset (of type DataSource)
+        :param workers: the workers (of type Worker)
+        """
+        OptKGEngine.__init__(self, instances, workers)
+        self._inst_ptr, self._wrk_pairs, self._wrk_ptr = _adjacency(self._pair_inst, self._pair_wrk,
+                                                                    len(self._inst_ids), len(self._wrk_ids))
+
+
+    def touched_pairs(self, pair):
+        """
+        :return: array of the remaining pairs sharing the instance or the worker of the pair, the pairs whose reward
+                 changes when the label of the pair is acquired
+        """
+        return _touched_pairs(self._inst_ptr, self._wrk_pairs, self._wrk_ptr, self._active, self._pair_inst[pair],
+                              self._pair_wrk[pair])
+
+
+    def rescore_touched(self, tree, pair):
+        """
+        Take the pair whose label was just acquired out of a TournamentTree of rewards and rescore the pairs it touched
+        :param tree: TournamentTree with one slot per pair of the pair table
+        :param pair: the index of the chosen pair in the pair table
+        :return: None
+        """
+        tree.update([pair], [-np.inf])
+        touched = self.touched_pairs(pair)
+        tree.update(touched, self.rewards(touched))
+
+
+class IncrementalOptKGEngine(AdjacencyOptKGEngine):
+    """
+    OptKGEngine that keeps the reward of every remaining pair between steps.
+
+    After each step only the pairs touching the updated instance or worker are rescored, and the max is kept in a
+    TournamentTree. The per-step cost grows with the degree of the touched instance and worker instead of with the
+    size of the dataset.
+    """
+
+    def __init__(self, instances, workers):
+        """
+        Build the arrays, the adjacency of the pair table and the reward tree
+        :param instances: the given dataset (of type DataSource)
+        :param workers: the workers (of type Worker)
+        """
+        AdjacencyOptKGEngine.__init__(self, instances, workers)
+        self._tree = TournamentTree(self.rewards(np.arange(self._pair_inst.size)))
+
+
+    def select(self):
+        """
+        Select the next pair to label, ties are broken in favor of the first pair in traversing order
+        :return: the max reward and the index of the selected pair in the pair table
+        """
+        pair, R_max = self._tree.top()
+        assert self._active[pair]
+
+        return R_max, pair
+
+
+    def _remaining_rewards(self):
+        """
+        :return: the indexes of the remaining pairs in the pair table and their kept rewards
+        """
+        remain = np.flatnonzero(self._active)
+
+        return remain, self._tree.values()[remain]
+
+
+    def acquire_label_update_posterior(self, pair):
+        """
+        Same as OptKGEngine.acquire_label_update_posterior, then rescore the pairs of the updated instance and worker
+        :param pair: the index of the chosen pair in the pair table
+        :return: the orig_id of the chosen instance
+        """
+        task_id = OptKGEngine.acquire_label_update_posterior(self, pair)
+        self.rescore_touched(self._tree, pair)
+
+        return task_id
+
+
+    def deactivate(self, pairs):
+        """
+        Same as OptKGEngine.deactivate, the removed pairs leave the reward tree
+        :param pairs: array of indexes in the pair table
+        :return: None
+        """
+        OptKGEngine.deactivate(self, pairs)
+        self._tree.update(pairs, np.full(len(pairs), -np.inf))
+
+
+class TournamentForest:
+    """
+    R TournamentTrees over the same number of slots, one per row of 2D arrays, so that one call updates slots of many
+    trees. The tie-breaking is the one of TournamentTree, the root of every row is the first slot holding its max
+    """
+
+    def __init__(self, values):
+        """
+        Build the trees over the given values
+        :param values: (R, n) array, row r holds the initial value of each slot of tree r
+        """
+        R, n = values.shape
+        self._size = 1 << max(0, (n - 1).bit_length())
+        # value and winning slot of each node, the leaves of a row are stored at [size, 2 * size)
+        self._val = np.full((R, 2 * self._size), -np.inf)
+        self._val[:, self._size:self._size + n] = values
+        self._win = np.zeros((R, 2 * self._size), dtype=np.int64)
+        self._win[:, self._size:] = np.arange(self._size)
+        lo = self._size // 2
+        while lo >= 1:
+            take_left = self._val[:, 2 * lo:4 * lo:2] >= self._val[:, 2 * lo + 1:4 * lo:2]
+            self._val[:, lo:2 * lo] = np.where(take_left, self._val[:, 2 * lo:4 * lo:2],
+                                               self._val[:, 2 * lo + 1:4 * lo:2])
+            self._win[:, lo:2 * lo] = np.where(take_left, self._win[:, 2 * lo:4 * lo:2],
+                                               self._win[:, 2 * lo + 1:4 * lo:2])
+            lo = lo // 2
+
+
+    def update(self, rows, slots, values):
+        """
+        Set new values for the given slots of the given trees and fix their paths to the roots
+        :param rows: array of tree indexes
+        :param slots: array of slot indexes
+        :param values: array of new values
+        :return: None
+        """
+        if len(slots) == 0:
+            return
+        width = 2 * self._size
+        val = self._val.reshape(-1)
+        win = self._win.reshape(-1)
+        # flat index of a node: row * width + node, all the nodes of one pass are on the same level. A node listed
+        # twice replays the same match twice, which is cheaper than removing the duplicates at every level
+        nodes = np.asarray(slots, dtype=np.int64) + self._size
+        keys = np.asarray(rows, dtype=np.int64) * width + nodes
+        val[keys] = values
+        while nodes[0] > 1:
+            keys = keys - nodes + nodes // 2
+            nodes = nodes // 2
+            left = keys + nodes
+            take_left = val[left] >= val[left + 1]
+            val[keys] = np.where(take_left, val[left], val[left + 1])
+            win[keys] = np.where(take_left, win[left], win[left + 1])
+
+
+    def top(self):
+        """
+        :return: array of the first slot holding the max value of each tree and array of the max values
+        """
+        return self._win[:, 1].copy(), self._val[:, 1].copy()
+
+
+def _ragged_arange(starts, lens):
+    """
+    :return: the owner k of each position and the concatenation of the ranges [starts[k], starts[k] + lens[k])
+    """
+    owner = np.repeat(np.arange(lens.size), lens)
+    offsets = np.cumsum(lens) - lens
+
+    return owner, np.arange(owner.size) - offsets[owner] + starts[owner]
+
+
+class LockstepOptKGEngine:
+    """
+    R independent replicates of Opt-KG advanced in lockstep.
+
+    The replicates share the pair table, and their a, b and c, d are the rows of (R, N) and (R, W) arrays. Every step
+    selects the best remaining pair of each replicate from a TournamentForest, applies the R labels with one
+    vectorized update and rescores the pairs touching the R updated instances and workers in one kg_reward call, so
+    the per-step overhead of Python is paid once for all the replicates, as in IncrementalOptKGEngine.
+    With mode 'replay' the labels are the labels of the dataset, every replicate then makes exactly the choices of
+    the other engines, which is only useful as a check. With mode 'sample' the label of a pair is drawn when the
+    pair is chosen: the true class of the instance with the reliability of the worker, the other class otherwise.
+    Every replicate draws its true classes and labels from its own generator seeded from seed and its number, so a
+    replicate gives the same run whatever the number of replicates run along with it.
+    The memory is O(R * number of pairs), a few tens of bytes per pair and replicate
+    """
+
+    def __init__(self, instances, workers, replicates, mode='sample', truth=None, reliability=None, seed=0,
+                 block=1024):
+        """
+        Build the arrays of the replicates from the current parameters of the given instances and workers
+        :param instances: the given dataset (of type DataSource)
+        :param workers: the workers (of type Worker)
+        :param replicates: number R of replicates
+        :param mode: 'sample' to draw the labels from the worker reliabilities, 'replay' to use the labels of the data
+        :param truth: the true class of every instance, array of N or (R, N) in the order of the dataset, default is
+                      the gold answer, an instance without a 0/1 gold answer gets a true class drawn in each replicate
+        :param reliability: the probability of every worker to give the true class, array of W or (R, W) in the
+                            order of Worker.get_worker_id_list(), default is the share of the labels of the worker
+                            agreeing with the gold answers, smoothed by the worker prior (c, d)
+        :param seed: the seed of the generators of the replicates
+        :param block: number of random numbers drawn at once by each generator
+        """
+        if mode not in ('sample', 'replay'):
+            raise ValueError('mode must be sample or replay')
+        self._mode = mode
+        (self._inst_ids, self._wrk_ids, ab, cd, self._pair_inst, self._pair_wrk,
+         self._pair_resp) = _pair_table(instances, workers)
+        self._inst_ptr, self._wrk_pairs, self._wrk_ptr = _adjacency(self._pair_inst, self._pair_wrk,
+                                                                    len(self._inst_ids), len(self._wrk_ids))
+        self._rows = np.arange(replicates)
+        self._a = np.tile(ab[:, 0], (replicates, 1))
+        self._b = np.tile(ab[:, 1], (replicates, 1))
+        self._c = np.tile(cd[:, 0], (replicates, 1))
+        self._d = np.tile(cd[:, 1], (replicates, 1))
+        self._active = np.ones((replicates, self._pair_inst.size), dtype=bool)
+        self._chosen = np.zeros((replicates, len(self._inst_ids)), dtype=bool)
+        self._steps = 0
+        self._rngs = [np.random.default_rng(s) for s in np.random.SeedSequence(seed).spawn(replicates)]
+        self._uniform = np.empty((replicates, block))
+        self._uniform_pos = block
+        # the true classes, -1 for unknown
+        gold = instances.get_gold()
+        gold = np.where((gold == 0) | (gold == 1), gold, -1).astype(np.int8)
+        if truth is None:
+            truth = gold
+        self._truth = np.array(np.broadcast_to(truth, self._chosen.shape), dtype=np.int8)
+        if mode == 'sample':
+            for r, rng in enumerate(self._rngs):
+                unknown = np.flatnonzero(self._truth[r] < 0)
+                self._truth[r, unknown] = rng.integers(0, 2, unknown.size)
+            if reliability is None:
+                known = gold[self._pair_inst] >= 0
+                agree = known & (self._pair_resp == gold[self._pair_inst])
+                num_wrk = len(self._wrk_ids)
+                reliability = (cd[:, 0] + np.bincount(self._pair_wrk, agree, num_wrk)) / \
+                              (cd[:, 0] + cd[:, 1] + np.bincount(self._pair_wrk, known, num_wrk))
+            self._reliability = np.array(np.broadcast_to(reliability, self._c.shape), dtype=np.float64)
+        # the replicates start from the same parameters, so the pairs are scored once for all of them
+        i = self._pair_inst
+        j = self._pair_wrk
+        R = kg_reward(ab[i, 0], ab[i, 1], cd[j, 0], cd[j, 1])
+        self._forest = TournamentForest(np.tile(R, (replicates, 1)))
+
+
+    def _next_uniform(self):
+        """
+        :return: array of one uniform random number per replicate, each from the generator of its replicate
+        """
+        if self._uniform_pos == self._uniform.shape[1]:
+            for r, rng in enumerate(self._rngs):
+                self._uniform[r] = rng.random(self._uniform.shape[1])
+            self._uniform_pos = 0
+        self._uniform_pos = self._uniform_pos + 1
+
+        return self._uniform[:, self._uniform_pos - 1]
+
+
+    def step(self):
+        """
+        Select, label and update one pair in every replicate
+        :return: array of the selected pair of each replicate, indexes in the pair table
+        """
+        if self._steps == self._pair_inst.size:
+            raise ValueError('no pairs left')
+        rows = self._rows
+        pairs, _ = self._forest.top()
+        i = self._pair_inst[pairs]
+        j = self._pair_wrk[pairs]
+        if self._mode == 'replay':
+            z = self._pair_resp[pairs]
+        else:
+            t = self._truth[rows, i]
+            z = np.where(self._next_uniform() < self._reliability[rows, j], t, 1 - t)
+        apply_labels(self._a, self._b, self._c, self._d, (rows, i), (rows, j), z)
+        self._active[rows, pairs] = False
+        self._chosen[rows, i] = True
+        self._forest.update(rows, pairs, np.full(rows.size, -np.inf))
+        # rescore the remaining pairs of the updated instance and worker of every replicate
+        owner_i, touched_i = _ragged_arange(self._inst_ptr[i], self._inst_ptr[i + 1] - self._inst_ptr[i])
+        owner_j, touched_j = _ragged_arange(self._wrk_ptr[j], self._wrk_ptr[j + 1] - self._wrk_ptr[j])
+        owner = np.concatenate((owner_i, owner_j))
+        touched = np.concatenate((touched_i, self._wrk_pairs[touched_j]))
+        keep = self._active[owner, touched]
+        owner = owner[keep]
+        touched = touched[keep]
+        ti = self._pair_inst[touched]
+        tj = self._pair_wrk[touched]
+        self._forest.update(owner, touched, kg_reward(self._a[owner, ti], self._b[owner, ti], self._c[owner, tj],
+                                                      self._d[owner, tj]))
+        self._steps = self._steps + 1
+
+        return pairs
+
+
+    def run(self, budget):
+        """
+        Step every replicate until it has budget labels, or until the pairs run out
+        :param budget: the total number of labels of each replicate
+        :return: None
+        """
+        for t in range(self._steps, min(budget, self._pair_inst.size)):
+            self.step()
+
+
+    def sweep(self, budgets):
+        """
+        Run up to every budget in increasing order and score the replicates there
+        :param budgets: the budgets to report
+        :return: generator of (budget, array of the accuracy of each replicate)
+        """
+        for T_ in sorted(budgets):
+            self.run(T_)
+            yield T_, self.accuracy()
+
+
+    def accuracy(self):
+        """
+        The accuracy of every replicate against its true classes, as Evaluator: (|H* & H_T| + |H*c & H_T complement|)
+        / number of instances
+        :return: array of R accuracies
+        """
+        positive = self._a >= self._b
+        correct = self._chosen & np.where(positive, self._truth == 1, self._truth == 0)
+
+        return np.count_nonzero(correct, axis=1) / self._chosen.shape[1]
+
+
+    def output_set_Ht(self, r):
+        """
+        The output of replicate r, as Algorithm._output_set_Ht
+        :return: H_T and its complement, lists of orig_id in dataset order
+        """
+        chosen = np.flatnonzero(self._chosen[r])
+        positive = self._a[r, chosen] >= self._b[r, chosen]
+
+        return ([self._inst_ids[i] for i in chosen[positive].tolist()],
+                [self._inst_ids[i] for i in chosen[~positive].tolist()])
+
+
+    def get_params(self):
+        """
+        :return: copies of the (R, N) arrays a, b and of the (R, W) arrays c, d
+        """
+        return self._a.copy(), self._b.copy(), self._c.copy(), self._d.copy()
+
+
+# test the engines against the reference loop
+def _test_engine():
+    from dataset import DataSource
+    from workers import Worker
+    from algorithm import Algorithm
+    filename = 'rte.standardized.tsv'
+    Budget = 1000
+    H_T_loop = Algorithm(DataSource(filename, 1, 1), Worker(filename, 4, 1), Budget).run_Opt_KG()
+    for engine in ('pruned', 'vectorized', 'incremental'):
+        H_T = Algorithm(DataSource(filename, 1, 1), Worker(filename, 4, 1), Budget, engine=engine).run_Opt_KG()
+        assert H_T == H_T_loop
+    print(H_T_loop)
+
+
+# batches of one pair are the sequential selection, and a batch never holds two pairs of the same instance
+def _test_batch():
+    from dataset import DataSource
+    from workers import Worker
+    filename = 'rte.standardized.tsv'
+    Budget = 400
+    for cls in (OptKGEngine, IncrementalOptKGEngine):
+        sequential = cls(DataSource(filename, 1, 1), Worker(filename, 4, 1))
+        batched = cls(DataSource(filename, 1, 1), Worker(filename, 4, 1))
+        for t in range(0, Budget):
+            R_max, pair = sequential.select()
+            R, pairs = batched.select_batch(1)
+            assert R[0] == R_max and pairs.tolist() == [pair]
+            sequential.acquire_label_update_posterior(pair)
+            batched.acquire_label_update_posterior(pair)
+        engine = cls(DataSource(filename, 1, 1), Worker(filename, 4, 1))
+        t = 0
+        while t < Budget:
+            R, pairs = engine.select_batch(16)
+            assert np.unique(engine._pair_inst[pairs]).size == pairs.size
+            assert (R[0], pairs[0]) == engine.select()
+            for pair in pairs.tolist():
+                engine.acquire_label_update_posterior(pair)
+            t = t + pairs.size
+    print('batches checked')
+
+
+# test the replicates against the incremental engine and against smaller lockstep runs
+def _test_lockstep():
+    from dataset import DataSource
+    from workers import Worker
+    from algorithm import Algorithm
+    filename = 'rte.standardized.tsv'
+    Budget = 1000
+    output = Algorithm(DataSource(filename, 1, 1), Worker(filename, 4, 1), Budget, engine='incremental').run_Opt_KG()
+    replay = LockstepOptKGEngine(DataSource(filename, 1, 1), Worker(filename, 4, 1), 3, mode='replay')
+    replay.run(Budget)
+    for r in range(0, 3):
+        assert replay.output_set_Ht(r) == output
+    wide = LockstepOptKGEngine(DataSource(filename, 1, 1), Worker(filename, 4, 1), 8, seed=5)
+    narrow = LockstepOptKGEngine(DataSource(filename, 1, 1), Worker(filename, 4, 1), 2, seed=5)
+    wide.run(Budget)
+    narrow.run(Budget)
+    assert all(np.array_equal(x[:2], y) for x, y in zip(wide.get_params(), narrow.get_params()))
+    print('sampled accuracy at budget ' + str(Budget) + ': ' + str(wide.accuracy()))
+
+
+if __name__ == "__main__":
+    _test_engine()
+    _test_batch()
+    _test_lockstep()
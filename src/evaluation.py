@@ -0,0 +1,84 @@
+import numpy as np
+
+
+class Evaluator:
+    """
+    Scores the positive set of a run against the gold answers.
+
+    The gold answers are read once into an int8 array in the order of the rows of the instances' PosteriorStore,
+    -1 for the instances without a 0/1 gold answer. A run is given as a bool bitmap of the chosen instances, in the
+    same order, and the (n, 2) array of the current a, b, so every score is a few vectorized passes, O(N).
+    An instance is in H_T when it is chosen and a >= b, in the complement of H_T when it is chosen and a < b, as
+    Algorithm._output_set_Ht
+    """
+
+    def __init__(self, instances):
+        """
+        :param instances: the given dataset (of type DataSource)
+        """
+        gold = instances.get_gold()
+        self._gold = np.where((gold == 0) | (gold == 1), gold, -1).astype(np.int8)
+        self._num_positive = int(np.count_nonzero(self._gold == 1))
+
+
+    def get_gold(self):
+        """
+        :return: the gold array, 1 / 0 and -1 for unknown
+        """
+        return self._gold
+
+
+    def confusion(self, chosen, params):
+        """
+        Confusion counts of a run
+        :param chosen: bool array, True for the chosen instances
+        :param params: (n, 2) array of the a, b of the instances
+        :return: dict with tp, fp, tn, fn and the number of instances not chosen
+        """
+        n = len(self._gold)
+        chosen = chosen[:n]
+        positive = params[:n, 0] >= params[:n, 1]
+        pred_1 = chosen & positive
+        pred_0 = chosen & ~positive
+        gold_1 = self._gold == 1
+        gold_0 = self._gold == 0
+
+        return {'tp': int(np.count_nonzero(pred_1 & gold_1)), 'fp': int(np.count_nonzero(pred_1 & gold_0)),
+                'tn': int(np.count_nonzero(pred_0 & gold_0)), 'fn': int(np.count_nonzero(pred_0 & gold_1)),
+                'not_chosen': int(n - np.count_nonzero(chosen))}
+
+
+    def evaluate(self, chosen, params):
+        """
+        Scores of a run. The accuracy is (|H* & H_T| + |H*c & H_T complement|) / number of instances as in the
+        experiments, the recall is over all the instances of H*, the precision over H_T
+        :param chosen: bool array, True for the chosen instances
+        :param params: (n, 2) array of the a, b of the instances
+        :return: dict with accuracy, precision, recall and the confusion counts
+        """
+        report = self.confusion(chosen, params)
+        tp = report['tp']
+        report['accuracy'] = (tp + report['tn']) / len(self._gold)
+        report['precision'] = tp / (tp + report['fp']) if tp + report['fp'] > 0 else 0.0
+        report['recall'] = tp / self._num_positive if self._num_positive > 0 else 0.0
+
+        return report
+
+
+def _test_evaluation():
+    from dataset import DataSource
+    from workers import Worker
+    from algorithm import Algorithm
+    filename = 'rte.standardized.tsv'
+    datasource = DataSource(filename, 1, 1)
+    Opt_KG = Algorithm(datasource, Worker(filename, 4, 1), 800, engine='incremental')
+    H_T, H_complement = Opt_KG.run_Opt_KG()
+    H_star, H_star_c = datasource.get_H_star()
+    report = Opt_KG.evaluate()
+    assert report['tp'] == len(set(H_star).intersection(H_T))
+    assert report['tn'] == len(set(H_star_c).intersection(H_complement))
+    print(report)
+
+
+if __name__ == '__main__':
+    _test_evaluation()
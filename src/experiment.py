@@ -1,81 +1,176 @@
-import numpy as np
-# show the figure opt-KG on RTE
-import matplotlib
-matplotlib.use('Qt5Agg')
-import matplotlib.pyplot as plt
+import sys
+import csv
+import json
+import argparse
 import warnings
+import numpy as np
 from dataset import DataSource
 from workers import Worker
-from math_util import *
-from algorithm import Algorithm
-
+from loader import load_crowd_data
+from kernels import kernel_backend
+from math_util import configure_beta_cache, save_beta_dic
+from algorithm import Algorithm, _ENGINES, _LOOP_ENGINES
+from policies import POLICIES, make_policy, run_policy
 
-#ignore the unnecessary warnings
-warnings.filterwarnings('ignore')
 
-
-def Opt_KG_experiment():
+def Opt_KG_experiment(data_file='rte.standardized.tsv', init_a0=1, init_b0=1, init_c0=4, init_d0=1, budgets=None,
+                      engine='incremental', beta_cache_path=None, output=None, plot=None,
+                      data_path=None):
     """
-    Run experiment on the RTE data set
-    :return: accuracy
+    Run experiment on the RTE data set, headless: the results are printed and written to files, nothing is shown
+    :param data_file: dataset filename(format ending should not be forgotten)
+    :param budgets: the budgets T to report, default is 0, 100, ..., 7900
+    :param engine: the engine of Algorithm, they all give the same results
+    :param beta_cache_path: file keeping the I(a,b) values between experiments, None for a memory only cache
+    :param output: file to write the results to, .json for JSON and CSV otherwise, None to not write them
+    :param plot: image file to draw the accuracy curve to, None for no plot
+    :param data_path: the directory of the data file, default is loader.DATA_PATH
+    :return: list of dicts, the results at each budget
     """
-    # initialize the prior parameters a0 b0 of the dataset
-    data_file = 'rte.standardized.tsv'
-    init_a0 = 1
-    init_b0 = 1
-    # sourcedata = DataSource(data_file, init_a0, init_b0)
-    # initialize the prior parameters c0 d0 of the workers
-    init_c0 = 4
-    init_d0 = 1
-    # workers = Worker(data_file, init_c0, init_d0)
     # Given Budget T
-    Budget_T = np.arange(0,8000,100)
-    # accuracy result of experiment each time
-    accuracy_ = []
-    # run experiment limited to the given budget T_
-    for T_ in Budget_T:
-        accuracy_sum = 0
-        for i in range(0,1):
-            sourcedata = DataSource(data_file, init_a0, init_b0)
-            workers = Worker(data_file, init_c0, init_d0)
-            Opt_KG = Algorithm(sourcedata, workers, T_)
-            H_T, H_complement = Opt_KG.run_Opt_KG()
-            # the number that the positive and negative set result derived from the experiment is accordance with the real data
-            result = 0
-            # get H* and H*c
-            H_star, H_star_c = sourcedata.get_H_star()
-            for idx in H_T:
-                if idx in H_star:
-                    result = result + 1
-            for idx in H_complement:
-                if idx in H_star_c:
-                    result = result + 1
-            # calculate the accuracy_sum
-            accuracy_sum = accuracy_sum + result / 800
-        # calculate the accuracy
-        accuracy_mean = accuracy_sum / 1
-        accuracy_.append(accuracy_mean)
+    if budgets is None:
+        budgets = np.arange(0, 8000, 100).tolist()
+    # report whether the kernels run compiled with numba or on NumPy
+    print('kernel backend: ' + str(kernel_backend()))
+    # keep the I(a,b) values between experiments in an append-only file
+    beta_cache = configure_beta_cache(path=beta_cache_path)
+    # Opt-KG is deterministic, so run it once up to the largest budget and snapshot every budget T_ on the way
+    crowd_data = load_crowd_data(data_file, data_path)
+    sourcedata = DataSource(crowd_data, init_a0, init_b0)
+    workers = Worker(crowd_data, init_c0, init_d0)
+    Opt_KG = Algorithm(sourcedata, workers, max(budgets), engine=engine)
+    # get H* and H*c
+    H_star, H_star_c = sourcedata.get_H_star()
+    results = []
+    for T_, H_T, H_complement, accuracy in Opt_KG.sweep_Opt_KG(budgets):
+        report = Opt_KG.evaluate()
+        results.append({'budget': T_, 'accuracy': accuracy, 'precision': report['precision'],
+                         'recall': report['recall'], 'tp': report['tp'], 'fp': report['fp'], 'tn': report['tn'],
+                         'fn': report['fn'], 'H_T_size': len(H_T), 'H_T_c_size': len(H_complement)})
         # print the accuracy result on the console
         print('the length of H_t is:' + str(len(H_T)) + ', the length of H_t_c is:' + str(len(H_complement)))
         print('the length of H* is:' + str(len(H_star)) + ', the length of H*_c is:' + str(len(H_star_c)))
-        print('the length of result is:' + str(result))
-        print('Budget ' + str(T_) + ' and the accuracy is ' + str(accuracy_[-1]))
+        print('Budget ' + str(T_) + ' and the accuracy is ' + str(accuracy))
+        print('precision ' + str(report['precision']) + ', recall ' + str(report['recall']) + ', confusion tp ' +
+              str(report['tp']) + ' fp ' + str(report['fp']) + ' tn ' + str(report['tn']) + ' fn ' + str(report['fn']))
         print('*' * 40)
 
-
-    # save the beta distribution dictionary
+    # save the new entries of the beta distribution cache
     save_beta_dic()
-    # plot
+    print('beta cache: ' + str(beta_cache.stats()))
+    if output is not None:
+        _write_results(results, output)
+    if plot is not None:
+        _plot_accuracy(results, plot)
+
+    return results
+
+
+def Policy_experiment(data_file='rte.standardized.tsv', init_a0=1, init_b0=1, init_c0=4, init_d0=1, budgets=None,
+                      policies=None, seed=0, output=None, data_path=None):
+    """
+    Compare allocation policies on one data set. The data file is loaded once, every policy runs on its own
+    DataSource and Worker built from the loaded data, through the shared state and update path of policies.py
+    :param policies: names of policies.POLICIES, default is all of them
+    :param seed: the seed of the randomized policies
+    :param output: file to write the results to, .json for JSON and CSV otherwise, None to not write them
+    :return: list of dicts, the results of every policy at each budget with its mean time per step in select and
+             update and the mean number of pairs it scanned per step
+    """
+    if budgets is None:
+        budgets = np.arange(0, 8000, 100).tolist()
+    if policies is None:
+        policies = list(POLICIES)
+    print('kernel backend: ' + str(kernel_backend()))
+    crowd_data = load_crowd_data(data_file, data_path)
+    results = []
+    for name in policies:
+        runs = run_policy(make_policy(name, seed), DataSource(crowd_data, init_a0, init_b0),
+                          Worker(crowd_data, init_c0, init_d0), budgets)
+        for T_, report in runs:
+            profile = report['profile']
+            phases = profile['phases']
+            results.append({'policy': name, 'budget': T_, 'accuracy': report['accuracy'],
+                            'precision': report['precision'], 'recall': report['recall'],
+                            'steps': profile['steps'],
+                            'select_time': phases['select']['mean'] if 'select' in phases else 0.0,
+                            'update_time': phases['update']['mean'] if 'update' in phases else 0.0,
+                            'pairs_scanned': profile['pairs_scanned']['mean'], 'wall_time': profile['wall_time']})
+            print('Policy ' + name + ', budget ' + str(T_) + ' and the accuracy is ' + str(report['accuracy']))
+        row = results[-1]
+        print('time per step of ' + name + ': select ' + str(row['select_time']) + ' s, update ' +
+              str(row['update_time']) + ' s, ' + str(row['pairs_scanned']) + ' pairs scanned')
+        print('*' * 40)
+    if output is not None:
+        _write_results(results, output)
+
+    return results
+
+
+def _write_results(results, output):
+    """
+    Write the results to a JSON file if output ends with .json, to a CSV file otherwise
+    :return: None
+    """
+    if output.endswith('.json'):
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=1)
+        return
+    with open(output, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(results[0].keys()))
+        writer.writeheader()
+        writer.writerows(results)
+
+
+def _plot_accuracy(results, path):
+    """
+    Draw the accuracy against the budget to an image file. matplotlib is imported here with the Agg backend, so it
+    needs no display
+    :return: None
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
     plt.figure()
-    plt.plot(Budget_T, accuracy_, color = 'red', linewidth = 2.0, marker = 'D', fillstyle = 'full')
+    plt.plot([row['budget'] for row in results], [row['accuracy'] for row in results], color = 'red',
+             linewidth = 2.0, marker = 'D', fillstyle = 'full')
     plt.xlabel('Budget')
     plt.ylabel('accuracy')
     # set y-axis locations and labels
     plt.yticks(np.arange(0,1,0.05))
     plt.title('Opt-KG on RTE')
-    plt.show()
+    plt.savefig(path)
+    plt.close()
+
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run Opt-KG on a crowd labeling file and write the accuracy at '
+                                                 'each budget')
+    parser.add_argument('--data', default='rte.standardized.tsv')
+    parser.add_argument('--data-path', default=None)
+    parser.add_argument('--a0', type=float, default=1)
+    parser.add_argument('--b0', type=float, default=1)
+    parser.add_argument('--c0', type=float, default=4)
+    parser.add_argument('--d0', type=float, default=1)
+    parser.add_argument('--budgets', type=int, nargs='+', default=None)
+    parser.add_argument('--engine', default='incremental', choices=list(_LOOP_ENGINES) + list(_ENGINES))
+    parser.add_argument('--beta-cache', default=None,
+                        help='file keeping the I(a,b) values between runs, e.g. beta_cache.bin, default is memory only')
+    parser.add_argument('--output', default='experiment_results.csv')
+    parser.add_argument('--plot', default=None, help='image file of the accuracy curve, e.g. accuracy.png')
+    parser.add_argument('--policies', nargs='+', default=None, choices=list(POLICIES),
+                        help='compare these allocation policies instead of running Opt-KG with an engine')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the randomized policies')
+    args = parser.parse_args(argv)
+    #ignore the unnecessary warnings
+    warnings.filterwarnings('ignore')
+    if args.policies is not None:
+        Policy_experiment(args.data, args.a0, args.b0, args.c0, args.d0, args.budgets, args.policies, args.seed,
+                          args.output, args.data_path)
+        return
+    Opt_KG_experiment(args.data, args.a0, args.b0, args.c0, args.d0, args.budgets, args.engine, args.beta_cache,
+                      args.output, args.plot, args.data_path)
 
 
 if __name__ == '__main__':
-    Opt_KG_experiment()
\ No newline at end of file
+    main(sys.argv[1:])
@@ -0,0 +1,463 @@
+import os
+import sys
+import math
+import functools
+import importlib.util
+import numpy as np
+
+
+# The numerical kernels shared by math_util, DataSource, Worker and the engines: I(a,b), the moment matching
+# updates of the paper's Appendix and the knowledge-gradient reward. All the functions take scalars or NumPy arrays.
+#
+# The moment matching formulas for the label z = 0 are the formulas for z = 1 with c and d swapped (for a, b) or with
+# a and b swapped (for c, d), term for term, so each update is written once and gives bit for bit the values of the
+# formulas written out for each label.
+#
+# There are two backends. With numba installed the reward is computed by one compiled loop fusing new_a_b, I(a,b)
+# and h_function, with I(a,b) evaluated by a continued fraction that numba can compile. Without numba, or with the
+# environment variable TA_KERNEL_BACKEND=numpy, everything runs on NumPy and I(a,b) is scipy.special.betainc. The two
+# backends agree to 5e-14, so a near tie may go either way from one backend to the other. Within a backend the scalar
+# and the batch I(a,b) are the same bit for bit, so the reference loop and the engines pick exactly the same pairs.
+#
+# Importing this module stays cheap: numba is only looked up here, it is imported and the kernels are compiled at
+# the first call of a compiled kernel.
+
+if os.environ.get('TA_KERNEL_BACKEND', 'numba') == 'numpy':
+    BACKEND = 'numpy'
+    _backend_reason = 'numba disabled by TA_KERNEL_BACKEND'
+elif importlib.util.find_spec('numba') is None:
+    BACKEND = 'numpy'
+    _backend_reason = "No module named 'numba'"
+else:
+    BACKEND = 'numba'
+    _backend_reason = 'numba, not imported yet'
+
+# the functions waiting to be compiled, in the order they were decorated
+_lazy_functions = []
+
+
+class _LazyJit:
+    """
+    A function compiled by numba.njit at the first call of any such function. At that point numba is imported, all
+    the waiting functions are compiled and the module globals naming them are set to the compiled functions, so the
+    compiled kernels call each other directly
+    """
+
+    def __init__(self, fn, options):
+        functools.update_wrapper(self, fn)
+        self._fn = fn
+        self._options = options
+        self._compiled = None
+        _lazy_functions.append(self)
+
+
+    def __call__(self, *args):
+        if self._compiled is None:
+            _compile_lazy_functions()
+        return self._compiled(*args)
+
+
+def _compile_lazy_functions():
+    """
+    Import numba and compile the waiting functions, see _LazyJit
+    :return: None
+    """
+    global _backend_reason
+    import numba
+    _backend_reason = 'numba ' + numba.__version__
+    for lazy in _lazy_functions:
+        if lazy._compiled is None:
+            lazy._compiled = numba.njit(**lazy._options)(lazy._fn)
+    for module_name in set(lazy._fn.__module__ for lazy in _lazy_functions):
+        module = sys.modules[module_name]
+        for name, value in list(vars(module).items()):
+            if isinstance(value, _LazyJit):
+                setattr(module, name, value._compiled)
+
+
+def njit(*args, **kwargs):
+    """
+    numba.njit compiling at the first call with the numba backend, a decorator that does nothing otherwise
+    """
+    if len(args) == 1 and callable(args[0]):
+        return _LazyJit(args[0], kwargs) if BACKEND == 'numba' else args[0]
+    if BACKEND == 'numba':
+        return lambda f: _LazyJit(f, kwargs)
+    return lambda f: f
+
+
+def kernel_backend():
+    """
+    Report which backend computes the kernels
+    :return: dict with the backend name ('numba' or 'numpy') and the numba version or why numba is not used
+    """
+    if BACKEND == 'numba' and not _backend_reason.startswith('numba '):
+        _compile_lazy_functions()
+    return {'backend': BACKEND, 'detail': _backend_reason}
+
+
+# max number of terms of the continued fraction, it converges in O(sqrt(max(a, b))) terms
+_CF_MAX_ITER = 10000
+_CF_EPS = 1e-16
+_CF_TINY = 1e-300
+# constants of Stirling's series
+_HALF_LOG_2PI = 0.5 * math.log(2 * math.pi)
+_HALF_LOG_4PI = 0.5 * math.log(4 * math.pi)
+_LOG_2 = math.log(2.0)
+
+
+@njit(cache=False)
+def _beta_cf(a, b, x):
+    """
+    Continued fraction of the regularized incomplete beta function (modified Lentz's method)
+    """
+    qab = a + b
+    qap = a + 1.0
+    qam = a - 1.0
+    c = 1.0
+    d = 1.0 - qab * x / qap
+    if abs(d) < _CF_TINY:
+        d = _CF_TINY
+    d = 1.0 / d
+    h = d
+    for m in range(1, _CF_MAX_ITER + 1):
+        m2 = 2 * m
+        aa = m * (b - m) * x / ((qam + m2) * (a + m2))
+        d = 1.0 + aa * d
+        if abs(d) < _CF_TINY:
+            d = _CF_TINY
+        c = 1.0 + aa / c
+        if abs(c) < _CF_TINY:
+            c = _CF_TINY
+        d = 1.0 / d
+        h *= d * c
+        aa = -(a + m) * (qab + m) * x / ((a + m2) * (qap + m2))
+        d = 1.0 + aa * d
+        if abs(d) < _CF_TINY:
+            d = _CF_TINY
+        c = 1.0 + aa / c
+        if abs(c) < _CF_TINY:
+            c = _CF_TINY
+        d = 1.0 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1.0) < _CF_EPS:
+            break
+    return h
+
+
+def _stirling_correction(x):
+    """
+    lgamma(x) - Stirling's approximation (x - 0.5) log(x) - x + log(2 pi) / 2, for x >= 10, x a float or an array
+    """
+    x2 = 1.0 / (x * x)
+    return (1.0 / 12 - x2 * (1.0 / 360 - x2 * (1.0 / 1260 - x2 * (1.0 / 1680 - x2 * (1.0 / 1188
+            - x2 * 691.0 / 360360))))) / x
+
+
+_lgamma_correction = njit(cache=False)(_stirling_correction)
+
+
+@njit(cache=False)
+def _log_gamma(x):
+    """
+    lgamma(x) for x > 0 from Stirling's series, lgamma(x) = lgamma(x + n) - log(x (x + 1) ... (x + n - 1)) with x + n
+    >= 10. math.lgamma is not used since numba has its own, which differs from the C library in the last bits
+    """
+    prod = 1.0
+    while x < 10:
+        prod = prod * x
+        x = x + 1.0
+    return (x - 0.5) * math.log(x) - x + _HALF_LOG_2PI + _lgamma_correction(x) - math.log(prod)
+
+
+@njit(cache=False)
+def _log_front_half(a, b):
+    """
+    log( 0.5^(a+b) / B(a, b) ). For large a and b the lgamma terms cancel badly, so the Stirling corrections are
+    used instead, with the 0.5^(a+b) folded into log1p terms that stay small when a and b are close
+    """
+    p = min(a, b)
+    q = max(a, b)
+    if p >= 10:
+        corr = _lgamma_correction(p) + _lgamma_correction(q) - _lgamma_correction(p + q)
+        delta = (p - q) / (p + q)
+        return 0.5 * math.log(q) - _HALF_LOG_4PI - corr - (p - 0.5) * math.log1p(delta) - q * math.log1p(-delta)
+    return _log_gamma(p + q) - _log_gamma(p) - _log_gamma(q) - (p + q) * _LOG_2
+
+
+@njit(cache=False)
+def _I_half(a, b):
+    """
+    Pr( theta > 0.5 | theta ~ Beta(a, b) ) = I_0.5(b, a), with the continued fraction on the side where it
+    converges fast
+    """
+    # I_0.5(b, a) = 0.5^(a+b) / (b B(a, b)) * cf(b, a), the cf of I_0.5(b, a) converges fast when a < b,
+    # otherwise use I_0.5(b, a) = 1 - I_0.5(a, b). Beta(a, a) is symmetric around 0.5
+    if a == b:
+        return 0.5
+    log_front = _log_front_half(a, b)
+    if a < b:
+        return math.exp(log_front) * _beta_cf(b, a, 0.5) / b
+    return 1.0 - math.exp(log_front) * _beta_cf(a, b, 0.5) / a
+
+
+@njit(cache=False)
+def _I_half_array(a, b):
+    """
+    _I_half over arrays
+    """
+    out = np.empty(a.shape[0])
+    for k in range(a.shape[0]):
+        out[k] = _I_half(a[k], b[k])
+    return out
+
+
+def _I_half_betainc(a, b):
+    """
+    I(a,b) of the NumPy backend, by scipy.special.betainc over arrays or floats. Beta(a, a) gives 0.5 exactly, as
+    with _I_half
+    """
+    from scipy.special import betainc
+    return np.where(a == b, 0.5, betainc(b, a, 0.5))
+
+
+def Beta_ab_cdf_batch(a, b):
+    """
+    calculate I(a,b) for arrays of a and b in one call.
+    Pr( theta > 0.5 ) = 1 - I_0.5(a, b) = I_0.5(b, a), evaluated by a continued fraction on the side where it
+    converges fast, which avoids the overhead of beta.sf and its slower complement. Absolute difference to
+    beta.sf(0.5, a, b) below 5e-14 for a, b in [0.1, 5000]. The NumPy backend uses scipy.special.betainc instead
+    :param a: array of beta distribution parameters a
+    :param b: array of beta distribution parameters b
+    :return: array of Pr( theta > 0.5 | theta ~ Beta(a, b) )
+    """
+    a, b = np.broadcast_arrays(np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64))
+    if BACKEND == 'numba':
+        return _I_half_array(a.ravel(), b.ravel()).reshape(a.shape)
+    return _I_half_betainc(a, b)
+
+
+def Beta_ab_cdf_scalar(a, b):
+    """
+    I(a,b) of one pair, the same value as Beta_ab_cdf_batch gives for it
+    :return: Pr( theta > 0.5 | theta ~ Beta(a, b) ) as a float
+    """
+    if BACKEND == 'numba':
+        return _I_half(float(a), float(b))
+    return float(_I_half_betainc(float(a), float(b)))
+
+
+def _match_ab(a, b, c, d):
+    """
+    :return: the new a and b of an instance after the label z = 1
+    """
+    exp_theta = a * ((a + 1) * c + b * d) / ((a + b + 1) * (a * c + b * d))
+    exp_theta_square = a * (a + 1) * ((a + 2) * c + b * d) / ((a + b + 1) * (a + b + 2) * (a * c + b * d))
+    new_a = exp_theta * (exp_theta - exp_theta_square) / (exp_theta_square - exp_theta * exp_theta)
+    new_b = (1 - exp_theta) * (exp_theta - exp_theta_square) / (exp_theta_square - exp_theta * exp_theta)
+
+    return new_a, new_b
+
+
+def _match_cd(a, b, c, d):
+    """
+    :return: the new c and d of a worker after the label z = 1
+    """
+    exp_rho = c * (a * (c + 1) + b * d) / ((c + d + 1) * (a * c + b * d))
+    exp_rho_square = c * (c + 1) * (a * (c + 2) + b * d) / ((c + d + 1) * (c + d + 2) * (a * c + b * d))
+    new_c = exp_rho * (exp_rho - exp_rho_square) / (exp_rho_square - exp_rho * exp_rho)
+    new_d = (1 - exp_rho) * (exp_rho - exp_rho_square) / (exp_rho_square - exp_rho * exp_rho)
+
+    return new_c, new_d
+
+
+def posterior_ab(a, b, c, d, z):
+    """
+    The new a and b of the instance after worker (c, d) gave the label z
+    :param a: a-i of the instance
+    :param b: b-i of the instance
+    :param c: c-j of the worker
+    :param d: d-j of the worker
+    :param z: the label, 0 or 1, a scalar or an array
+    :return: new a, new b
+    """
+    # np.ndim costs more than the update of floats, skip it for the labels of the scalar code
+    if type(z) is int or np.ndim(z) == 0:
+        if z == 1:
+            return _match_ab(a, b, c, d)
+        elif z == 0:         # the RTE dataset have two label results : 0 and 1, different from the paper
+            return _match_ab(a, b, d, c)
+        raise ValueError
+    z = np.asarray(z)
+    if not np.isin(z, (0, 1)).all():
+        raise ValueError
+    return _match_ab(a, b, np.where(z == 1, c, d), np.where(z == 1, d, c))
+
+
+def posterior_cd(a, b, c, d, z):
+    """
+    The new c and d of the worker after he gave the label z to the instance (a, b)
+    :param a: a-i of the instance
+    :param b: b-i of the instance
+    :param c: c-j of the worker
+    :param d: d-j of the worker
+    :param z: the label, 0 or 1, a scalar or an array
+    :return: new c, new d
+    """
+    if type(z) is int or np.ndim(z) == 0:
+        if z == 1:
+            return _match_cd(a, b, c, d)
+        elif z == 0:
+            return _match_cd(b, a, c, d)
+        raise ValueError
+    z = np.asarray(z)
+    if not np.isin(z, (0, 1)).all():
+        raise ValueError
+    return _match_cd(np.where(z == 1, a, b), np.where(z == 1, b, a), c, d)
+
+
+def apply_labels(a, b, c, d, inst, wrk, z):
+    """
+    Update the posterior arrays in place with labels given by workers wrk to instances inst. The labels are applied
+    together from the current values, so every instance and every worker may appear at most once; apply labels
+    sharing an instance or a worker in separate calls
+    :param a: array of a-i of all the instances, updated in place
+    :param b: array of b-i of all the instances, updated in place
+    :param c: array of c-j of all the workers, updated in place
+    :param d: array of d-j of all the workers, updated in place
+    :param inst: index or array of indexes of the instances
+    :param wrk: index or array of indexes of the workers
+    :param z: the labels
+    :return: None
+    """
+    ai, bi, cj, dj = a[inst], b[inst], c[wrk], d[wrk]
+    a[inst], b[inst] = posterior_ab(ai, bi, cj, dj, z)
+    c[wrk], d[wrk] = posterior_cd(ai, bi, cj, dj, z)
+
+
+_match_ab_compiled = njit(cache=False)(_match_ab)
+
+
+@njit(cache=False)
+def _kg_reward_fused(a, b, c, d):
+    """
+    kg_reward in one compiled loop, no temporary arrays
+    """
+    out = np.empty(a.shape[0])
+    for k in range(a.shape[0]):
+        I_ab = _I_half(a[k], b[k])
+        h_ab = max(I_ab, 1 - I_ab)
+        new_a, new_b = _match_ab_compiled(a[k], b[k], c[k], d[k])
+        I_ab_new = _I_half(new_a, new_b)
+        R1 = max(I_ab_new, 1 - I_ab_new) - h_ab
+        new_a, new_b = _match_ab_compiled(a[k], b[k], d[k], c[k])
+        I_ab_new = _I_half(new_a, new_b)
+        R2 = max(I_ab_new, 1 - I_ab_new) - h_ab
+        out[k] = max(R1, R2)
+    return out
+
+
+def kg_reward(a, b, c, d):
+    """
+    Calculate the knowledge-gradient reward of many (instance, worker) pairs at once.
+    This is the same computation as the body of the loop in Algorithm._select_inst_wrk, written with NumPy arrays
+    so that all the candidate pairs are evaluated in one batched pass, or as one fused compiled loop with numba
+    :param a: array of a-i of the instance in each pair
+    :param b: array of b-i of the instance in each pair
+    :param c: array of c-j of the worker in each pair
+    :param d: array of d-j of the worker in each pair
+    :return: array of max(R1, R2) for each pair
+    """
+    if BACKEND == 'numba':
+        return _kg_reward_fused(np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64),
+                                np.asarray(c, dtype=np.float64), np.asarray(d, dtype=np.float64))
+    I_ab = Beta_ab_cdf_batch(a, b)
+    h_ab = np.maximum(I_ab, 1 - I_ab)
+    # z == 1
+    new_a, new_b = _match_ab(a, b, c, d)
+    I_ab_new = Beta_ab_cdf_batch(new_a, new_b)
+    R1 = np.maximum(I_ab_new, 1 - I_ab_new) - h_ab
+    # z == 0
+    new_a, new_b = _match_ab(a, b, d, c)
+    I_ab_new = Beta_ab_cdf_batch(new_a, new_b)
+    R2 = np.maximum(I_ab_new, 1 - I_ab_new) - h_ab
+
+    return np.maximum(R1, R2)
+
+
+def warm_up():
+    """
+    Compile the kernels now, calling them on a few values, so that the compilation is not counted in the time of
+    their first real call. Nothing is compiled with the NumPy backend
+    :return: None
+    """
+    x = np.ones(2)
+    kg_reward(x, x, x, x)
+    Beta_ab_cdf_batch(x, x)
+    Beta_ab_cdf_scalar(1.0, 2.0)
+
+
+def _test_kernels():
+    # compare with the formulas written out for each label
+    rng = np.random.RandomState(0)
+    a, b, c, d = rng.uniform(0.5, 20, (4, 1000))
+    z = rng.randint(0, 2, 1000)
+    exp_theta = np.where(z == 1, a * ((a + 1) * c + b * d) / ((a + b + 1) * (a * c + b * d)),
+                         a * (b * c + (a + 1) * d) / ((a + b + 1) * (b * c + a * d)))
+    exp_theta_square = np.where(z == 1,
+                                a * (a + 1) * ((a + 2) * c + b * d) / ((a + b + 1) * (a + b + 2) * (a * c + b * d)),
+                                a * (a + 1) * (b * c + (a + 2) * d) / ((a + b + 1) * (a + b + 2) * (b * c + a * d)))
+    new_a = exp_theta * (exp_theta - exp_theta_square) / (exp_theta_square - np.square(exp_theta))
+    assert np.array_equal(posterior_ab(a, b, c, d, z)[0], new_a)
+    exp_rho = np.where(z == 1, c * (a * (c + 1) + b * d) / ((c + d + 1) * (a * c + b * d)),
+                       c * (b * (c + 1) + a * d) / ((c + d + 1) * (b * c + a * d)))
+    exp_rho_square = np.where(z == 1,
+                              c * (c + 1) * (a * (c + 2) + b * d) / ((c + d + 1) * (c + d + 2) * (a * c + b * d)),
+                              c * (c + 1) * (b * (c + 2) + a * d) / ((c + d + 1) * (c + d + 2) * (b * c + a * d)))
+    new_d = (1 - exp_rho) * (exp_rho - exp_rho_square) / (exp_rho_square - np.square(exp_rho))
+    assert np.array_equal(posterior_cd(a, b, c, d, z)[1], new_d)
+    assert posterior_ab(a[0], b[0], c[0], d[0], z[0]) == (posterior_ab(a, b, c, d, z)[0][0],
+                                                          posterior_ab(a, b, c, d, z)[1][0])
+    print('kernels match the scalar formulas')
+    print(kernel_backend())
+
+
+def _check_backend():
+    """
+    Check the backend of this process: the scalar and the batch I(a,b) are the same bit for bit, and the reference
+    loop picks the pairs of the incremental engine on a simulated dataset
+    """
+    from simulator import simulate_crowd_data
+    from dataset import DataSource
+    from workers import Worker
+    from algorithm import Algorithm
+    rng = np.random.RandomState(1)
+    a, b = np.exp(rng.uniform(-2, 8.5, (2, 1000)))
+    assert all(Beta_ab_cdf_scalar(x, y) == v for x, y, v in zip(a, b, Beta_ab_cdf_batch(a, b)))
+    data = simulate_crowd_data(200, 50, 10, seed=0)
+    H_T = [Algorithm(DataSource(data, 1, 1), Worker(data, 4, 1), 400, engine=engine).run_Opt_KG()
+           for engine in ('loop', 'incremental')]
+    assert H_T[0] == H_T[1]
+    print(BACKEND + ': the loop and the engine pick the same pairs')
+
+
+def _test_backends():
+    # the two backends agree to 5e-14, and with each of them the loop and the engines pick the same pairs
+    import subprocess
+    backends = ['numpy']
+    if importlib.util.find_spec('numba') is not None:
+        backends.append('numba')
+        rng = np.random.RandomState(0)
+        a, b = np.exp(rng.uniform(-2, 8.5, (2, 100000)))
+        assert np.abs(_I_half_array(a, b) - _I_half_betainc(a, b)).max() < 5e-14
+    for backend in backends:
+        env = dict(os.environ, TA_KERNEL_BACKEND=backend)
+        print(subprocess.run([sys.executable, '-c', 'import kernels; kernels._check_backend()'],
+                             cwd=os.path.dirname(os.path.abspath(__file__)), env=env, capture_output=True, text=True,
+                             check=True).stdout.strip())
+
+
+if __name__ == '__main__':
+    _test_kernels()
+    _test_backends()
@@ -0,0 +1,230 @@
+import os
+import json
+import shutil
+import tempfile
+import numpy as np
+
+
+# the directory of the data files, it can be set with the environment variable TA_DATA_PATH
+DATA_PATH = os.environ.get('TA_DATA_PATH', '.')
+# a compiled data file is the directory <file><COMPILED_SUFFIX> next to the text file
+COMPILED_SUFFIX = '.compiled'
+# version of the compiled format, bump it when the arrays or their dtypes change
+_COMPILED_VERSION = 1
+
+
+class CrowdData:
+    """
+    The crowd labeling data of one file in columnar form, shared by DataSource and Worker.
+
+    The instances ("orig_id") and the workers ("!amt_worker_ids") are replaced by dense integer codes. The labels are
+    grouped by instance in CSR style: the labels of the i-th instance are the positions inst_ptr[i] to
+    inst_ptr[i + 1] of the worker index and response arrays, in the order they appear in the file.
+    The instances are sorted by orig_id and the workers are in order of first appearance, the same orders
+    DataSource and Worker always had.
+    """
+
+    def __init__(self, inst_ids, wrk_ids, inst_ptr, wrk_idx, response, gold):
+        """
+        :param inst_ids: list of the orig_id of each instance code
+        :param wrk_ids: list of the worker id of each worker code
+        :param inst_ptr: int array of length len(inst_ids) + 1, offsets of the labels of each instance
+        :param wrk_idx: int array, the worker code of each label
+        :param response: int array, the response of each label
+        :param gold: int array, the gold answer of each instance
+        """
+        self._inst_ids = inst_ids
+        self._wrk_ids = wrk_ids
+        self._inst_ptr = inst_ptr
+        self._wrk_idx = wrk_idx
+        self._response = response
+        self._gold = gold
+
+
+    def get_inst_id_list(self):
+        """
+        :return: the list of orig_id, indexed by instance code
+        """
+        return self._inst_ids
+
+
+    def get_worker_id_list(self):
+        """
+        :return: the list of worker ids, indexed by worker code
+        """
+        return self._wrk_ids
+
+
+    def get_inst_ptr(self):
+        """
+        :return: offsets of the labels of each instance in the worker index and response arrays
+        """
+        return self._inst_ptr
+
+
+    def get_worker_index(self):
+        """
+        :return: the worker code of each label
+        """
+        return self._wrk_idx
+
+
+    def get_response(self):
+        """
+        :return: the response of each label
+        """
+        return self._response
+
+
+    def get_gold(self):
+        """
+        :return: the gold answer of each instance
+        """
+        return self._gold
+
+
+def load_crowd_data(filename, data_path=None, mmap=True):
+    """
+    Load a crowd labeling file in the RTE schema (orig_id, !amt_worker_ids, response, gold).
+    If the file has been compiled by compile_crowd_data and the compiled copy is up to date, the arrays are
+    memory-mapped from it instead of parsing the text file
+    :param filename: dataset filename(format ending should not be forgotten), relative to data_path
+    :param data_path: the directory of the file, default is DATA_PATH
+    :param mmap: memory-map the compiled arrays instead of reading them into memory
+    :return: CrowdData
+    """
+    if data_path is None:
+        data_path = DATA_PATH
+    filepath = os.path.join(data_path, filename)
+    if _is_compiled(filepath):
+        return load_compiled_crowd_data(filepath + COMPILED_SUFFIX, mmap)
+    return _read_crowd_data(filepath)
+
+
+def _read_crowd_data(filepath):
+    """
+    Read the text file in a single pass. pandas is only imported here, the compiled copies do not need it
+    :param filepath: path of the file
+    :return: CrowdData
+    """
+    import pandas as pd
+    df = pd.read_csv(filepath, sep='\t',
+                     usecols=['orig_id', '!amt_worker_ids', 'response', 'gold'])
+    inst_codes, inst_ids = pd.factorize(df['orig_id'], sort=True)
+    wrk_codes, wrk_ids = pd.factorize(df['!amt_worker_ids'], sort=False)
+    # group the labels by instance, keeping the order of the file inside each instance
+    order = np.argsort(inst_codes, kind='stable')
+    inst_ptr = np.zeros(len(inst_ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(inst_codes, minlength=len(inst_ids)), out=inst_ptr[1:])
+    wrk_idx = wrk_codes[order].astype(np.int64)
+    response = df['response'].to_numpy(dtype=np.int64)[order]
+    gold = df['gold'].to_numpy(dtype=np.int64)[order][inst_ptr[:-1]]
+
+    return CrowdData(inst_ids.tolist(), wrk_ids.tolist(), inst_ptr, wrk_idx, response, gold)
+
+
+def _source_stamp(filepath):
+    """
+    :return: what identifies the version of the text file a compiled copy was made from
+    """
+    stat = os.stat(filepath)
+    return {'version': _COMPILED_VERSION, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _is_compiled(filepath):
+    """
+    :return: whether the file has a compiled copy made from its current content
+    """
+    meta_path = os.path.join(filepath + COMPILED_SUFFIX, 'meta.json')
+    if not os.path.exists(meta_path):
+        return False
+    if not os.path.exists(filepath):
+        # only the compiled copy is around
+        return True
+    with open(meta_path) as f:
+        meta = json.load(f)
+    return meta.get('source') == _source_stamp(filepath)
+
+
+def save_crowd_data(data, directory, source=None):
+    """
+    Write CrowdData to a directory of .npy files with compact dtypes. The directory is written next to its final
+    place and renamed at the end, so concurrent readers never see a half written copy
+    :param data: CrowdData
+    :param directory: the directory to create (an existing one is replaced)
+    :param source: stamp of the text file the data comes from, stored to detect stale copies
+    :return: None
+    """
+    parent = os.path.dirname(os.path.abspath(directory))
+    tmp_dir = tempfile.mkdtemp(dir=parent, prefix='.tmp-')
+    np.save(os.path.join(tmp_dir, 'inst_ids.npy'), np.array(data.get_inst_id_list()), allow_pickle=False)
+    np.save(os.path.join(tmp_dir, 'worker_ids.npy'), np.array(data.get_worker_id_list()), allow_pickle=False)
+    np.save(os.path.join(tmp_dir, 'inst_ptr.npy'), data.get_inst_ptr().astype(np.int64))
+    np.save(os.path.join(tmp_dir, 'worker_index.npy'), data.get_worker_index().astype(np.int32))
+    np.save(os.path.join(tmp_dir, 'response.npy'), data.get_response().astype(np.int8))
+    np.save(os.path.join(tmp_dir, 'gold.npy'), data.get_gold().astype(np.int8))
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump({'version': _COMPILED_VERSION, 'source': source}, f)
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.replace(tmp_dir, directory)
+
+
+def load_compiled_crowd_data(directory, mmap=True):
+    """
+    Load CrowdData written by save_crowd_data. With mmap the label arrays are memory-mapped read only, so all the
+    processes loading the same copy share the page cache instead of each holding its own arrays
+    :param directory: the directory written by save_crowd_data
+    :param mmap: memory-map the arrays instead of reading them into memory
+    :return: CrowdData
+    """
+    with open(os.path.join(directory, 'meta.json')) as f:
+        meta = json.load(f)
+    if meta.get('version') != _COMPILED_VERSION:
+        raise ValueError('unsupported compiled data version in ' + directory)
+    mmap_mode = 'r' if mmap else None
+    arrays = {}
+    for name in ('inst_ptr', 'worker_index', 'response', 'gold'):
+        arrays[name] = np.load(os.path.join(directory, name + '.npy'), mmap_mode=mmap_mode)
+    inst_ids = np.load(os.path.join(directory, 'inst_ids.npy')).tolist()
+    wrk_ids = np.load(os.path.join(directory, 'worker_ids.npy')).tolist()
+
+    return CrowdData(inst_ids, wrk_ids, arrays['inst_ptr'], arrays['worker_index'], arrays['response'],
+                     arrays['gold'])
+
+
+def compile_crowd_data(filename, data_path=None):
+    """
+    Parse a text data file once and write its compiled copy next to it, load_crowd_data then uses the copy.
+    Nothing is done when the copy is already up to date
+    :param filename: dataset filename(format ending should not be forgotten), relative to data_path
+    :param data_path: the directory of the file, default is DATA_PATH
+    :return: the directory of the compiled copy
+    """
+    if data_path is None:
+        data_path = DATA_PATH
+    filepath = os.path.join(data_path, filename)
+    if not _is_compiled(filepath):
+        save_crowd_data(_read_crowd_data(filepath), filepath + COMPILED_SUFFIX, _source_stamp(filepath))
+
+    return filepath + COMPILED_SUFFIX
+
+
+def _test_loader():
+    data = load_crowd_data('rte.standardized.tsv')
+    inst_ptr = data.get_inst_ptr()
+    print(len(data.get_inst_id_list()), len(data.get_worker_id_list()), inst_ptr[-1])
+    print(data.get_inst_id_list()[0], data.get_worker_index()[inst_ptr[0]:inst_ptr[1]], data.get_gold()[0])
+    compiled = load_compiled_crowd_data(compile_crowd_data('rte.standardized.tsv'))
+    assert compiled.get_inst_id_list() == data.get_inst_id_list()
+    assert (compiled.get_worker_index() == data.get_worker_index()).all()
+
+
+if __name__ == '__main__':
+    # python loader.py file1.tsv file2.tsv ... compiles the given files, without arguments it runs the test
+    import sys
+    if len(sys.argv) > 1:
+        for filename in sys.argv[1:]:
+            print(compile_crowd_data(filename))
+    else:
+        _test_loader()
@@ -1,26 +1,24 @@
-import numpy as np
-from scipy.stats import beta
-from numba import jit
-import pickle
+from beta_cache import BetaCache
+from kernels import posterior_ab
 
 
+# the cache of I(a,b) used by Beta_ab_cdf, it stays in memory unless configure_beta_cache is given a file
+beta_cache = BetaCache(capacity=2 ** 20)
 
-"""
-Load the beta distribution dictionary from txt into python
-:return: None
-"""
-try:
-    with open('beta_dic.txt','rb') as f:
-        beta_dic = pickle.load(f)
-        if not isinstance(beta_dic, dict):
-            beta_dic = {}
-except EOFError:
-    beta_dic = {}
 
-print('beta_ab dictionary successful initialization')
+def configure_beta_cache(capacity=2 ** 20, quantum=None, path=None):
+    """
+    Replace the cache used by Beta_ab_cdf, see BetaCache for the meaning of the parameters
+    :param capacity: max number of entries kept in memory, None for no bound
+    :param quantum: grid step of the quantized keys, None for exact keys
+    :param path: file of the on-disk store, None for a memory only cache
+    :return: the new cache
+    """
+    global beta_cache
+    beta_cache = BetaCache(capacity, quantum, path)
+    return beta_cache
 
 
-@jit
 def new_a_b(a, b, c, d, z):
     """
     Calculate the new a and new b when traversing all the available instances and the corresponding workers
@@ -32,31 +30,20 @@ def new_a_b(a, b, c, d, z):
     :param z: label z
     :return: corresponding new a and new b
     """
-    if z == 1:
-        exp_theta = a * ((a + 1) * c + b * d) / ((a + b + 1) * (a * c + b * d))
-        exp_theta_square = a * (a + 1) * ((a + 2) * c + b * d) / ((a + b + 1) * (a + b + 2) * (a * c + b * d))
-    elif z == 0:         # the RTE dataset have two label results : 0 and 1, different from the paper
-        exp_theta = a * (b * c + (a + 1) * d) / ((a + b + 1) * (b * c + a * d))
-        exp_theta_square = a * (a + 1) * (b * c + (a + 2) * d) / ((a + b + 1) * (a + b + 2) * (b * c + a * d))
-    else:
-        raise ValueError
-    new_a = exp_theta * (exp_theta - exp_theta_square) / (exp_theta_square - np.square(exp_theta))
-    new_b = (1 - exp_theta) * (exp_theta - exp_theta_square)/(exp_theta_square - np.square(exp_theta))
-
-    return new_a, new_b
-
-@jit
+    return posterior_ab(a, b, c, d, z)
+
 def Beta_ab_cdf(a, b):
     """
-    calculate I(a,b) defined in the paper, using the function beta.sf
+    calculate I(a,b) defined in the paper, the scalar version of Beta_ab_cdf_batch looked up in beta_cache.
+    The values are those of Beta_ab_cdf_batch and no longer beta.sf(0.5, a, b): the two differ by less than 5e-14,
+    which is enough to flip the choice between two nearly tied pairs, so the output of the loop may differ from the
+    one of earlier versions. Cache files written by earlier versions hold beta.sf values
     :param a: beta distribution parameter a
     :param b: beta distribution parameter b
     :return: Pr( theta > 0.5 | theta ~ Beta(a, b) )
     """
 
-    if beta_dic.get((a, b)) == None:
-        beta_dic[(a, b)] = beta.sf(0.5,a, b)
-    I_ab = beta_dic[(a, b)]
+    I_ab = beta_cache.get(a, b)
     # a = float(a)
     # b = float(b)
     # I_ab = 1 - eng.cdf('Beta', 0.5, a, b)
@@ -68,32 +55,21 @@ def Beta_ab_cdf(a, b):
 
 def save_beta_dic():
     """
-    Save the beta distribution dictionary to 'beta_dic.txt' using pickle
+    Append the new entries of beta_cache to its on-disk store, if it has one
     :return: None
     """
-    f = open('beta_dic.txt','wb')
-    pickle.dump(beta_dic, f)
-    f.close()
+    beta_cache.flush()
 
 
 def load_beta_dic():
     """
-    Load the beta distribution dictionary from txt into python
+    Load the on-disk store of beta_cache into memory now instead of at the first lookup
     :return: None
     """
-    try:
-        with open('beta_dic.txt','rb') as f:
-            _beta_dic = pickle.load(f)
-            if not isinstance(_beta_dic, dict):
-                _beta_dic = {}
-    except EOFError:
-        _beta_dic = {}
-
-    beta_dic = _beta_dic
+    beta_cache.load()
 
 
 
-@jit
 def h_function(I):
     """
     h function as defined in the paper
@@ -111,6 +87,21 @@ def _test_math_util():
     b = 1
     I_ab = Beta_ab_cdf(a, b)
     print(I_ab)
+    # the batch values are within 5e-14 of beta.sf and the scalar ones are the batch ones
+    import numpy as np
+    from scipy.stats import beta
+    from kernels import Beta_ab_cdf_batch
+    rng = np.random.RandomState(0)
+    a, b = np.exp(rng.uniform(np.log(0.1), np.log(5000), (2, 20000)))
+    I_ab = Beta_ab_cdf_batch(a, b)
+    assert np.abs(I_ab - beta.sf(0.5, a, b)).max() < 5e-14
+    assert all(Beta_ab_cdf(x, y) == v for x, y, v in zip(a[:2000], b[:2000], I_ab[:2000]))
+    # pin a few values of the continued fraction, beta.sf gives 0.08984375, 0.678355028253913 and 0.8048897982879893
+    from kernels import BACKEND
+    if BACKEND == 'numba':
+        assert Beta_ab_cdf(3, 7) == 0.08984374999999985
+        assert Beta_ab_cdf(250.5, 240.25) == 0.6783550282539117
+        assert Beta_ab_cdf(0.7, 0.2) == 0.8048897982879883
 
 
 
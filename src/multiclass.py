@@ -0,0 +1,363 @@
+import numpy as np
+from loader import CrowdData, load_crowd_data
+from engine import TournamentTree, _adjacency, _touched_pairs
+from kernels import Beta_ab_cdf_batch
+
+
+# The K-class version of Opt-KG.
+#
+# Every instance i has a Dirichlet(alpha_i) posterior on its class probabilities theta_i. Every worker j has the
+# symmetric confusion model of the binary case: he gives the true class with probability rho_j ~ Beta(c_j, d_j) and
+# any other class uniformly otherwise. After a label z the exact posteriors are mixtures, of Dirichlet(alpha + e_k)
+# for the instance and of Beta(c + 1, d), Beta(c, d + 1) for the worker, and they are moment matched back to a
+# Dirichlet and a Beta as in the paper's Appendix: the means and the second moment of the labeled class (of rho)
+# are matched. With K = 2 these are the updates of posterior_ab and posterior_cd.
+#
+# h(alpha) is the probability that the class with the largest alpha is the true class, Pr(theta_top = max_k
+# theta_k), so the output of an instance is right with probability h as in the binary case. With theta_k = G_k /
+# sum(G) for independent G_k ~ Gamma(alpha_k), it is the integral of the density of G_top times the product of the
+# cdfs of the other G_k, computed by a trapezoid rule in log x over the range holding all but about 1e-12 of it;
+# with K = 2 it is max(I, 1 - I) as in the binary case. The reward of a pair is the max over the K labels of the
+# one-label posterior's h minus h(alpha). With K = 2 that posterior is the moment matched one, which gives the binary
+# Opt-KG reward. With K > 2 it is the exact posterior, the mixture of the Dirichlet(alpha + e_k): the K components are
+# the same for every label, only their weights change, so the K labels share the 2K incomplete gamma functions of
+# each quadrature node and a reward costs O(K) of them per node, plus O(K^2) products.
+
+# number of nodes and mass left out of each tail of the quadrature of h
+_QUAD_NODES = 48
+_QUAD_TAIL = 1e-12
+# number of (pair, node, class) values of the quadrature held at once by kg_reward_multi
+_QUAD_BLOCK = 2 ** 18
+
+
+def posterior_alpha(alpha, c, d, z):
+    """
+    The new alpha of instances after workers (c, d) gave the labels z
+    :param alpha: (n, K) array, the alpha of each instance
+    :param c: (n,) array, c of the worker of each label
+    :param d: (n,) array, d of the worker of each label
+    :param z: (n,) int array, the labels
+    :return: (n, K) array of the new alpha
+    """
+    alpha = np.asarray(alpha, dtype=np.float64)
+    n, K = alpha.shape
+    rows = np.arange(n)
+    A = alpha.sum(axis=1)
+    a_z = alpha[rows, z]
+    r = c / (c + d)
+    # weights of the mixture components Dirichlet(alpha + e_k), w_k = lam * alpha_k for k != z
+    U = r * a_z + (1 - r) / (K - 1) * (A - a_z)
+    w_z = r * a_z / U
+    lam = (1 - r) / (K - 1) / U
+    mean = alpha * (1 + lam)[:, None] / (A + 1)[:, None]
+    mean[rows, z] = (a_z + w_z) / (A + 1)
+    m_z = mean[rows, z]
+    exp_square = (a_z * (a_z + 1) + 2 * w_z * (a_z + 1)) / ((A + 1) * (A + 2))
+    S = (m_z - exp_square) / (exp_square - np.square(m_z))
+
+    return mean * S[:, None]
+
+
+def posterior_cd_multi(alpha, c, d, z):
+    """
+    The new c and d of workers after they gave the labels z to instances alpha
+    :param alpha: (n, K) array, the alpha of each instance
+    :param c: (n,) array, c of the worker of each label
+    :param d: (n,) array, d of the worker of each label
+    :param z: (n,) int array, the labels
+    :return: new c and new d arrays
+    """
+    alpha = np.asarray(alpha, dtype=np.float64)
+    n, K = alpha.shape
+    m_z = alpha[np.arange(n), z] / alpha.sum(axis=1)
+    # weight of the component Beta(c + 1, d), the worker was right
+    v = c * m_z / (c * m_z + d * (1 - m_z) / (K - 1))
+    exp_rho = (c + v) / (c + d + 1)
+    exp_rho_square = (c * (c + 1) + 2 * v * (c + 1)) / ((c + d + 1) * (c + d + 2))
+    S = (exp_rho - exp_rho_square) / (exp_rho_square - np.square(exp_rho))
+
+    return exp_rho * S, (1 - exp_rho) * S
+
+
+def _class_max_probs(alpha):
+    """
+    The probability that each class is the true class, Pr(theta_c = max_k theta_k), under Dirichlet(alpha) and under
+    every Dirichlet(alpha + e_k). All of them are integrals over the same nodes of the densities and the cdfs of the
+    G_k ~ Gamma(alpha_k) and Gamma(alpha_k + 1), so the 2K incomplete gamma functions of a node serve all of them
+    :param alpha: (n, K) array, the alpha of each instance
+    :return: (n, K) array of the probabilities under alpha and (n, K, K) array whose [:, k, c] is the probability of
+             class c under alpha + e_k
+    """
+    from scipy.special import gammainc, gammaincinv, gammainccinv, gammaln
+    n, K = alpha.shape
+    a_top = alpha.max(axis=1)
+    A = alpha.sum(axis=1)
+    # below x0 any integrand is at most x^(alpha_c - 1) / Gamma(alpha_c) * prod x^alpha_k / Gamma(alpha_k + 1), whose
+    # integral is at most _QUAD_TAIL at the x0 below, and a class other than the top one is at most the cdf of G_top,
+    # so the integrals start at the largest of x0 and a quantile of G_top. They end at a quantile of Gamma(a_top + 1)
+    log_x0 = (np.log(_QUAD_TAIL) + np.log(A) + gammaln(alpha + 1).sum(axis=1) - np.log(a_top)) / A
+    lo = np.maximum(np.log(np.maximum(gammaincinv(a_top, _QUAD_TAIL), 1e-300)), log_x0)
+    hi = np.log(gammainccinv(a_top + 1, _QUAD_TAIL))
+    step = (hi - lo) / (_QUAD_NODES - 1)
+    weight = np.ones(_QUAD_NODES)
+    weight[[0, -1]] = 0.5
+    t = (lo[:, None] + step[:, None] * np.arange(_QUAD_NODES))[:, :, None]
+    x = np.exp(t)
+    a = alpha[:, None, :]
+    P = gammainc(a, x)
+    # the densities of the log(G_k) at the nodes times the trapezoid weights, and the cdfs of the other classes from
+    # prefix and suffix products
+    g = np.exp(a * t - x - gammaln(a)) * (step[:, None] * weight)[:, :, None]
+    ones = np.ones((n, _QUAD_NODES, 1))
+    prefix = np.cumprod(np.concatenate((ones, P[:, :, :-1]), axis=2), axis=2)
+    suffix = np.cumprod(np.concatenate((ones, P[:, :, :0:-1]), axis=2), axis=2)[:, :, ::-1]
+    gE = g * prefix * suffix
+    # alpha + e_k turns the cdf of class k into gammainc(alpha_k + 1, x) and its density into g * x / alpha_k
+    ratio = gammainc(a + 1, x) / np.where(P > 0, P, 1.0)
+    Q = np.matmul(ratio.transpose(0, 2, 1), gE)
+    Q[:, np.arange(K), np.arange(K)] = (gE * x).sum(axis=1) / alpha
+
+    return gE.sum(axis=1), Q
+
+
+def _h_multi(alpha):
+    """
+    :param alpha: (n, K) array, the alpha of each instance
+    :return: (n,) array, the probability that the class with the largest alpha is the true class
+    """
+    if alpha.shape[1] == 2:
+        I = Beta_ab_cdf_batch(alpha[:, 1], alpha[:, 0])
+        return np.maximum(I, 1 - I)
+
+    return _class_max_probs(alpha)[0].max(axis=1)
+
+
+def kg_reward_multi(alpha, c, d):
+    """
+    The knowledge-gradient reward of asking workers (c, d) to label instances alpha, see the top of the module
+    :param alpha: (n, K) array, the alpha of each instance
+    :param c: (n,) array
+    :param d: (n,) array
+    :return: (n,) array of the rewards
+    """
+    alpha = np.asarray(alpha, dtype=np.float64)
+    n, K = alpha.shape
+    A = alpha.sum(axis=1)
+    r = c / (c + d)
+    if K == 2:
+        # the binary Opt-KG reward, on the moment matched posteriors
+        h_now = _h_multi(alpha)
+        h_best = np.full(n, -np.inf)
+        for z in range(0, K):
+            a_z = alpha[:, z]
+            U = r * a_z + (1 - r) / (K - 1) * (A - a_z)
+            w_z = r * a_z / U
+            lam = (1 - r) / (K - 1) / U
+            m_z = (a_z + w_z) / (A + 1)
+            exp_square = (a_z * (a_z + 1) + 2 * w_z * (a_z + 1)) / ((A + 1) * (A + 2))
+            S = (m_z - exp_square) / (exp_square - np.square(m_z))
+            # the labeled class gets m_z * S, the other classes are scaled by the same factor
+            new_alpha = alpha * ((1 + lam) * S / (A + 1))[:, None]
+            new_alpha[:, z] = m_z * S
+            h_best = np.maximum(h_best, _h_multi(new_alpha))
+        return h_best - h_now
+    # the label z of a worker gives the mixture of the Dirichlet(alpha + e_k) with weights alpha_k * q, alpha_z * r
+    # for k = z, over U_z, so Pr(class c | z) = (q * sum_k alpha_k Q[k, c] + (r - q) * alpha_z Q[z, c]) / U_z
+    q = (1 - r) / (K - 1)
+    reward = np.empty(n)
+    block = max(1, _QUAD_BLOCK // (_QUAD_NODES * K))
+    for start in range(0, n, block):
+        part = slice(start, start + block)
+        P0, Q = _class_max_probs(alpha[part])
+        M = alpha[part, :, None] * Q
+        U = q[part, None] * A[part, None] + (r - q)[part, None] * alpha[part]
+        prob = (q[part, None, None] * M.sum(axis=1)[:, None, :] + (r - q)[part, None, None] * M) / U[:, :, None]
+        reward[part] = prob.max(axis=2).max(axis=1) - P0.max(axis=1)
+
+    return reward
+
+
+class MultiClassOptKG:
+    """
+    Opt-KG for labels in K classes, with the model at the top of the module.
+
+    The pairs are kept in a flat table in the order of the dataset as in IncrementalOptKGEngine, with their rewards
+    in a TournamentTree: a label rescores only the pending pairs of the labeled instance and of the worker, so a step
+    costs O(degree * K) incomplete gamma functions per quadrature node, and ties go to the first pair of the
+    dataset.
+    """
+
+    def __init__(self, filename, alpha0, c0, d0, budget, num_classes=None, data_path=None):
+        """
+        :param filename: dataset filename(format ending should not be forgotten), or a CrowdData already loaded by
+                         load_crowd_data. The responses and the gold answers are the classes 0 .. K - 1
+        :param alpha0: the initial alpha of all the instances, a number or K numbers
+        :param c0: the initial c0 parameter for all the workers
+        :param d0: the initial d0 parameter for all the workers
+        :param budget: the given experiment budget T
+        :param num_classes: the number K of classes, default is one more than the largest class in the data
+        :param data_path: the directory of the file, default is loader.DATA_PATH
+        """
+        if isinstance(filename, CrowdData):
+            self._data = filename
+        else:
+            self._data = load_crowd_data(filename, data_path)
+        response = np.asarray(self._data.get_response(), dtype=np.int64)
+        gold = np.asarray(self._data.get_gold(), dtype=np.int64)
+        if num_classes is None:
+            num_classes = max(2, int(response.max(initial=0)) + 1, int(gold.max(initial=0)) + 1)
+        if num_classes < 2 or response.min(initial=0) < 0 or response.max(initial=0) >= num_classes:
+            raise ValueError('the responses must be classes 0 .. ' + str(num_classes - 1))
+        self._K = num_classes
+        self._T = budget
+        self._inst_ids = list(self._data.get_inst_id_list())
+        self._wrk_ids = list(self._data.get_worker_id_list())
+        self._gold = gold
+        # posteriors of the instances and of the workers
+        self._alpha = np.empty((len(self._inst_ids), self._K), dtype=np.float64)
+        self._alpha[:] = alpha0
+        self._c = np.full(len(self._wrk_ids), c0, dtype=np.float64)
+        self._d = np.full(len(self._wrk_ids), d0, dtype=np.float64)
+        # the flat pair table in the order of the dataset, a worker labeling an instance twice is read at his first
+        # label as in Algorithm
+        inst_ptr = np.asarray(self._data.get_inst_ptr(), dtype=np.int64)
+        self._pair_inst = np.repeat(np.arange(len(self._inst_ids)), np.diff(inst_ptr))
+        self._pair_wrk = np.asarray(self._data.get_worker_index(), dtype=np.int64)
+        first = np.unique(self._pair_inst * len(self._wrk_ids) + self._pair_wrk, return_index=True,
+                          return_inverse=True)
+        self._pair_resp = response[first[1][first[2]]]
+        self._active = np.ones(len(self._pair_inst), dtype=bool)
+        self._inst_ptr, self._wrk_pairs, self._wrk_ptr = _adjacency(self._pair_inst, self._pair_wrk,
+                                                                    len(self._inst_ids), len(self._wrk_ids))
+        self._tree = TournamentTree(self._rewards(np.arange(len(self._pair_inst))))
+        # instances that have been chosen
+        self._chosen_mask = np.zeros(len(self._inst_ids), dtype=bool)
+        self._steps = 0
+
+
+    def _rewards(self, pairs):
+        """
+        :return: the rewards of the given pairs
+        """
+        i = self._pair_inst[pairs]
+        j = self._pair_wrk[pairs]
+
+        return kg_reward_multi(self._alpha[i], self._c[j], self._d[j])
+
+
+    def _step(self):
+        """
+        Select the pair with the max reward, acquire its label and update the posteriors
+        :return: None
+        """
+        pair, R_max = self._tree.top()
+        assert self._active[pair]
+        i = self._pair_inst[pair]
+        j = self._pair_wrk[pair]
+        z = self._pair_resp[pair:pair + 1]
+        alpha = self._alpha[i:i + 1]
+        c = self._c[j:j + 1]
+        d = self._d[j:j + 1]
+        new_c, new_d = posterior_cd_multi(alpha, c, d, z)
+        self._alpha[i] = posterior_alpha(alpha, c, d, z)[0]
+        self._c[j] = new_c[0]
+        self._d[j] = new_d[0]
+        self._active[pair] = False
+        self._tree.update([pair], [-np.inf])
+        touched = _touched_pairs(self._inst_ptr, self._wrk_pairs, self._wrk_ptr, self._active, i, j)
+        if touched.size > 0:
+            self._tree.update(touched, self._rewards(touched))
+        self._chosen_mask[i] = True
+        self._steps = self._steps + 1
+
+
+    def run_Opt_KG(self):
+        """
+        Run the steps left up to the budget
+        :return: {orig_id: predicted class} of the chosen instances, in the order of the dataset
+        """
+        while self._steps < self._T:
+            self._step()
+
+        return self.predictions()
+
+
+    def predictions(self):
+        """
+        :return: {orig_id: class with the largest alpha} of the chosen instances, ties to the smallest class
+        """
+        chosen = np.flatnonzero(self._chosen_mask)
+        labels = np.argmax(self._alpha[chosen], axis=1)
+
+        return {self._inst_ids[i]: k for i, k in zip(chosen.tolist(), labels.tolist())}
+
+
+    def get_alpha(self):
+        """
+        :return: (number of instances, K) array of the alpha of the instances, in the order of the dataset
+        """
+        return self._alpha
+
+
+    def get_worker_params(self):
+        """
+        :return: arrays of the c and the d of the workers, in the order of the dataset
+        """
+        return self._c, self._d
+
+
+    def evaluate(self):
+        """
+        Score the chosen instances against the gold answers. The accuracy is the number of chosen instances whose
+        predicted class is the gold one over the number of instances, as the binary accuracy
+        :return: dict with the accuracy and the (K, K) confusion matrix, rows gold and columns predicted classes
+        """
+        chosen = np.flatnonzero(self._chosen_mask)
+        gold = self._gold[chosen]
+        known = (gold >= 0) & (gold < self._K)
+        predicted = np.argmax(self._alpha[chosen], axis=1)
+        confusion = np.bincount(gold[known] * self._K + predicted[known],
+                                minlength=self._K * self._K).reshape(self._K, self._K)
+
+        return {'accuracy': float(np.trace(confusion)) / len(self._inst_ids), 'confusion': confusion}
+
+
+def _test_multiclass():
+    from dataset import DataSource
+    from workers import Worker
+    from algorithm import Algorithm
+    from kernels import posterior_ab, posterior_cd, kg_reward
+    # K = 2 is the binary model
+    rng = np.random.RandomState(0)
+    a, b, c, d = rng.uniform(0.5, 20, (4, 1000))
+    z = rng.randint(0, 2, 1000)
+    alpha = np.stack((b, a), axis=1)
+    new_a, new_b = posterior_ab(a, b, c, d, z)
+    assert np.allclose(posterior_alpha(alpha, c, d, z), np.stack((new_b, new_a), axis=1), rtol=1e-10)
+    assert np.allclose(np.stack(posterior_cd_multi(alpha, c, d, z)), np.stack(posterior_cd(a, b, c, d, z)),
+                       rtol=1e-10)
+    assert np.allclose(kg_reward_multi(alpha, c, d), kg_reward(a, b, c, d), rtol=1e-8, atol=1e-12)
+    # h against Monte Carlo estimates of the probability that the largest alpha is the true class
+    for alpha in (np.ones((1, 10)), rng.uniform(0.3, 30, (20, 10)), rng.uniform(0.3, 300, (20, 3))):
+        G = rng.gamma(alpha[:, None, :], size=(len(alpha), 100000, alpha.shape[1]))
+        estimate = np.mean(np.argmax(G, axis=2) == np.argmax(alpha, axis=1)[:, None], axis=1)
+        assert np.abs(_h_multi(alpha) - estimate).max() < 0.01
+    assert abs(_h_multi(np.ones((1, 10)))[0] - 0.1) < 1e-9
+    # the shared quadrature of the Dirichlet(alpha + e_k) against a quadrature of each of them
+    for alpha in (rng.uniform(0.3, 30, (20, 3)), rng.uniform(0.3, 300, (20, 5)), rng.uniform(0.3, 1, (20, 10))):
+        P0, Q = _class_max_probs(alpha)
+        shifted = np.stack([_class_max_probs(alpha + np.eye(alpha.shape[1])[k])[0] for k in range(alpha.shape[1])],
+                           axis=1)
+        assert np.abs(Q - shifted).max() < 1e-9 and np.abs(P0.sum(axis=1) - 1).max() < 1e-9
+        c, d = rng.uniform(0.5, 10, (2, len(alpha)))
+        assert kg_reward_multi(alpha, c, d).min() > -1e-12
+    filename = 'rte.standardized.tsv'
+    Budget = 800
+    Opt_KG = MultiClassOptKG(filename, 1, 4, 1, Budget)
+    predictions = Opt_KG.run_Opt_KG()
+    H_T, H_complement = Algorithm(DataSource(filename, 1, 1), Worker(filename, 4, 1), Budget).run_Opt_KG()
+    print(len(set(H_T + H_complement) ^ set(predictions)), Opt_KG.evaluate())
+
+
+if __name__ == '__main__':
+    _test_multiclass()
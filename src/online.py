@@ -0,0 +1,259 @@
+import json
+import asyncio
+import numpy as np
+from dataset import DataSource
+from workers import Worker
+from engine import TournamentTree
+from kernels import kg_reward
+from loader import load_crowd_data
+
+
+class OnlineOptKG:
+    """
+    Opt-KG as an online service: the labels are not known up front, they are submitted as they arrive.
+
+    The service keeps the candidate (instance, worker) pairs that may be asked, each in a slot of a TournamentTree
+    holding its knowledge-gradient reward. A slot is a label position, as for Algorithm, so a pair registered twice
+    has two slots and can be asked twice. next_pair() reads the root, submit_label() updates the posteriors of one
+    instance and one worker through DataSource and Worker and rescores only the pending pairs of that instance and
+    that worker, so no query rescans all the pairs. New instances, workers and candidate pairs can be added at any
+    time without rebuilding DataSource or Worker. Ties are broken in favor of the pair added first, so adding the
+    pairs in the order of the dataset gives the same choices as Algorithm.run_Opt_KG
+    """
+
+    def __init__(self, instances, workers):
+        """
+        :param instances: the instances known at start (of type DataSource)
+        :param workers: the workers known at start (of type Worker)
+        """
+        self._instances = instances
+        self._workers = workers
+        self._param_of_all_insts = self._instances.get_all_inst_prior_distribution()
+        self._param_of_all_wrks = self._workers.get_all_worker_prior()
+        # the instance and the worker of each slot
+        self._slot_inst = []
+        self._slot_wrk = []
+        # the pending slots of each pair, {(orig_id, worker id): {slot: None}} in the order they were added
+        self._slots_of_pair = {}
+        self._num_pending = 0
+        # the pending slots of each instance and of each worker, dicts used as ordered sets
+        self._inst_slots = {}
+        self._wrk_slots = {}
+        self._tree = TournamentTree([], 1024)
+        # instances that have been labeled
+        self._chosen_inst = []
+
+
+    def _rescore(self, slots):
+        """
+        Recompute the rewards of the given pending slots
+        :param slots: list of slots
+        :return: None
+        """
+        if len(slots) == 0:
+            return
+        ab = np.array([self._param_of_all_insts[self._slot_inst[s]] for s in slots], dtype=np.float64)
+        cd = np.array([self._param_of_all_wrks[self._slot_wrk[s]] for s in slots], dtype=np.float64)
+        self._tree.update(slots, kg_reward(ab[:, 0], ab[:, 1], cd[:, 0], cd[:, 1]))
+
+
+    def add_instance(self, inst_id, gold=None):
+        """
+        Add an instance, nothing is done if it is already known
+        :param inst_id: "orig_id" of the instance
+        :param gold: the gold answer if known
+        :return: None
+        """
+        self._instances.add_instance(inst_id, gold)
+
+
+    def add_worker(self, wrk_id):
+        """
+        Add a worker, nothing is done if he is already known
+        :param wrk_id: worker ID
+        :return: None
+        """
+        self._workers.add_worker(wrk_id)
+
+
+    def add_candidates(self, inst_id, wrk_ids):
+        """
+        Register pairs that may be asked, unknown instances and workers are added on the way. Every worker gets a new
+        slot, also a worker already registered for the instance, as a worker appearing twice for an instance of the
+        dataset is two labels
+        :param inst_id: "orig_id" of the instance
+        :param wrk_ids: the workers who can label the instance
+        :return: None
+        """
+        self.add_instance(inst_id)
+        slots = []
+        for wrk_id in wrk_ids:
+            self.add_worker(wrk_id)
+            slot = len(self._slot_inst)
+            self._slot_inst.append(inst_id)
+            self._slot_wrk.append(wrk_id)
+            self._slots_of_pair.setdefault((inst_id, wrk_id), {})[slot] = None
+            self._inst_slots.setdefault(inst_id, {})[slot] = None
+            self._wrk_slots.setdefault(wrk_id, {})[slot] = None
+            slots.append(slot)
+        self._num_pending = self._num_pending + len(slots)
+        self._tree.resize(len(self._slot_inst))
+        self._rescore(slots)
+
+
+    def next_pair(self):
+        """
+        :return: (orig_id, worker id, reward) of the pending pair with the max reward, None if no pair is pending
+        """
+        if self._num_pending == 0:
+            return None
+        slot, R_max = self._tree.top()
+
+        return self._slot_inst[slot], self._slot_wrk[slot], float(R_max)
+
+
+    def submit_label(self, inst_id, wrk_id, z):
+        """
+        Update the posteriors with the label z the worker gave to the instance. The first pending slot of the pair
+        stops being pending, a label for a pair that was never registered is used for the update as well
+        :param inst_id: "orig_id" of the instance
+        :param wrk_id: worker ID
+        :param z: the label, 0 or 1
+        :return: None
+        """
+        self.add_instance(inst_id)
+        self.add_worker(wrk_id)
+        [a, b] = self._param_of_all_insts[inst_id]
+        [c, d] = self._param_of_all_wrks[wrk_id]
+        self._instances.update_parameter_a_b(inst_id, a, b, c, d, z)
+        self._workers.update_parameter_c_d(wrk_id, a, b, c, d, z)
+        self._chosen_inst.append(inst_id)
+        pending = self._slots_of_pair.get((inst_id, wrk_id))
+        if pending:
+            slot = next(iter(pending))
+            pending.pop(slot)
+            self._num_pending = self._num_pending - 1
+            self._inst_slots[inst_id].pop(slot)
+            self._wrk_slots[wrk_id].pop(slot)
+            self._tree.update([slot], [-np.inf])
+        touched = list(self._inst_slots.get(inst_id, {})) + list(self._wrk_slots.get(wrk_id, {}))
+        self._rescore(touched)
+
+
+    def output_set_Ht(self):
+        """
+        The positive set of the labeled instances, as Algorithm._output_set_Ht
+        :return: Ht, Ht_complement
+        """
+        Ht = []
+        Ht_complement = []
+        for key_ in set(self._chosen_inst):
+            [a, b] = self._param_of_all_insts[key_]
+            if a >= b:
+                Ht.append(key_)
+            else:
+                Ht_complement.append(key_)
+
+        return Ht, Ht_complement
+
+
+async def _handle_client(service, reader, writer):
+    """
+    Serve one connection, one JSON request per line and one JSON answer per line
+    """
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        try:
+            request = json.loads(line)
+            op = request['op']
+            if op == 'next':
+                pair = service.next_pair()
+                answer = {'ok': True, 'pair': None if pair is None else
+                          {'instance': pair[0], 'worker': pair[1], 'reward': pair[2]}}
+            elif op == 'submit':
+                service.submit_label(request['instance'], request['worker'], request['z'])
+                answer = {'ok': True}
+            elif op == 'add':
+                service.add_candidates(request['instance'], request.get('workers', []))
+                answer = {'ok': True}
+            else:
+                answer = {'ok': False, 'error': 'unknown op: ' + str(op)}
+        except (ValueError, KeyError, TypeError) as e:
+            answer = {'ok': False, 'error': repr(e)}
+        writer.write((json.dumps(answer) + '\n').encode())
+        await writer.drain()
+    writer.close()
+
+
+async def serve(service, host='127.0.0.1', port=8765):
+    """
+    Serve an OnlineOptKG on a local TCP port. Every request is a JSON line with an "op":
+    {"op": "next"}, {"op": "submit", "instance": .., "worker": .., "z": 0 or 1},
+    {"op": "add", "instance": .., "workers": [..]}
+    The requests are handled one at a time by the event loop, so the service needs no locking
+    :param service: OnlineOptKG
+    :return: None, runs until cancelled
+    """
+    server = await asyncio.start_server(lambda r, w: _handle_client(service, r, w), host, port)
+    async with server:
+        await server.serve_forever()
+
+
+def replay(filename, a0, b0, c0, d0, budget, data_path=None):
+    """
+    Drive an OnlineOptKG from a data file: every label position of the file is registered in the order of the
+    dataset, and the label of each asked pair is read from the file, the first label of the pair as Algorithm does
+    :param filename: dataset filename(format ending should not be forgotten)
+    :param budget: number of labels to submit
+    :return: Positive set H_T
+    """
+    crowd_data = load_crowd_data(filename, data_path)
+    service = OnlineOptKG(DataSource(crowd_data, a0, b0), Worker(crowd_data, c0, d0))
+    wrk_ids = crowd_data.get_worker_id_list()
+    inst_ptr = crowd_data.get_inst_ptr().tolist()
+    wrk_idx = crowd_data.get_worker_index().tolist()
+    response = crowd_data.get_response().tolist()
+    labels = {}
+    for i, key_ in enumerate(crowd_data.get_inst_id_list()):
+        wrks_list = [wrk_ids[j] for j in wrk_idx[inst_ptr[i]:inst_ptr[i + 1]]]
+        for wrk, z in zip(wrks_list, response[inst_ptr[i]:inst_ptr[i + 1]]):
+            labels.setdefault((key_, wrk), z)
+        service.add_candidates(key_, wrks_list)
+    for t in range(0, budget):
+        inst_id, wrk_id, R_max = service.next_pair()
+        service.submit_label(inst_id, wrk_id, labels[(inst_id, wrk_id)])
+
+    return service.output_set_Ht()
+
+
+def _test_online():
+    from algorithm import Algorithm
+    filename = 'rte.standardized.tsv'
+    Budget = 1000
+    H_T = replay(filename, 1, 1, 4, 1, Budget)
+    H_T_offline = Algorithm(DataSource(filename, 1, 1), Worker(filename, 4, 1), Budget).run_Opt_KG()
+    assert sorted(H_T[0]) == sorted(H_T_offline[0]) and sorted(H_T[1]) == sorted(H_T_offline[1])
+    print(H_T)
+    # workers labeling an instance twice, every label is a slot of its own and can be asked
+    import os
+    import tempfile
+    import pandas as pd
+    from loader import DATA_PATH
+    df = pd.read_csv(os.path.join(DATA_PATH, filename), sep='\t', dtype={'!amt_worker_ids': str})
+    df = df[df['orig_id'].isin(df['orig_id'].unique()[:40])]
+    twice = df.iloc[::3].copy()
+    twice['response'] = 1 - twice['response']
+    df = pd.concat([df, twice])
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        df.to_csv(os.path.join(tmp_dir, 'twice.tsv'), sep='\t', index=False)
+        for Budget in (len(df) // 2, len(df)):
+            H_T = replay('twice.tsv', 1, 1, 4, 1, Budget, tmp_dir)
+            H_T_offline = Algorithm(DataSource('twice.tsv', 1, 1, tmp_dir), Worker('twice.tsv', 4, 1, tmp_dir),
+                                    Budget).run_Opt_KG()
+            assert sorted(H_T[0]) == sorted(H_T_offline[0]) and sorted(H_T[1]) == sorted(H_T_offline[1])
+
+
+if __name__ == '__main__':
+    _test_online()
@@ -0,0 +1,292 @@
+import time
+import numpy as np
+from engine import OptKGEngine, AdjacencyOptKGEngine, TournamentTree
+from evaluation import Evaluator
+from profiling import RunProfile
+
+
+class PolicyState(AdjacencyOptKGEngine):
+    """
+    The array-backed state shared by all the allocation policies.
+
+    It is the OptKGEngine state, the a, b, c, d arrays, the pair table and the mask of the remaining pairs, with the
+    update path of OptKGEngine through DataSource and Worker and the pairs of every instance and every worker of
+    AdjacencyOptKGEngine, plus the number of remaining pairs of every instance and the chosen instances.
+    A policy only picks a pair, the state acquires its label and does all the bookkeeping
+    """
+
+    def __init__(self, instances, workers):
+        """
+        :param instances: the given dataset (of type DataSource)
+        :param workers: the workers (of type Worker)
+        """
+        AdjacencyOptKGEngine.__init__(self, instances, workers)
+        self._inst_remain = np.diff(self._inst_ptr)
+        self._chosen = np.zeros(len(self._inst_ids), dtype=bool)
+
+
+    def num_remaining(self):
+        """
+        :return: the number of remaining pairs
+        """
+        return int(self._inst_remain.sum())
+
+
+    def inst_pairs(self, i):
+        """
+        :return: array of the remaining pairs of instance i
+        """
+        pairs = np.arange(self._inst_ptr[i], self._inst_ptr[i + 1])
+
+        return pairs[self._active[pairs]]
+
+
+    def count_scanned(self, n):
+        """
+        Count n pairs or instances looked at by a policy in this step
+        :return: None
+        """
+        self._scanned = self._scanned + n
+
+
+    def acquire_label_update_posterior(self, pair):
+        """
+        Same as OptKGEngine.acquire_label_update_posterior, plus the bookkeeping of the policies
+        :param pair: the index of the chosen pair in the pair table
+        :return: the orig_id of the chosen instance
+        """
+        task_id = OptKGEngine.acquire_label_update_posterior(self, pair)
+        i = self._pair_inst[pair]
+        self._inst_remain[i] = self._inst_remain[i] - 1
+        self._chosen[i] = True
+
+        return task_id
+
+
+    def output_set_Ht(self):
+        """
+        The current output, as Algorithm._output_set_Ht
+        :return: H_T and its complement, lists of orig_id in dataset order
+        """
+        chosen = np.flatnonzero(self._chosen)
+        positive = self._a[chosen] >= self._b[chosen]
+
+        return ([self._inst_ids[i] for i in chosen[positive].tolist()],
+                [self._inst_ids[i] for i in chosen[~positive].tolist()])
+
+
+class Policy:
+    """
+    A budget allocation policy: at every step it picks one remaining (instance, worker) pair of a PolicyState.
+    select() must not change the state, observe() is called once the label of the selected pair is acquired, for the
+    policies keeping their own bookkeeping
+    """
+
+    # the name of the policy in POLICIES and in the results
+    name = None
+
+    def reset(self, state):
+        """
+        Called once with the state before the first step
+        :return: None
+        """
+        pass
+
+
+    def select(self, state):
+        """
+        :return: the index in the pair table of the next pair to label
+        """
+        raise NotImplementedError
+
+
+    def observe(self, state, pair):
+        """
+        Called after the label of pair was acquired and the state updated
+        :return: None
+        """
+        pass
+
+
+class UniformPolicy(Policy):
+    """
+    Round-robin allocation: the instances are visited in dataset order, each gets the label of its next remaining
+    pair, and the instances without remaining pairs are skipped. Every instance thus gets about the same number of
+    labels, whatever their posteriors
+    """
+
+    name = 'uniform'
+
+    def reset(self, state):
+        self._next_inst = 0
+
+
+    def select(self, state):
+        num_inst = len(state._inst_remain)
+        i = self._next_inst
+        visited = 1
+        while state._inst_remain[i] == 0:
+            i = (i + 1) % num_inst
+            visited = visited + 1
+        pair = state._inst_ptr[i]
+        while not state._active[pair]:
+            pair = pair + 1
+        state.count_scanned(visited)
+
+        return int(pair)
+
+
+    def observe(self, state, pair):
+        self._next_inst = (state._pair_inst[pair] + 1) % len(state._inst_remain)
+
+
+class OptKGPolicy(Policy):
+    """
+    Opt-KG: the pair with the largest knowledge-gradient reward, the first in dataset order on ties. The rewards are
+    kept in a TournamentTree rescored by PolicyState.rescore_touched, as in IncrementalOptKGEngine, so the policy picks
+    exactly the pairs of Algorithm.run_Opt_KG
+    """
+
+    name = 'opt-kg'
+
+    def reset(self, state):
+        R = np.full(state._active.size, -np.inf)
+        remain = np.flatnonzero(state._active)
+        R[remain] = state.rewards(remain)
+        self._tree = TournamentTree(R)
+
+
+    def select(self, state):
+        pair, _ = self._tree.top()
+
+        return pair
+
+
+    def observe(self, state, pair):
+        state.rescore_touched(self._tree, pair)
+
+
+class ThompsonPolicy(Policy):
+    """
+    A randomized policy in the style of Thompson sampling. Every step draws theta-i ~ Beta(a-i, b-i) for all the
+    instances and takes the instance with remaining pairs whose draw is closest to 0.5, the instance whose label
+    the sampled world is least sure of. Then it draws rho-j ~ Beta(c-j, d-j) for the workers of its remaining pairs
+    and takes the worker whose draw is farthest from 0.5, the most informative one under the sample. The cost of a
+    step is O(N) draws instead of rewards
+    """
+
+    name = 'thompson'
+
+    def __init__(self, seed=0):
+        """
+        :param seed: the seed of the random generator
+        """
+        self._seed = seed
+
+
+    def reset(self, state):
+        self._rng = np.random.default_rng(self._seed)
+
+
+    def select(self, state):
+        theta = self._rng.beta(state._a, state._b)
+        ambiguity = np.where(state._inst_remain > 0, -np.abs(theta - 0.5), -np.inf)
+        i = int(np.argmax(ambiguity))
+        pairs = state.inst_pairs(i)
+        j = state._pair_wrk[pairs]
+        rho = self._rng.beta(state._c[j], state._d[j])
+        state.count_scanned(theta.size + pairs.size)
+
+        return int(pairs[np.argmax(np.abs(rho - 0.5))])
+
+
+# the policies by name
+POLICIES = {'uniform': UniformPolicy, 'opt-kg': OptKGPolicy, 'thompson': ThompsonPolicy}
+
+
+def make_policy(name, seed=0):
+    """
+    :param name: a key of POLICIES
+    :param seed: the seed of the randomized policies
+    :return: a new policy
+    """
+    if name not in POLICIES:
+        raise ValueError('unknown policy: ' + str(name))
+    if name == 'thompson':
+        return ThompsonPolicy(seed)
+
+    return POLICIES[name]()
+
+
+def run_policy(policy, instances, workers, budgets):
+    """
+    Run a policy on a new PolicyState of the instances and the workers and score it at every budget. The time of
+    each step is recorded in a profiling.RunProfile, as phases 'select' (the policy's select) and 'update' (the
+    state update and the policy's observe)
+    :param policy: a Policy
+    :param instances: the given dataset (of type DataSource), updated by the run
+    :param workers: the workers (of type Worker), updated by the run
+    :param budgets: the budgets to score at, a budget beyond the number of pairs stops at the number of pairs
+    :return: generator of (budget, dict) in increasing order of budget, the dict holding the scores of
+             Evaluator.evaluate and the report of the RunProfile
+    """
+    state = PolicyState(instances, workers)
+    evaluator = Evaluator(instances)
+    inst_store = instances.get_posterior_store()
+    # the row of the posterior store of every instance of the state
+    store_rows = np.array([inst_store.index(key_) for key_ in state._inst_ids], dtype=np.int64)
+    profile = RunProfile()
+    profile.start()
+    policy.reset(state)
+    state.pop_pairs_scanned()
+    t = 0
+    for T_ in sorted(budgets):
+        while t < T_ and state.num_remaining() > 0:
+            start = time.perf_counter()
+            pair = policy.select(state)
+            selected = time.perf_counter()
+            state.acquire_label_update_posterior(pair)
+            policy.observe(state, pair)
+            profile.add_phase('select', selected - start)
+            profile.add_phase('update', time.perf_counter() - selected)
+            profile.end_step(state.pop_pairs_scanned())
+            t = t + 1
+        chosen = np.zeros(len(inst_store), dtype=bool)
+        chosen[store_rows[state._chosen]] = True
+        report = evaluator.evaluate(chosen, inst_store.params())
+        report['profile'] = profile.report()
+        yield T_, report
+
+
+def _test_policies():
+    from dataset import DataSource
+    from workers import Worker
+    from algorithm import Algorithm
+    filename = 'rte.standardized.tsv'
+    Budget = 500
+    Opt_KG = Algorithm(DataSource(filename, 1, 1), Worker(filename, 4, 1), Budget, engine='incremental')
+    Opt_KG.run_Opt_KG()
+    accuracy = {}
+    for name in POLICIES:
+        runs = []
+        for r in range(0, 2):
+            [(T_, report)] = run_policy(make_policy(name, seed=1), DataSource(filename, 1, 1),
+                                        Worker(filename, 4, 1), [Budget])
+            runs.append(report)
+        assert runs[0]['accuracy'] == runs[1]['accuracy']
+        assert runs[0]['profile']['steps'] == Budget
+        accuracy[name] = runs[0]['accuracy']
+        print(name, runs[0]['accuracy'], runs[0]['profile']['phases'])
+    assert accuracy['opt-kg'] == Opt_KG.evaluate()['accuracy']
+    state = PolicyState(DataSource(filename, 1, 1), Worker(filename, 4, 1))
+    policy = OptKGPolicy()
+    policy.reset(state)
+    for t in range(0, Budget):
+        pair = policy.select(state)
+        state.acquire_label_update_posterior(pair)
+        policy.observe(state, pair)
+    assert state.output_set_Ht() == Opt_KG._output_set_Ht()
+
+
+if __name__ == '__main__':
+    _test_policies()
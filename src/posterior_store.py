@@ -0,0 +1,178 @@
+from collections.abc import Mapping
+import numpy as np
+
+
+class PosteriorStore:
+    """
+    The parameters of the Beta distributions of a collection of instances or workers, (a, b) or (c, d).
+
+    The parameters are the rows of one contiguous (n, 2) float64 array and every ID has a dense integer index, its
+    row, in the order the IDs were added. IDs can be added at any time, the array grows by doubling. IDs are never
+    removed, so a snapshot is the number of IDs and a copy of the rows, and restoring it drops the IDs added since.
+    """
+
+    def __init__(self, ids, p0, q0):
+        """
+        :param ids: the initial IDs, in the order of their indexes
+        :param p0: the initial first parameter of every ID
+        :param q0: the initial second parameter of every ID
+        """
+        self._p0 = p0
+        self._q0 = q0
+        self._ids = list(ids)
+        self._index = {id_: i for i, id_ in enumerate(self._ids)}
+        if len(self._index) != len(self._ids):
+            raise ValueError('duplicate IDs')
+        self._params = np.empty((max(len(self._ids), 1), 2), dtype=np.float64)
+        self._params[:len(self._ids)] = [p0, q0]
+
+
+    def __len__(self):
+        return len(self._ids)
+
+
+    def __contains__(self, id_):
+        return id_ in self._index
+
+
+    def index(self, id_):
+        """
+        :return: the index of the ID
+        """
+        return self._index[id_]
+
+
+    def index_map(self):
+        """
+        :return: the dict {ID: index}, not to be modified
+        """
+        return self._index
+
+
+    def ids(self):
+        """
+        :return: the list of the IDs in the order of their indexes, not to be modified
+        """
+        return self._ids
+
+
+    def params(self):
+        """
+        :return: view of the (n, 2) array of the parameters, row i for the ID of index i
+        """
+        return self._params[:len(self._ids)]
+
+
+    def get(self, id_):
+        """
+        :return: [p, q] of the ID, a new list of floats
+        """
+        return self._params[self._index[id_]].tolist()
+
+
+    def set(self, id_, p, q):
+        """
+        Set the parameters of the ID
+        :return: None
+        """
+        i = self._index[id_]
+        self._params[i, 0] = p
+        self._params[i, 1] = q
+
+
+    def add(self, id_):
+        """
+        Add an ID with the initial parameters, nothing is done if it is already known
+        :return: the index of the ID
+        """
+        i = self._index.get(id_)
+        if i is not None:
+            return i
+        i = len(self._ids)
+        if i == self._params.shape[0]:
+            params = np.empty((2 * i, 2), dtype=np.float64)
+            params[:i] = self._params
+            self._params = params
+        self._params[i] = [self._p0, self._q0]
+        self._ids.append(id_)
+        self._index[id_] = i
+
+        return i
+
+
+    def snapshot(self):
+        """
+        :return: a snapshot of the parameters, for restore()
+        """
+        return len(self._ids), self.params().copy()
+
+
+    def restore(self, snapshot):
+        """
+        Set back the parameters of a snapshot taken from this store, the IDs added since are dropped
+        :param snapshot: what snapshot() returned
+        :return: None
+        """
+        n, params = snapshot
+        if n > len(self._ids) or params.shape != (n, 2):
+            raise ValueError('the snapshot was not taken from this store')
+        for id_ in self._ids[n:]:
+            del self._index[id_]
+        del self._ids[n:]
+        self._params[:n] = params
+
+
+    def view(self):
+        """
+        :return: a read-only mapping {ID: [p, q]} over the store, which follows the changes of the store
+        """
+        return PosteriorView(self)
+
+
+class PosteriorView(Mapping):
+    """
+    Read-only mapping {ID: [p, q]} over a PosteriorStore, in the order of the indexes. It replaces the dicts of
+    lists the getters of DataSource and Worker used to return
+    """
+
+    def __init__(self, store):
+        self._store = store
+
+
+    def __getitem__(self, id_):
+        return self._store.get(id_)
+
+
+    def __contains__(self, id_):
+        return id_ in self._store
+
+
+    def __iter__(self):
+        return iter(self._store.ids())
+
+
+    def __len__(self):
+        return len(self._store)
+
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+def _test_posterior_store():
+    store = PosteriorStore(['i1', 'i2'], 1, 1)
+    view = store.view()
+    store.set('i2', 2.5, 0.5)
+    assert view['i2'] == [2.5, 0.5] and view['i1'] == [1.0, 1.0]
+    snapshot = store.snapshot()
+    for k in range(0, 10):
+        store.add('new' + str(k))
+    store.set('i1', 3.0, 4.0)
+    assert len(view) == 12 and store.index('new9') == 11 and view['new9'] == [1.0, 1.0]
+    store.restore(snapshot)
+    assert list(view) == ['i1', 'i2'] and view['i1'] == [1.0, 1.0] and 'new0' not in view
+    print(view)
+
+
+if __name__ == '__main__':
+    _test_posterior_store()
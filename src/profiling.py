@@ -0,0 +1,116 @@
+import time
+import math_util
+
+
+class RunProfile:
+    """
+    Per-phase instrumentation of an Opt-KG run, given to Algorithm with profile=RunProfile().
+
+    The phases are 'select' (Algorithm._select_inst_wrk or the engine's select), 'update'
+    (Algorithm._acquire_label_Update_posterior or the engine's acquire_label_update_posterior) and 'bookkeeping'
+    (Algorithm._pop_out_chosen_wrk_response, or recording the chosen instance with an engine), plus 'index' for the
+    bound index of the 'pruned' engine (Algorithm._update_bound_index). For each phase the
+    number of calls and the cumulative time are kept. The profile also counts the candidate pairs whose reward was
+    computed at each step and the hits and misses of math_util.beta_cache during the run.
+    """
+
+    def __init__(self, callback=None):
+        """
+        :param callback: optional function called after every step as callback(t, step) where step is a dict with
+                         the time of each phase in this step and the number of pairs scanned
+        """
+        self._callback = callback
+        self._phases = {}
+        self._step = {}
+        self._steps = 0
+        self._pairs_total = 0
+        self._pairs_max = 0
+        self._start = None
+        self._cache = None
+        self._cache_hits = 0
+        self._cache_misses = 0
+
+
+    def start(self):
+        """
+        Called by Algorithm when the run starts
+        :return: None
+        """
+        self._start = time.perf_counter()
+        self._cache = math_util.beta_cache
+        self._cache_hits = self._cache.hits
+        self._cache_misses = self._cache.misses
+
+
+    def add_phase(self, name, seconds):
+        """
+        Record one call of a phase
+        :return: None
+        """
+        phase = self._phases.get(name)
+        if phase is None:
+            phase = self._phases[name] = [0, 0.0]
+        phase[0] = phase[0] + 1
+        phase[1] = phase[1] + seconds
+        self._step[name] = self._step.get(name, 0.0) + seconds
+
+
+    def end_step(self, pairs_scanned):
+        """
+        Called by Algorithm after every acquired label
+        :param pairs_scanned: number of pairs whose reward was computed during the step
+        :return: None
+        """
+        self._steps = self._steps + 1
+        self._pairs_total = self._pairs_total + pairs_scanned
+        self._pairs_max = max(self._pairs_max, pairs_scanned)
+        if self._callback is not None:
+            step = self._step
+            step['pairs_scanned'] = pairs_scanned
+            self._callback(self._steps, step)
+        self._step = {}
+
+
+    def report(self):
+        """
+        :return: dict with the number of steps, the wall time since the start, the calls and time of every phase,
+                 the pairs scanned and the beta cache hits and misses during the run
+        """
+        phases = {}
+        for name, (calls, seconds) in self._phases.items():
+            phases[name] = {'calls': calls, 'seconds': seconds, 'mean': seconds / calls}
+        hits = 0
+        misses = 0
+        if self._cache is not None:
+            hits = self._cache.hits - self._cache_hits
+            misses = self._cache.misses - self._cache_misses
+        return {'steps': self._steps,
+                'wall_time': 0.0 if self._start is None else time.perf_counter() - self._start,
+                'phases': phases,
+                'pairs_scanned': {'total': self._pairs_total, 'max': self._pairs_max,
+                                  'mean': self._pairs_total / self._steps if self._steps > 0 else 0.0},
+                'beta_cache': {'hits': hits, 'misses': misses,
+                               'hit_rate': hits / (hits + misses) if hits + misses > 0 else 0.0}}
+
+
+def _test_profiling():
+    from dataset import DataSource
+    from workers import Worker
+    from algorithm import Algorithm
+    filename = 'rte.standardized.tsv'
+    Budget = 400
+    steps = []
+    H_T_plain = Algorithm(DataSource(filename, 1, 1), Worker(filename, 4, 1), Budget).run_Opt_KG()
+    for engine in ('loop', 'pruned', 'vectorized', 'incremental'):
+        profile = RunProfile(callback=lambda t, step: steps.append(t))
+        Opt_KG = Algorithm(DataSource(filename, 1, 1), Worker(filename, 4, 1), Budget, engine=engine, profile=profile)
+        assert Opt_KG.run_Opt_KG() == H_T_plain
+        report = profile.report()
+        assert report['steps'] == Budget
+        assert report['phases']['select']['calls'] == Budget
+        print(engine, report)
+    assert len(steps) == 4 * Budget
+
+
+if __name__ == '__main__':
+    _test_profiling()
@@ -0,0 +1,108 @@
+import time
+import random
+import itertools
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+from dataset import DataSource
+from workers import Worker
+from algorithm import Algorithm
+from loader import load_crowd_data, compile_crowd_data
+from kernels import warm_up
+
+
+# the fields of a configuration, in the order of the columns of the result table
+CONFIG_FIELDS = ['data_file', 'a0', 'b0', 'c0', 'd0', 'budget', 'seed']
+
+# the CrowdData already loaded by this process, {data file: CrowdData}
+_crowd_data = {}
+# the directory of the data files and the engine, set by _init_process
+_data_path = None
+_engine = 'incremental'
+
+
+def make_grid(data_files, a0s, b0s, c0s, d0s, budgets, seeds=(0,)):
+    """
+    Build the cartesian product of the given values as a list of configurations
+    :return: list of dicts with the keys CONFIG_FIELDS
+    """
+    return [dict(zip(CONFIG_FIELDS, values))
+            for values in itertools.product(data_files, a0s, b0s, c0s, d0s, budgets, seeds)]
+
+
+def _init_process(data_path, engine):
+    """
+    Initializer of the pool processes
+    :return: None
+    """
+    global _data_path, _engine
+    _data_path = data_path
+    _engine = engine
+    _crowd_data.clear()
+    # compile the kernels before any run, so that the wall time of the first run does not count the compilation
+    warm_up()
+
+
+def _run_config(config):
+    """
+    Run Opt-KG for one configuration. The data file is loaded once per process from its compiled copy, whose
+    arrays are memory-mapped read only and so shared by all the processes through the page cache
+    :param config: dict with the keys CONFIG_FIELDS
+    :return: dict, the configuration with its results
+    """
+    data_file = config['data_file']
+    if data_file not in _crowd_data:
+        _crowd_data[data_file] = load_crowd_data(data_file, _data_path)
+    crowd_data = _crowd_data[data_file]
+    # Opt-KG itself is deterministic, the seed makes any randomized part of a run reproducible
+    random.seed(config['seed'])
+    np.random.seed(config['seed'])
+    start = time.perf_counter()
+    sourcedata = DataSource(crowd_data, config['a0'], config['b0'])
+    workers = Worker(crowd_data, config['c0'], config['d0'])
+    Opt_KG = Algorithm(sourcedata, workers, config['budget'], engine=_engine)
+    [(T_, H_T, H_complement, accuracy)] = Opt_KG.sweep_Opt_KG()
+    wall_time = time.perf_counter() - start
+    result = dict(config)
+    result.update({'engine': _engine, 'accuracy': accuracy, 'H_T_size': len(H_T),
+                   'H_T_c_size': len(H_complement), 'wall_time': wall_time})
+
+    return result
+
+
+def run_grid(configs, processes=None, output=None, data_path=None, engine='incremental'):
+    """
+    Run all the configurations on a process pool and collect the results in a table, one row per configuration.
+    Every data file is compiled first, so the processes memory-map it instead of parsing it
+    :param configs: list of dicts with the keys CONFIG_FIELDS, see make_grid
+    :param processes: number of processes, default is the number of cpus
+    :param output: file to write the table to, .parquet for Parquet and CSV otherwise, None to not write it
+    :param data_path: the directory of the data files, default is loader.DATA_PATH
+    :param engine: the engine of Algorithm used for every run, not 'sharded' as the pool processes cannot start the
+                   shard processes
+    :return: pandas DataFrame of the results, in the order of configs
+    """
+    if engine == 'sharded':
+        raise ValueError("the 'sharded' engine cannot run in the pool processes, use a single process engine")
+    for data_file in sorted(set(config['data_file'] for config in configs)):
+        compile_crowd_data(data_file, data_path)
+    with Pool(processes, initializer=_init_process, initargs=(data_path, engine)) as pool:
+        results = pool.map(_run_config, configs, chunksize=1)
+    table = pd.DataFrame(results)
+    if output is not None:
+        if output.endswith('.parquet'):
+            table.to_parquet(output, index=False)
+        else:
+            table.to_csv(output, index=False)
+
+    return table
+
+
+def _test_runner():
+    configs = make_grid(['rte.standardized.tsv'], [1], [1], [1, 2, 4], [1], [400, 800])
+    table = run_grid(configs, processes=4)
+    print(table)
+
+
+if __name__ == '__main__':
+    _test_runner()
@@ -0,0 +1,307 @@
+import os
+import weakref
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+from kernels import kg_reward
+from engine import OptKGEngine
+
+
+# max number of shards of the 'sharded' engine, it can be set with the environment variable TA_SHARDS
+NUM_SHARDS = int(os.environ.get('TA_SHARDS', min(4, os.cpu_count() or 1)))
+# the least number of pairs of a shard when the number of shards is not given, a smaller shard costs more in messages
+# than it saves in scoring
+_SHARD_PAIRS = 50000
+
+
+def _shard_bounds(pair_inst, num_inst, shards):
+    """
+    Cut the pair table into shards of whole instances with about the same number of pairs each
+    :return: array of shards + 1 pair positions, shard s owns the pairs [bounds[s], bounds[s + 1])
+    """
+    inst_ptr = np.searchsorted(pair_inst, np.arange(num_inst + 1))
+    cuts = np.searchsorted(inst_ptr, np.linspace(0, pair_inst.size, shards + 1))
+    bounds = inst_ptr[np.minimum(cuts, num_inst)]
+    bounds[-1] = pair_inst.size
+
+    return bounds
+
+
+def _shard_main(conn, shm_name, num_wrk, lo, pair_inst, pair_wrk, a, b):
+    """
+    The loop of a shard process. The shard owns the pairs [lo, lo + len(pair_inst)) of the pair table and the a, b
+    of their instances, the c, d of all the workers are read from the shared memory block shm_name. It answers the
+    commands of ShardedOptKGEngine until it gets None
+    :param conn: the end of the pipe to the coordinator
+    :param pair_inst: the instance index of each pair of the shard
+    :param pair_wrk: the worker index of each pair of the shard
+    :param a: the a of the instances of the shard, indexed by instance index - pair_inst[0]
+    :param b: the b of the instances of the shard
+    :return: None
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    cd = np.ndarray((num_wrk, 2), dtype=np.float64, buffer=shm.buf)
+    hi = lo + pair_inst.size
+    first_inst = pair_inst[0] if pair_inst.size > 0 else 0
+    active = np.ones(pair_inst.size, dtype=bool)
+    try:
+        while True:
+            message = conn.recv()
+            if message is None:
+                break
+            k, removed, upd_inst, upd_a, upd_b = message
+            # apply the updates made since the last command, keeping those of the shard
+            removed = removed[(removed >= lo) & (removed < hi)]
+            active[removed - lo] = False
+            mine = (upd_inst >= first_inst) & (upd_inst < first_inst + a.size)
+            a[upd_inst[mine] - first_inst] = upd_a[mine]
+            b[upd_inst[mine] - first_inst] = upd_b[mine]
+            # the local best pairs under the current parameters
+            remain = np.flatnonzero(active)
+            i = pair_inst[remain] - first_inst
+            j = pair_wrk[remain]
+            R = kg_reward(a[i], b[i], cd[j, 0], cd[j, 1])
+            if k == 1:
+                if remain.size == 0:
+                    conn.send((np.empty(0), np.empty(0, dtype=np.int64), 0))
+                    continue
+                best = np.argmax(R)
+                conn.send((R[best:best + 1], remain[best:best + 1] + lo, remain.size))
+                continue
+            order = np.lexsort((remain, -R))
+            _, first = np.unique(i[order], return_index=True)
+            best = order[np.sort(first)[:k]]
+            conn.send((R[best], remain[best] + lo, remain.size))
+    finally:
+        del cd
+        shm.close()
+        conn.close()
+
+
+def _shutdown(conns, processes, shm):
+    """
+    Stop the shard processes and free the shared memory block
+    :return: None
+    """
+    for conn in conns:
+        try:
+            conn.send(None)
+            conn.close()
+        except (OSError, ValueError):
+            pass
+    for process in processes:
+        process.join(5)
+        if process.is_alive():
+            process.terminate()
+    shm.close()
+    shm.unlink()
+
+
+class ShardedOptKGEngine(OptKGEngine):
+    """
+    OptKGEngine whose selection runs in several processes.
+
+    The instances are cut into shards of consecutive instances, each with about the same number of pairs, and every
+    shard is owned by a process keeping the a, b of its instances and the active mask of its pairs. The c, d of the
+    workers live in a shared memory block, written by this process only. A selection sends the updates made since
+    the last one to all the shards, every shard scores its remaining pairs and answers its best pair, and the best
+    of the answers is the selected pair. The shards follow each other in the order of the pair table and the first
+    shard wins ties, so the selected pair is the one OptKGEngine selects.
+    The shard processes are stopped by close(), or when the engine is garbage collected
+    """
+
+    def __init__(self, instances, workers, shards=None):
+        """
+        Build the arrays, the shared memory block and start the shard processes
+        :param instances: the given dataset (of type DataSource)
+        :param workers: the workers (of type Worker)
+        :param shards: number of shard processes, default is NUM_SHARDS with at least _SHARD_PAIRS pairs per shard,
+                       at most the number of instances
+        """
+        OptKGEngine.__init__(self, instances, workers)
+        if shards is None:
+            shards = min(NUM_SHARDS, -(-self._pair_inst.size // _SHARD_PAIRS))
+        shards = max(1, min(shards, len(self._inst_ids)))
+        num_wrk = len(self._wrk_ids)
+        self._shm = shared_memory.SharedMemory(create=True, size=max(num_wrk, 1) * 2 * 8)
+        cd = np.ndarray((num_wrk, 2), dtype=np.float64, buffer=self._shm.buf)
+        cd[:, 0] = self._c
+        cd[:, 1] = self._d
+        # the c, d of OptKGEngine become views of the shared block, so the updates are seen by the shards
+        self._c = cd[:, 0]
+        self._d = cd[:, 1]
+        # the removed pairs and the updated instances not sent to the shards yet
+        self._removed = []
+        self._updated = []
+        self._bounds = _shard_bounds(self._pair_inst, len(self._inst_ids), shards)
+        context = multiprocessing.get_context()
+        self._conns = []
+        processes = []
+        # registered before the first shard starts, so that a shard failing to start still frees the block and stops
+        # the shards started before it
+        self._finalizer = weakref.finalize(self, _shutdown, self._conns, processes, self._shm)
+        try:
+            for s in range(0, shards):
+                lo, hi = self._bounds[s], self._bounds[s + 1]
+                insts = np.unique(self._pair_inst[lo:hi])
+                if insts.size > 0:
+                    a = self._a[insts[0]:insts[-1] + 1].copy()
+                    b = self._b[insts[0]:insts[-1] + 1].copy()
+                else:
+                    a = np.empty(0)
+                    b = np.empty(0)
+                conn, child_conn = context.Pipe()
+                process = context.Process(target=_shard_main, daemon=True,
+                                          args=(child_conn, self._shm.name, num_wrk, lo, self._pair_inst[lo:hi],
+                                                self._pair_wrk[lo:hi], a, b))
+                try:
+                    process.start()
+                finally:
+                    child_conn.close()
+                self._conns.append(conn)
+                processes.append(process)
+        except BaseException:
+            self._finalizer()
+            raise
+
+
+    def _gather(self, k):
+        """
+        Send the pending updates and a selection of k pairs to every shard
+        :return: array of the rewards and array of the indexes of the pairs answered by the shards, in shard order
+        """
+        removed = np.array(self._removed, dtype=np.int64)
+        upd_inst = np.array(self._updated, dtype=np.int64)
+        message = (k, removed, upd_inst, self._a[upd_inst], self._b[upd_inst])
+        for conn in self._conns:
+            conn.send(message)
+        self._removed = []
+        self._updated = []
+        answers = [conn.recv() for conn in self._conns]
+        self._scanned = self._scanned + sum(answer[2] for answer in answers)
+
+        return np.concatenate([answer[0] for answer in answers]), np.concatenate([answer[1] for answer in answers])
+
+
+    def select(self):
+        """
+        Select the next pair to label, ties are broken in favor of the first pair in traversing order
+        :return: the max reward and the index of the selected pair in the pair table
+        """
+        R, pairs = self._gather(1)
+        assert pairs.size > 0
+        best = int(np.argmax(R))
+
+        return R[best], int(pairs[best])
+
+
+    def select_batch(self, k):
+        """
+        Same as OptKGEngine.select_batch, every shard answers its k best pairs and the k best of all are kept, an
+        instance belongs to one shard so there is still at most one pair per instance
+        :param k: the number of pairs to select
+        :return: array of the rewards and array of the indexes of the selected pairs
+        """
+        R, pairs = self._gather(k)
+        assert pairs.size > 0
+        best = np.lexsort((pairs, -R))[:k]
+
+        return R[best], pairs[best]
+
+
+    def acquire_label_update_posterior(self, pair):
+        """
+        Same as OptKGEngine.acquire_label_update_posterior, the new c, d go straight to the shared block and the new
+        a, b are sent to the shard of the instance with the next selection
+        :param pair: the index of the chosen pair in the pair table
+        :return: the orig_id of the chosen instance
+        """
+        task_id = OptKGEngine.acquire_label_update_posterior(self, pair)
+        self._removed.append(pair)
+        self._updated.append(self._pair_inst[pair])
+
+        return task_id
+
+
+    def deactivate(self, pairs):
+        """
+        Same as OptKGEngine.deactivate, the shards drop the pairs at the next selection
+        :param pairs: array of indexes in the pair table
+        :return: None
+        """
+        OptKGEngine.deactivate(self, pairs)
+        self._removed.extend(np.asarray(pairs, dtype=np.int64).tolist())
+
+
+    def close(self):
+        """
+        Stop the shard processes and free the shared memory, the engine cannot be used afterwards
+        :return: None
+        """
+        self._finalizer()
+
+
+def _build_in_daemon(filename):
+    """
+    Build a ShardedOptKGEngine in a daemonic process, which cannot start the shards, and exit with 0 if the shared
+    memory block was freed
+    """
+    from dataset import DataSource
+    from workers import Worker
+    created = []
+    SharedMemory = shared_memory.SharedMemory
+
+    class RecordedSharedMemory(SharedMemory):
+        def __init__(self, *args, **kwargs):
+            SharedMemory.__init__(self, *args, **kwargs)
+            created.append(self.name)
+
+    shared_memory.SharedMemory = RecordedSharedMemory
+    try:
+        ShardedOptKGEngine(DataSource(filename, 1, 1), Worker(filename, 4, 1), shards=3)
+    except AssertionError:
+        pass
+    try:
+        SharedMemory(name=created[0]).close()
+    except FileNotFoundError:
+        os._exit(0)
+    os._exit(1)
+
+
+# test the sharded engine step by step against OptKGEngine, and through Algorithm
+def _test_sharded():
+    from dataset import DataSource
+    from workers import Worker
+    from algorithm import Algorithm
+    filename = 'rte.standardized.tsv'
+    Budget = 600
+    reference = OptKGEngine(DataSource(filename, 1, 1), Worker(filename, 4, 1))
+    sharded = ShardedOptKGEngine(DataSource(filename, 1, 1), Worker(filename, 4, 1), shards=3)
+    for t in range(0, Budget):
+        R_max, pair = reference.select()
+        assert sharded.select() == (R_max, pair)
+        reference.acquire_label_update_posterior(pair)
+        sharded.acquire_label_update_posterior(pair)
+    sharded.close()
+    H_T = Algorithm(DataSource(filename, 1, 1), Worker(filename, 4, 1), Budget, engine='vectorized',
+                    batch_size=4).run_Opt_KG()
+    Opt_KG = Algorithm(DataSource(filename, 1, 1), Worker(filename, 4, 1), Budget, engine='sharded', batch_size=4)
+    assert Opt_KG.run_Opt_KG() == H_T
+    # the run stops the shard processes when it ends, as does a sweep left half way
+    assert not Opt_KG._engine_obj._finalizer.alive
+    Opt_KG = Algorithm(DataSource(filename, 1, 1), Worker(filename, 4, 1), Budget, engine='sharded')
+    sweep = Opt_KG.sweep_Opt_KG([100, 200])
+    next(sweep)
+    assert Opt_KG._engine_obj._finalizer.alive
+    sweep.close()
+    assert not Opt_KG._engine_obj._finalizer.alive
+    # shards that cannot start leave no shared memory behind
+    process = multiprocessing.Process(target=_build_in_daemon, args=(filename,), daemon=True)
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+    print(H_T)
+
+
+if __name__ == '__main__':
+    _test_sharded()
@@ -0,0 +1,224 @@
+import os
+import sys
+import argparse
+import numpy as np
+from loader import CrowdData, compile_crowd_data
+
+
+# the columns of the data files, as in rte.standardized.tsv
+COLUMNS = ['orig_id', '!amt_worker_ids', 'response', 'gold']
+
+
+def _worker_reliability(num_workers, reliability, seed):
+    """
+    :return: the probability of each worker to give the true class, drawn from Beta(reliability)
+    """
+    rng = np.random.default_rng([seed, 0])
+
+    return rng.beta(reliability[0], reliability[1], num_workers)
+
+
+# max number of draws of a worker before _assign_workers falls back to the Gumbel-top-k trick
+_MAX_DRAWS = 64
+
+
+def _gumbel_top(rng, log_weight, chosen, num):
+    """
+    Draw num more distinct workers for every row of chosen, successively by weight among the workers not in the row,
+    with the Gumbel-top-k trick: the num largest log_weight + Gumbel noise, in decreasing order
+    :param log_weight: array of the log of the weight of every worker
+    :param chosen: (rows, s) array of the workers already drawn for every row
+    :return: (rows, num) array of worker indexes
+    """
+    keys = log_weight - np.log(-np.log(rng.random((chosen.shape[0], log_weight.size))))
+    np.put_along_axis(keys, chosen, -np.inf, axis=1)
+    top = np.argpartition(-keys, num - 1, axis=1)[:, :num]
+    order = np.argsort(-np.take_along_axis(keys, top, axis=1), axis=1)
+
+    return np.take_along_axis(top, order, axis=1)
+
+
+def _assign_workers(rng, num_labels, num_workers, labels_per_inst, activity):
+    """
+    Draw labels_per_inst distinct workers for each of num_labels // labels_per_inst instances, successively by
+    activity: the k-th worker of an instance is drawn by activity among the workers it does not have yet. A draw
+    hitting a worker the instance has is drawn again, at most _MAX_DRAWS times, then the rest of the workers of the
+    instance are drawn over the whole pool with _gumbel_top. Both give the same distribution, the first is fast while
+    an instance has few workers compared to the pool, the second when a few workers give most of the labels
+    :param activity: None for workers equally likely, otherwise array of the probability of every worker
+    :return: (number of instances, labels_per_inst) array of worker indexes
+    """
+    num_inst = num_labels // labels_per_inst
+    workers = np.empty((num_inst, labels_per_inst), dtype=np.int64)
+    cum_activity = None if activity is None else np.cumsum(activity)
+
+    def draw(n):
+        if cum_activity is None:
+            return rng.integers(0, num_workers, n)
+        return np.minimum(np.searchsorted(cum_activity, rng.random(n), side='right'), num_workers - 1)
+
+    # the instances whose workers are drawn one at a time
+    rows = np.arange(num_inst)
+    for s in range(0, labels_per_inst):
+        workers[rows, s] = draw(rows.size)
+        redraw = np.arange(rows.size)
+        for t in range(0, _MAX_DRAWS):
+            redraw = redraw[(workers[rows[redraw], :s] == workers[rows[redraw], s:s + 1]).any(axis=1)]
+            if redraw.size == 0:
+                break
+            workers[rows[redraw], s] = draw(redraw.size)
+        if redraw.size > 0:
+            log_weight = np.zeros(num_workers) if activity is None else np.log(activity)
+            late = rows[redraw]
+            # blocks of about 2^22 keys
+            block = max(1, 2 ** 22 // num_workers)
+            for start in range(0, late.size, block):
+                part = late[start:start + block]
+                workers[part, s:] = _gumbel_top(rng, log_weight, workers[part, :s], labels_per_inst - s)
+            rows = np.delete(rows, redraw)
+
+    return workers
+
+
+def iter_label_chunks(num_inst, num_workers, labels_per_inst, num_classes=2, reliability=(4, 1), activity_skew=0.0,
+                      chunk_size=100000, seed=0):
+    """
+    Simulate crowd labels chunk by chunk, only one chunk is held in memory.
+    Every instance has a latent true class drawn uniformly, and labels_per_inst distinct workers label it. Every worker
+    gives the true class with his reliability, drawn from Beta(reliability), and any other class uniformly otherwise,
+    which is the worker model of Opt-KG and of multiclass. Each chunk has its own random generator seeded by seed and
+    the chunk number, so the labels only depend on seed and chunk_size
+    :param num_inst: number of instances
+    :param num_workers: number of workers
+    :param labels_per_inst: number of labels of each instance
+    :param num_classes: number K of classes, the labels are 0 .. K - 1
+    :param reliability: the (c, d) of the Beta distribution of the reliabilities
+    :param activity_skew: 0 for workers equally likely to label an instance, s > 0 for the worker of rank k drawn
+                          with a weight k^-s, a few workers then give most of the labels
+    :param chunk_size: number of instances of each chunk
+    :param seed: the random seed
+    :return: generator of dicts of arrays with the keys COLUMNS, one entry per label, grouped by instance
+    """
+    if labels_per_inst > num_workers:
+        raise ValueError('labels_per_inst must not exceed num_workers')
+    rel = _worker_reliability(num_workers, reliability, seed)
+    activity = None
+    if activity_skew > 0:
+        weight = np.arange(1, num_workers + 1, dtype=np.float64) ** -activity_skew
+        activity = weight / weight.sum()
+    for k, start in enumerate(range(0, num_inst, chunk_size)):
+        rng = np.random.default_rng([seed, 1, k])
+        n = min(chunk_size, num_inst - start)
+        gold = rng.integers(0, num_classes, n)
+        workers = _assign_workers(rng, n * labels_per_inst, num_workers, labels_per_inst, activity).ravel()
+        inst = np.repeat(np.arange(n), labels_per_inst)
+        correct = rng.random(inst.size) < rel[workers]
+        wrong = (gold[inst] + rng.integers(1, num_classes, inst.size)) % num_classes
+        yield {'orig_id': inst + start + 1, '!amt_worker_ids': workers, 'response': np.where(correct, gold[inst], wrong),
+               'gold': gold[inst]}
+
+
+def write_crowd_file(path, num_inst, num_workers, labels_per_inst, compile=False, **kwargs):
+    """
+    Simulate a dataset with iter_label_chunks and write it chunk by chunk as a tab separated file in the schema of
+    rte.standardized.tsv, the workers named W0, W1, ...
+    :param path: the file to write
+    :param compile: True to also write the compiled copy of loader, so that loading it needs no parsing
+    :param kwargs: the other parameters of iter_label_chunks
+    :return: number of labels written
+    """
+    import pandas as pd
+    num_labels = 0
+    with open(path, 'w', newline='') as f:
+        f.write('\t'.join(COLUMNS) + '\n')
+        for chunk in iter_label_chunks(num_inst, num_workers, labels_per_inst, **kwargs):
+            chunk['!amt_worker_ids'] = np.char.add('W', chunk['!amt_worker_ids'].astype('U'))
+            pd.DataFrame(chunk, columns=COLUMNS).to_csv(f, sep='\t', index=False, header=False)
+            num_labels = num_labels + len(chunk['orig_id'])
+    if compile:
+        compile_crowd_data(os.path.basename(path), os.path.dirname(os.path.abspath(path)))
+
+    return num_labels
+
+
+def simulate_crowd_data(num_inst, num_workers, labels_per_inst, **kwargs):
+    """
+    Simulate a dataset straight into a CrowdData, without any file. The chunks are copied into the arrays of the
+    CrowdData as they come, so the peak memory is the CrowdData plus one chunk
+    :param kwargs: the other parameters of iter_label_chunks
+    :return: CrowdData, the instances in increasing orig_id and the workers named W0, W1, ... in order of index
+    """
+    num_labels = num_inst * labels_per_inst
+    wrk_idx = np.empty(num_labels, dtype=np.int64)
+    response = np.empty(num_labels, dtype=np.int64)
+    gold = np.empty(num_inst, dtype=np.int64)
+    pos = 0
+    for chunk in iter_label_chunks(num_inst, num_workers, labels_per_inst, **kwargs):
+        n = len(chunk['orig_id'])
+        wrk_idx[pos:pos + n] = chunk['!amt_worker_ids']
+        response[pos:pos + n] = chunk['response']
+        gold[pos // labels_per_inst:(pos + n) // labels_per_inst] = chunk['gold'][::labels_per_inst]
+        pos = pos + n
+    inst_ptr = np.arange(0, num_labels + 1, labels_per_inst, dtype=np.int64)
+
+    return CrowdData(list(range(1, num_inst + 1)), ['W' + str(j) for j in range(0, num_workers)], inst_ptr, wrk_idx,
+                     response, gold)
+
+
+def _test_simulator():
+    import tempfile
+    from loader import load_crowd_data
+    kwargs = {'num_classes': 2, 'activity_skew': 0.5, 'chunk_size': 300, 'seed': 3}
+    data = simulate_crowd_data(1000, 200, 7, **kwargs)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'simulated.tsv')
+        assert write_crowd_file(path, 1000, 200, 7, **kwargs) == 7000
+        loaded = load_crowd_data(path)
+    assert loaded.get_inst_id_list() == data.get_inst_id_list()
+    assert np.array_equal(loaded.get_response(), data.get_response())
+    assert np.array_equal(loaded.get_gold(), data.get_gold())
+    names = data.get_worker_id_list()
+    assert [loaded.get_worker_id_list()[j] for j in loaded.get_worker_index()] == \
+           [names[j] for j in data.get_worker_index()]
+    # every instance has distinct workers
+    rows = np.sort(data.get_worker_index().reshape(1000, 7), axis=1)
+    assert (rows[:, 1:] != rows[:, :-1]).all()
+    print('labels agreeing with gold: ' + str(np.mean(data.get_response() == np.repeat(data.get_gold(), 7))))
+    # a few workers give most of the labels, the draws of _gumbel_top only follow the same distribution
+    global _MAX_DRAWS
+    weight = np.arange(1, 51, dtype=np.float64) ** -2.0
+    counts = []
+    for max_draws in (_MAX_DRAWS, 0):
+        _MAX_DRAWS, saved = max_draws, _MAX_DRAWS
+        rows = _assign_workers(np.random.default_rng(0), 200000, 50, 10, weight / weight.sum())
+        _MAX_DRAWS = saved
+        ordered = np.sort(rows, axis=1)
+        assert (ordered[:, 1:] != ordered[:, :-1]).all()
+        counts.append(np.bincount(rows.ravel(), minlength=50) / rows.shape[0])
+    assert np.abs(counts[0] - counts[1]).max() < 0.03
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write a simulated crowd labeling file in the RTE schema')
+    parser.add_argument('path', nargs='?', default=None)
+    parser.add_argument('--instances', type=int, default=100000)
+    parser.add_argument('--workers', type=int, default=5000)
+    parser.add_argument('--labels-per-inst', type=int, default=10)
+    parser.add_argument('--classes', type=int, default=2)
+    parser.add_argument('--reliability', type=float, nargs=2, default=[4, 1])
+    parser.add_argument('--activity-skew', type=float, default=0.0)
+    parser.add_argument('--chunk-size', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--compile', action='store_true', help='also write the compiled copy for loader')
+    args = parser.parse_args(argv)
+    if args.path is None:
+        _test_simulator()
+        return
+    num_labels = write_crowd_file(args.path, args.instances, args.workers, args.labels_per_inst, args.compile,
+                                  num_classes=args.classes, reliability=tuple(args.reliability),
+                                  activity_skew=args.activity_skew, chunk_size=args.chunk_size, seed=args.seed)
+    print(str(num_labels) + ' labels written to ' + args.path)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
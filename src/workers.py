@@ -1,6 +1,7 @@
-import pandas as pd
-import numpy as np
 from random import choice
+from loader import CrowdData, load_crowd_data
+from kernels import posterior_cd
+from posterior_store import PosteriorStore
 
 
 class Worker:
@@ -11,23 +12,28 @@ class Worker:
     [c-i, d-i]
     """
 
-    def __init__(self,filename, c0, d0):
+    def __init__(self,filename, c0, d0, data_path=None):
         """
 
-        :param filename: dataset filename(format ending should not be forgotten)
+        :param filename: dataset filename(format ending should not be forgotten), or a CrowdData already loaded by
+                         load_crowd_data so that the file is only read once for DataSource and Worker
         :param c0: the initial c0 parameter for all the workers
         :param d0: the initial d0 parameter for all the workers
+        :param data_path: the directory of the file, default is loader.DATA_PATH
         """
-        self._path = "D:\\task allocation\\noisy-oracle-master\\noisy-oracle-master\\data\\all_collected_data\\"
-        self._filepath = self._path + filename
+        if isinstance(filename, CrowdData):
+            self._data = filename
+        else:
+            self._data = load_crowd_data(filename, data_path)
         # initialize the parameters of the workers prior distributions, generally c0 = 4, d0 = 1
         self._c0 = c0
         self._d0 = d0
         # the list that contains all the worker ids
         self._workers_id = []
-        # the dict that contains all the workers prior distribution parameters. The key is worker id,
-        # the value is the corresponding c-i and d-i
-        self._workers_prior = {}
+        # the PosteriorStore that contains all the workers prior distribution parameters, and the view over it
+        # whose key is worker id and value the corresponding c-i and d-i
+        self._workers_store = None
+        self._workers_prior = None
         # read the workers and initialize the workers prior distribution parameters
         self._initialize_worker_prior()
 
@@ -36,10 +42,9 @@ class Worker:
         Create the self._worker_id list and initialize the worker prior distribution parameters
         :return: None
         """
-        df = pd.read_csv(self._filepath, sep='	')
-        self._workers_id = df['!amt_worker_ids'].unique().tolist()
-        for worker_id in self._workers_id:
-            self._workers_prior[worker_id] = [self._c0, self._d0]
+        self._workers_store = PosteriorStore(self._data.get_worker_id_list(), self._c0, self._d0)
+        self._workers_id = self._workers_store.ids()
+        self._workers_prior = self._workers_store.view()
 
 
     def get_worker_id_list(self):
@@ -52,12 +57,19 @@ class Worker:
 
     def get_all_worker_prior(self):
         """
-        Return the worker prior distribution parameter dictionary
+        Return the worker prior distribution parameters, a read-only {worker id: [c, d]} mapping
         :return: self._workers_prior
         !!!Attention: simply return self._workers_prior means we get the real-time worker prior distribution dictionary!!!
         """
         return self._workers_prior
 
+    def get_posterior_store(self):
+        """
+        Return the PosteriorStore of the worker parameters, for snapshots and array access
+        :return: self._workers_store
+        """
+        return self._workers_store
+
     def get_worker_prior(self,worker_id):
         """
         Return the corresponding worker prior distribution parameters
@@ -66,6 +78,16 @@ class Worker:
         """
         return self._workers_prior[worker_id]
 
+    def add_worker(self, worker_id):
+        """
+        Add a worker that is not in the data file, with the initial prior Beta(c0, d0)
+        :param worker_id: worker ID
+        :return: None
+        """
+        if worker_id in self._workers_prior:
+            return
+        self._workers_store.add(worker_id)
+
     def update_parameter_c_d(self, wrk_id, a, b, c, d, z):
         """
         Update the worker prior distribution parameters using moment matching according to Appendix of the paper
@@ -80,19 +102,10 @@ class Worker:
         # for key_, value_ in worker.items():
         #     c = value_[0]
         #     d = value_[1]
-        if z == 1:
-            exp_rho = c * (a * (c + 1) + b * d) / ((c + d + 1) * (a * c + b * d))
-            exp_rho_square = c * (c + 1) * (a * (c + 2) + b * d) / ((c + d + 1) * (c + d + 2) * (a * c + b * d))
-        elif z == 0:
-            exp_rho = c * (b * (c + 1) + a * d)/((c + d + 1) * (b * c + a * d))
-            exp_rho_square = c * (c + 1) * (b * (c + 2) + a * d)/((c + d + 1) * (c + d + 2) * (b * c + a * d))
-        else:
-            raise ValueError
-        new_c = exp_rho * (exp_rho - exp_rho_square) / (exp_rho_square - np.square(exp_rho))
-        new_d = (1 - exp_rho) * (exp_rho - exp_rho_square) / (exp_rho_square - np.square(exp_rho))
+        new_c, new_d = posterior_cd(a, b, c, d, z)
 
         # for key_ in worker.keys():
-        self._workers_prior[wrk_id] = [new_c, new_d]
+        self._workers_store.set(wrk_id, new_c, new_d)
             # return self._workers_prior[key_]
 
 